@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Load time and checks of the run artifacts against the pickled afts.bin.
+
+Prepares the artifacts of a model trained on a synthetic series and
+saves them both as the pickled [ohe, schema, recent_prepared,
+recent_values] list of older runs and with run_artifacts. Times loading
+each in a fresh interpreter, imports included, as a new container does,
+and in this process. Checks that both give the same scorer rows, and
+that a tampered manifest or recent.npy and a schema or feature types
+that do not match the model are rejected. Exits non-zero when a check
+fails or when loading the artifacts takes more than --max-ratio of the
+unpickle path:
+
+    python benchmarks/bench_artifacts.py --repeat 5 --max-ratio 0.25
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+TRAINING = os.path.join(os.path.dirname(__file__), '..', 'src', 'training')
+PREDICTION = os.path.join(os.path.dirname(__file__), '..', 'src', 'prediction')
+sys.path.insert(0, TRAINING)
+sys.path.insert(0, PREDICTION)
+from xgboost import XGBRegressor
+import run_artifacts
+from data_preprocessing import preprocess, prepare_for_inference, WINDOW_SIZE
+from scoring import BoosterScorer
+from synthetic import demand_frame
+from timing import timings
+
+# Run by a fresh interpreter, with the artifacts directory as argument.
+LOAD_PICKLE = """
+import os, sys, time, pickle
+start = time.perf_counter()
+with open(os.path.join(sys.argv[1], 'afts.bin'), 'rb') as f_in:
+    artifacts = pickle.load(f_in)
+print(time.perf_counter() - start)
+"""
+LOAD_ARTIFACTS = """
+import sys, time
+start = time.perf_counter()
+import run_artifacts
+manifest = run_artifacts.read_manifest(sys.argv[1])
+recent = run_artifacts.load_recent(sys.argv[1], manifest)
+print(time.perf_counter() - start)
+"""
+
+
+def fresh(code, path, repeat):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([TRAINING, PREDICTION]))
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code, path], env=env,
+                                capture_output=True, text=True, check=True)
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return float(np.median(timings))
+
+
+def in_process(func, repeat):
+    return float(np.median(timings(func, repeat)[0]))
+
+
+def build(workdir, encoding):
+    """
+    Train a small model and write its artifacts in both formats.
+    """
+    df = demand_frame(3653)
+    df_processed, ohe = preprocess(df, encoding=encoding)
+    X = df_processed.drop(columns=['value'])
+    schema = X.columns.tolist()
+    model_params = {'enable_categorical': True, 'tree_method': 'hist'} \
+        if encoding == 'native' else {}
+    model = XGBRegressor(n_estimators=50, max_depth=4, **model_params)
+    model.fit(X, df_processed['value'])
+
+    recent_prepared = prepare_for_inference(
+        df=df.iloc[[-1]].reset_index(drop=True),
+        last_day_rolling_vals=df_processed[['rolling_mean', 'rolling_std']].iloc[-1].to_numpy(),
+        ohe=ohe,
+        schema=schema,
+        encoding=encoding
+    )
+    recent_values = {
+        'period': df['period'].iloc[-1].strftime('%Y-%m-%d'),
+        'window': df_processed['value'].to_numpy()[-WINDOW_SIZE:].tolist(),
+    }
+
+    legacy_path = os.path.join(workdir, 'legacy')
+    os.makedirs(legacy_path)
+    with open(os.path.join(legacy_path, 'afts.bin'), 'wb') as f_out:
+        pickle.dump([ohe, schema, recent_prepared, recent_values], f_out)
+    path = os.path.join(workdir, 'artifacts')
+    run_artifacts.save_artifacts(path, ohe=ohe, schema=schema,
+                                 recent_prepared=recent_prepared,
+                                 recent_values=recent_values, encoding=encoding)
+    return model, legacy_path, path
+
+
+def rejects(func, *args):
+    try:
+        func(*args)
+    except ValueError:
+        return True
+    return False
+
+
+def check(model, legacy_path, path, workdir):
+    """
+    Compare the rows of both formats and tamper with copies of the
+    artifacts.
+    """
+    failed = False
+    with open(os.path.join(legacy_path, 'afts.bin'), 'rb') as f_in:
+        ohe, schema, recent_prepared, recent_values = pickle.load(f_in)
+    scorer = BoosterScorer.from_model(model, schema)
+    scorer.check_frame(recent_prepared)
+
+    manifest = run_artifacts.read_manifest(path)
+    run_artifacts.verify_files(path, manifest)
+    recent = run_artifacts.load_recent(path, manifest)
+    scorer.check_types(manifest['feature_types'])
+    if not np.array_equal(recent, scorer.rows(recent_prepared), equal_nan=True) \
+            or manifest['recent_values'] != recent_values \
+            or manifest['schema'] != schema:
+        print("Artifacts differ from the pickled ones")
+        failed = True
+
+    tampered = os.path.join(workdir, 'tampered')
+    shutil.copytree(path, tampered)
+    with open(os.path.join(tampered, run_artifacts.MANIFEST)) as f_in:
+        edited = json.load(f_in)
+    edited['recent_values']['period'] = '1999-01-01'
+    with open(os.path.join(tampered, run_artifacts.MANIFEST), 'w') as f_out:
+        json.dump(edited, f_out)
+    if not rejects(run_artifacts.read_manifest, tampered):
+        print("An edited manifest was accepted")
+        failed = True
+
+    shutil.copy(os.path.join(path, run_artifacts.MANIFEST), tampered)
+    np.save(os.path.join(tampered, run_artifacts.RECENT), recent + 1)
+    if not rejects(run_artifacts.verify_files, tampered, manifest):
+        print("An edited recent.npy was accepted")
+        failed = True
+
+    if not rejects(BoosterScorer.from_model, model, schema[::-1]):
+        print("A schema in another order was accepted")
+        failed = True
+    flipped = ['float' if t == 'c' else 'c' for t in manifest['feature_types']]
+    if not rejects(scorer.check_types, flipped):
+        print("Feature types that do not match the model were accepted")
+        failed = True
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--encoding', default='native')
+    parser.add_argument('--max-ratio', type=float, default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-artifacts-')
+    try:
+        model, legacy_path, path = build(workdir, args.encoding)
+        failed = check(model, legacy_path, path, workdir)
+
+        def unpickle():
+            with open(os.path.join(legacy_path, 'afts.bin'), 'rb') as f_in:
+                pickle.load(f_in)
+
+        def load():
+            manifest = run_artifacts.read_manifest(path)
+            run_artifacts.load_recent(path, manifest)
+
+        cold = (fresh(LOAD_PICKLE, legacy_path, args.repeat),
+                fresh(LOAD_ARTIFACTS, path, args.repeat))
+        warm = (in_process(unpickle, args.repeat * 20),
+                in_process(load, args.repeat * 20))
+        for name, (legacy, new) in (('fresh process', cold), ('in process', warm)):
+            print(f"{name:>13}: afts.bin {legacy * 1e3:8.2f} ms  "
+                  f"artifacts {new * 1e3:8.2f} ms  ({new / legacy:.3f}x)")
+
+        ratio = cold[1] / cold[0]
+        if args.max_ratio is not None and ratio > args.max_ratio:
+            print(f"Loading takes more than {args.max_ratio} of the unpickle path")
+            failed = True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compare the shared-matrix cross-validation of train.train with the
+per-fold XGBRegressor.fit loop it replaced.
+
+Runs --trials trainings of the same parameters, as a tuning study would,
+and reports time and average test MAE of both. Exits non-zero when the
+MAE differs by more than --mae-tolerance (relative) or the speedup falls
+below --min-speedup:
+
+    python benchmarks/bench_cv.py --rows 50000 --trials 5 --fold-workers 3
+"""
+import os
+import sys
+import time
+import argparse
+
+from omegaconf import OmegaConf
+from xgboost import XGBRegressor
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.metrics import mean_absolute_error
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+import train
+from data_preprocessing import preprocess
+from synthetic import demand_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+
+def fit_reference(model, X, y, n_splits):
+    """
+    Per-fold copies and DMatrix construction, as train.train used to do.
+    """
+    mae_test_hist = []
+    for train_index, test_index in TimeSeriesSplit(n_splits=n_splits).split(X):
+        X_train, X_test = X.iloc[train_index], X.iloc[test_index]
+        y_train, y_test = y.iloc[train_index], y.iloc[test_index]
+        model.fit(X_train, y_train, eval_set=[(X_test, y_test)], verbose=False)
+        mae_test_hist.append(mean_absolute_error(y_test, model.predict(X_test)))
+    return sum(mae_test_hist) / len(mae_test_hist)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--trials', type=int, default=3)
+    parser.add_argument('--fold-workers', type=int, default=1)
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--mae-tolerance', type=float, default=0.05)
+    parser.add_argument('--min-speedup', type=float, default=1.0)
+    args = parser.parse_args()
+
+    config = OmegaConf.load(CONFIG_PATH)
+    config.training.FOLD_WORKERS = args.fold_workers
+    n_splits = config.training.N_SPLITS
+
+    df_processed, _ = preprocess(
+        demand_frame(args.rows, timezones=('Eastern',)), encoding=config.training.ENCODING
+    )
+    X = df_processed.drop(columns=['value'])
+    y = df_processed.value
+
+    def make_model():
+        return XGBRegressor(
+            n_estimators=300, max_depth=6, learning_rate=0.1,
+            early_stopping_rounds=config.hyperparameters.sample_space.EARLY_STOPPING_ROUNDS,
+            random_state=config.hyperparameters.SEED,
+            n_jobs=args.n_jobs,
+            enable_categorical=True, tree_method='hist'
+        )
+
+    start = time.perf_counter()
+    for _ in range(args.trials):
+        ref_mae = fit_reference(make_model(), X, y, n_splits)
+    ref_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    folds = train.FoldData(X, y, n_splits)
+    for _ in range(args.trials):
+        _, new_mae = train.train(config, make_model(), X, y, n_splits, folds=folds)
+    new_time = time.perf_counter() - start
+
+    speedup = ref_time / new_time
+    print(f"{len(X)} rows, {n_splits} folds, {args.trials} trials, "
+          f"{args.fold_workers} fold workers")
+    print(f"  per-fold fit  {ref_time:7.2f} s  test MAE {ref_mae:9.2f}")
+    print(f"  shared folds  {new_time:7.2f} s  test MAE {new_mae:9.2f}")
+    print(f"  speedup {speedup:5.2f}x")
+
+    failed = False
+    if abs(new_mae - ref_mae) > args.mae_tolerance * ref_mae:
+        print(f"Test MAE differs by more than {args.mae_tolerance:.0%}")
+        failed = True
+    if speedup < args.min_speedup:
+        print(f"Speedup below {args.min_speedup}x")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
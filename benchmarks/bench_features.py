@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Micro-benchmark of extract_features against the pandas accessor version.
+
+Times a 10-year daily series and an hourly-sized one (the same number of
+rows as 10 years of hourly data), checks that the calendar features
+match the pandas reference and exits non-zero when the speedup falls
+below --min-speedup:
+
+    python benchmarks/bench_features.py --min-speedup 2
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+from data_preprocessing import extract_features
+from synthetic import demand_frame
+from timing import best_of
+
+CALENDAR = ['year', 'month', 'day', 'day_of_week', 'quarter',
+            'week_of_year', 'is_weekend']
+
+
+def pandas_reference(df, window_size=7):
+    """
+    Calendar and rolling features computed with pandas accessors.
+    """
+    df = df.copy()
+    df['period'] = df['period'].astype('datetime64[ns]')
+    df['timezone'] = df['timezone'].astype('category')
+    df['value'] = df['value'].astype('int64')
+
+    df['year'] = df['period'].dt.year.astype('int16')
+    df['month'] = df['period'].dt.month.astype('int16')
+    df['day'] = df['period'].dt.day.astype('int16')
+    df['day_of_week'] = df['period'].dt.weekday.astype('int8')
+    df['quarter'] = df['period'].dt.quarter.astype('int8')
+    df['week_of_year'] = df['period'].dt.isocalendar().week.astype('int16')
+    df['is_weekend'] = (df['period'].dt.weekday >= 5).astype('int8')
+
+    df['rolling_mean'] = df['value'].rolling(window=window_size).mean()
+    df['rolling_std'] = df['value'].rolling(window=window_size).std()
+    return df.dropna().copy().reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-speedup', type=float, default=1.0)
+    args = parser.parse_args()
+
+    failed = False
+    for name, df in (('daily-10y', demand_frame(3653, timezones=('Eastern',))),
+                     ('hourly-10y', demand_frame(87660, hourly=True))):
+        n_rows = len(df)
+        new_time, new = best_of(extract_features, args.repeat, df)
+        ref_time, ref = best_of(pandas_reference, args.repeat, df)
+
+        for column in CALENDAR + ['rolling_mean', 'rolling_std']:
+            np.testing.assert_allclose(
+                new[column].to_numpy(dtype='float64'),
+                ref[column].to_numpy(dtype='float64'),
+                rtol=1e-6, err_msg=column
+            )
+
+        speedup = ref_time / new_time
+        print(f"{name:>11}: {n_rows:7d} rows  "
+              f"vectorized {new_time * 1e3:8.2f} ms  "
+              f"pandas {ref_time * 1e3:8.2f} ms  "
+              f"speedup {speedup:5.1f}x")
+        if speedup < args.min_speedup:
+            print(f"{name}: speedup below {args.min_speedup}x")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Memory and time of the hourly feature pipeline.
+
+Preprocesses --years of synthetic hourly data for --subbas subbas, one at
+a time as the training workers do, with the hourly window, lags and
+lagged windows of the config. Reports the time, the peak traced
+allocation of one subba and the size of the feature frames against the
+same frames in int64/float64. Checks every lag against a pandas reindex
+on the hour grid, and exits non-zero on a mismatch or when all feature
+frames take more than --max-mb:
+
+    python benchmarks/bench_hourly.py --years 5 --subbas 10 --max-mb 200
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from omegaconf import OmegaConf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+from data_preprocessing import preprocess, lag_name
+from synthetic import demand_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+
+def wide_bytes(df):
+    """
+    Bytes of `df` with every numeric column widened to 64 bits.
+    """
+    total = 0
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            total += df[column].memory_usage(index=False, deep=True)
+        else:
+            total += 8 * len(df)
+    return total
+
+
+def check_lags(raw, df_processed, lags, window_size):
+    """
+    Compare the lag columns with the value `lag` hours earlier among the
+    rows that keep a full rolling window.
+    """
+    period = raw['period'].to_numpy()[window_size - 1:]
+    value = pd.Series(raw['value'].to_numpy()[window_size - 1:], index=period)
+    grid = value.reindex(pd.date_range(period[0], period[-1], freq='h'))
+
+    kept = np.ones(len(period), dtype=bool)
+    expected = {}
+    for lag in lags:
+        shifted = grid.shift(lag).reindex(period).to_numpy()
+        kept &= ~np.isnan(shifted)
+        expected[lag] = shifted
+    for lag in lags:
+        if not np.array_equal(df_processed[lag_name(lag)].to_numpy(dtype='float64'),
+                              expected[lag][kept]):
+            print(f"{lag_name(lag)} does not match the hour grid")
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--subbas', type=int, default=10)
+    parser.add_argument('--max-mb', type=float, default=None)
+    args = parser.parse_args()
+
+    params = OmegaConf.load(CONFIG_PATH).features.hourly
+    lags = tuple(params.LAGS)
+    n_rows = args.years * 8766
+
+    failed = False
+    total_bytes = total_wide = 0
+    elapsed = peak = 0.0
+    for seed in range(args.subbas):
+        # No outliers, so that the reindex reference sees the same rows.
+        raw = demand_frame(n_rows, hourly=True, seed=seed, outliers=0)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        df_processed, _ = preprocess(
+            raw, bounds=(-np.inf, np.inf), encoding='native',
+            window_size=params.WINDOW_SIZE, lags=lags,
+            rolling=tuple(tuple(pair) for pair in params.ROLLING), hourly=True
+        )
+        elapsed += time.perf_counter() - start
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        total_bytes += df_processed.memory_usage(index=False, deep=True).sum()
+        total_wide += wide_bytes(df_processed)
+        if seed == 0:
+            failed |= not check_lags(raw, df_processed, lags, params.WINDOW_SIZE)
+
+    mb = total_bytes / 2**20
+    print(f"{args.subbas} subbas x {n_rows} hourly rows: "
+          f"{elapsed:.2f} s, peak {peak / 2**20:.1f} MB per subba")
+    print(f"feature frames {mb:.1f} MB, "
+          f"{total_wide / 2**20:.1f} MB in int64/float64 "
+          f"({total_wide / total_bytes:.1f}x)")
+    if args.max_mb is not None and mb > args.max_mb:
+        print(f"Feature frames above {args.max_mb} MB")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Overhead of the stage instrumentation, disabled and enabled.
+
+Times --calls empty stages through the context manager and the decorator
+with the instrumentation disabled and enabled, against a bare call.
+Checks that an enabled stage logs one JSON line with its wall and CPU
+time, peak RSS and rows, that log_metrics names the metrics after the
+stages, and that a profile is dumped per outermost stage when a
+PROFILE_DIR is set. Exits non-zero when a check fails, or when a
+disabled stage costs more than --max-disabled-us microseconds:
+
+    python benchmarks/bench_instrumentation.py --calls 100000 --max-disabled-us 1
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+from omegaconf import OmegaConf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+import instrumentation
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+
+class RecordingClient(object):
+    """
+    Stands in for MlflowClient, keeping the batches it is given.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def log_batch(self, run_id, metrics=()):
+        self.metrics.extend(metrics)
+
+
+def configure(enabled, profile_dir=None):
+    config = OmegaConf.load(CONFIG_PATH)
+    config.instrumentation.ENABLED = enabled
+    config.instrumentation.PROFILE_DIR = profile_dir
+    instrumentation.configure(config)
+
+
+def per_call_us(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def overhead(calls):
+    """
+    Microseconds per call of an empty stage and of a decorated no-op.
+    """
+    def bare():
+        pass
+
+    @instrumentation.timed('decorated')
+    def decorated():
+        pass
+
+    def managed():
+        with instrumentation.stage('managed'):
+            pass
+
+    # Enabled stages print; the lines themselves are not timed.
+    with contextlib.redirect_stdout(io.StringIO()):
+        base = per_call_us(bare, calls)
+        return (per_call_us(managed, calls) - base,
+                per_call_us(decorated, calls) - base)
+
+
+def check_records(workdir):
+    """
+    Run nested stages with profiling on, and check what they leave.
+    """
+    failed = False
+    profile_dir = os.path.join(workdir, 'profiles')
+    configure(True, profile_dir)
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        with instrumentation.stage('outer', subba='ZONJ') as stage:
+            with instrumentation.stage('inner', rows=10):
+                sum(range(10 ** 6))
+            stage.set(rows=20)
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    if [line['stage'] for line in lines] != ['inner', 'outer']:
+        print("Unexpected stage lines:", lines)
+        return True
+    for line in lines:
+        missing = {'wall_s', 'cpu_s', 'peak_rss_mb', 'peak_rss_growth_mb',
+                   'rows', 'status'} - line.keys()
+        if missing:
+            print(f"{line['stage']} misses {sorted(missing)}")
+            failed = True
+    if lines[1]['rows'] != 20 or lines[1]['subba'] != 'ZONJ':
+        print("Fields set on the stage are not logged:", lines[1])
+        failed = True
+    if lines[1]['wall_s'] < lines[0]['wall_s']:
+        print("The outer stage is shorter than the inner one")
+        failed = True
+
+    profiles = os.listdir(profile_dir)
+    if len(profiles) != 1 or not profiles[0].startswith('outer-'):
+        print("Expected one profile of the outer stage:", profiles)
+        failed = True
+
+    client = RecordingClient()
+    instrumentation.log_metrics('run', client=client)
+    names = {metric.key for metric in client.metrics}
+    expected = {'stage.inner.wall_s', 'stage.outer.cpu_s', 'stage.outer.rows'}
+    if not expected <= names:
+        print("Missing metrics:", sorted(expected - names))
+        failed = True
+
+    configure(False)
+    with contextlib.redirect_stdout(output):
+        with instrumentation.stage('disabled'):
+            pass
+    if instrumentation.records():
+        print("A disabled stage was recorded")
+        failed = True
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--max-disabled-us', type=float, default=None)
+    args = parser.parse_args()
+
+    failed = check_records(tempfile.mkdtemp(prefix='bench-instrumentation-'))
+
+    for enabled in (False, True):
+        configure(enabled)
+        managed, decorated = overhead(args.calls)
+        print(f"{'enabled' if enabled else 'disabled':>8}: "
+              f"stage {managed:6.2f} us  decorator {decorated:6.2f} us per call")
+        if not enabled:
+            disabled = max(managed, decorated)
+
+    if args.max_disabled_us is not None and disabled > args.max_disabled_us:
+        print(f"Disabled stages cost more than {args.max_disabled_us} us")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
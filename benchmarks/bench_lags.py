@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Time and peak memory of transform_to_supervised as the lag count grows.
+
+For 1 up to --max-lags lags, each with a lagged rolling window, builds
+the features of a synthetic 10-year hourly series with
+transform_to_supervised and with a pandas reference that adds one
+shifted and one rolled column per feature. Checks that both agree, and
+reports the time and the peak traced allocation beyond the size of the
+result. Exits non-zero on a mismatch, or when that temporary memory
+grows more than --max-growth times from the fewest to the most lags:
+
+    python benchmarks/bench_lags.py --max-lags 64 --max-growth 2
+"""
+import os
+import sys
+import time
+import argparse
+import warnings
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+from data_preprocessing import extract_features, transform_to_supervised, lag_name
+from synthetic import demand_frame
+
+
+def pandas_reference(df, lags, rolling):
+    """
+    Lag features with one shift and one rolling pass per feature.
+    """
+    # The fragmentation pandas warns about is what is being measured.
+    warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+    df = df.copy()
+    for lag in lags:
+        df.loc[:, lag_name(lag)] = df['value'].shift(lag)
+    for lag, window in rolling:
+        shifted = df['value'].astype('float64').shift(lag)
+        df.loc[:, f'rolling_mean_{lag}_{window}'] = shifted.rolling(window).mean()
+        df.loc[:, f'rolling_std_{lag}_{window}'] = shifted.rolling(window).std()
+    df.dropna(inplace=True)
+    return df.drop(columns=['period'])
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = result.memory_usage(index=True, deep=True).sum()
+    return result, elapsed, max(peak - size, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=87660)
+    parser.add_argument('--max-lags', type=int, default=64)
+    parser.add_argument('--max-growth', type=float, default=None)
+    args = parser.parse_args()
+
+    df = extract_features(demand_frame(args.rows, hourly=True), window_size=24, hourly=True)
+    failed = False
+    temporary = []
+    n_lags = 1
+    while n_lags <= args.max_lags:
+        lags = tuple(range(1, 24 * n_lags, 24))
+        rolling = tuple((lag, 24) for lag in lags)
+
+        new, new_time, new_temp = measure(
+            transform_to_supervised, df, lags, rolling, 'h'
+        )
+        ref, ref_time, ref_temp = measure(pandas_reference, df, lags, rolling)
+        temporary.append(new_temp)
+
+        if len(new) != len(ref) or not np.allclose(
+                new.drop(columns='timezone').to_numpy(dtype='float64'),
+                ref.drop(columns='timezone').to_numpy(dtype='float64'),
+                rtol=1e-6):
+            print(f"{n_lags} lags: features differ from the pandas reference")
+            failed = True
+
+        print(f"{n_lags:3d} lags: builder {new_time * 1e3:8.1f} ms "
+              f"{new_temp / 2**20:7.1f} MB temporary  "
+              f"pandas {ref_time * 1e3:8.1f} ms {ref_temp / 2**20:7.1f} MB")
+        n_lags *= 2
+
+    growth = temporary[-1] / temporary[0]
+    print(f"temporary memory growth {growth:.2f}x")
+    if args.max_growth is not None and growth > args.max_growth:
+        print(f"Temporary memory grows more than {args.max_growth}x")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
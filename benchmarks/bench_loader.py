@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compare rows per second of the execute_values and COPY loaders.
+
+Runs against the Postgres described by the DB_* environment variables
+and uses a scratch table, so the real demand table is left alone:
+
+    python benchmarks/bench_loader.py --rows 200000 --chunk 5000
+"""
+import os
+import sys
+import time
+import argparse
+
+from omegaconf import OmegaConf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+from db_store import DatabaseHandler
+from synthetic import demand_frame, api_rows
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+SCHEMA = "period, subba, subba_name, parent, parent_name, timezone, value, value_units"
+TIMEZONES = ['Eastern', 'Central', 'Mountain', 'Pacific', 'Arizona']
+
+
+def synthetic_rows(n_rows, subba='ZONJ'):
+    # API rows as tuples in SCHEMA order, as db_store.ingest stores them.
+    df = demand_frame(-(-n_rows // len(TIMEZONES)), timezones=TIMEZONES)
+    return [tuple(row.values()) for row in api_rows(df, subba)][:n_rows]
+
+
+def run(db_handler, loader, tab_name, tab_schema, rows, chunk):
+    db_handler.create_table(tab_name, tab_schema, rebuild=True)
+    load = getattr(db_handler, loader)
+
+    start = time.perf_counter()
+    for i in range(0, len(rows), chunk):
+        load(data=rows[i:i + chunk], schema=SCHEMA, tab_name=tab_name)
+    elapsed = time.perf_counter() - start
+    return len(rows) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk', type=int, default=5000)
+    parser.add_argument('--table', default='demand_bench')
+    args = parser.parse_args()
+
+    config = OmegaConf.load(CONFIG_PATH)
+    tab_schema = config.data.tab_params.tab_schema.demand.replace(
+        'demand', args.table)
+
+    db_handler = DatabaseHandler(config)
+    db_handler.connect()
+
+    rows = synthetic_rows(args.rows)
+    for loader in ('insert', 'copy_insert'):
+        rate = run(db_handler, loader, args.table, tab_schema, rows, args.chunk)
+        print(f"{loader:>12}: {rate:12,.0f} rows/s")
+
+    cur = db_handler.conn.cursor()
+    cur.execute(f"DROP TABLE {args.table};")
+    db_handler.conn.commit()
+    cur.close()
+    db_handler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Champion selection and registry lookups against a growing experiment.
+
+Fills a local SQLite tracking store with runs of several subbas spread
+over a few years, registering every --register-every-th run of the
+benchmarked subba, and keeps the number of recent runs fixed. At every
+size in --sizes, times the old experiment-wide search_best and the scan
+over search_model_versions against register_model.search_best with its
+search_days window, and registered_version with a filtered query and
+with a warm RegistryIndex. Both paths must pick the same champion and
+version. Exits non-zero on a mismatch, or when the windowed path slows
+down more than --max-growth times from the smallest to the largest size:
+
+    python benchmarks/bench_registry.py --sizes 1000 4000 --max-growth 2
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from omegaconf import OmegaConf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+from timing import best_of
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+SUBBAS = ('ZONJ', 'ZONA', 'ZONB', 'ZONC')
+
+
+def legacy_search_best(config, subba):
+    """
+    Champion search as search_best used to run it.
+    """
+    import mlflow
+    from mlflow import MlflowClient
+    from mlflow.entities import ViewType
+
+    experiment = mlflow.get_experiment_by_name(config.mlflow.experiment_name)
+    return MlflowClient().search_runs(
+        experiment_ids=experiment.experiment_id,
+        filter_string=f"tags.subba = '{subba}'",
+        run_view_type=ViewType.ACTIVE_ONLY,
+        max_results=1,
+        order_by=["metrics.mae_test ASC"],
+    )[0]
+
+
+def legacy_registered_version(model_name, run_id):
+    """
+    Version lookup as check_if_registered used to run it.
+    """
+    from mlflow import MlflowClient
+
+    for mv in MlflowClient().search_model_versions(f"name='{model_name}'"):
+        if dict(mv)['run_id'] == run_id:
+            return mv.version
+    return None
+
+
+def legacy_path(config, subba, model_name):
+    run = legacy_search_best(config, subba)
+    return run, legacy_registered_version(model_name, run.info.run_id)
+
+
+def windowed_path(config, subba, model_name, index=None):
+    import register_model
+
+    # Prefect tasks keep the plain function as .fn.
+    search_best = getattr(register_model.search_best, 'fn', register_model.search_best)
+    run = search_best(config, subba)
+    return run, register_model.registered_version(model_name, run.info.run_id, index)
+
+
+def add_runs(client, experiment_id, model_name, n_runs, first, args, rng):
+    """
+    Log `n_runs` finished runs started more than search_days ago.
+    """
+    from mlflow.entities import Metric
+
+    now = int(time.time() * 1000)
+    oldest = now - 3 * 365 * 86400 * 1000
+    for i in range(first, first + n_runs):
+        subba = SUBBAS[i % len(SUBBAS)]
+        start_time = int(rng.integers(oldest, now - 365 * 86400 * 1000))
+        run = client.create_run(experiment_id, start_time=start_time,
+                                tags={'subba': subba})
+        run_id = run.info.run_id
+        client.log_batch(run_id, metrics=[
+            # Old runs are worse than the recent ones.
+            Metric('mae_test', float(rng.uniform(400, 600)), start_time, 0)
+        ])
+        client.set_terminated(run_id, end_time=start_time + 60000)
+        if subba == SUBBAS[0] and i % args.register_every == 0:
+            client.create_model_version(
+                model_name, f"runs:/{run_id}/xgb_best", run_id=run_id
+            )
+
+
+def add_recent_runs(client, experiment_id, model_name, n_runs, rng):
+    """
+    Log and register `n_runs` better runs of the last days, the newest
+    one in Production.
+    """
+    from mlflow.entities import Metric
+
+    now = int(time.time() * 1000)
+    for i in range(n_runs):
+        run = client.create_run(experiment_id, start_time=now - i * 3600000,
+                                tags={'subba': SUBBAS[0]})
+        client.log_batch(run.info.run_id, metrics=[
+            Metric('mae_test', float(rng.uniform(300, 400)), now, 0)
+        ])
+        client.set_terminated(run.info.run_id)
+        version = client.create_model_version(
+            model_name, f"runs:/{run.info.run_id}/xgb_best",
+            run_id=run.info.run_id
+        )
+    client.transition_model_version_stage(
+        model_name, version.version, 'Production'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 4000])
+    parser.add_argument('--recent', type=int, default=20)
+    parser.add_argument('--register-every', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-growth', type=float, default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-registry-')
+    os.environ['MLFLOW_TRACKING_URI'] = 'sqlite:///' + os.path.join(workdir, 'mlflow.db')
+    # Interpolated by the config even though a local store is used.
+    for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST',
+                 'DB_PORT', 'API_KEY', 'S3_BUCKET_NAME'):
+        os.environ.setdefault(name, 'unused')
+
+    import mlflow
+    from mlflow import MlflowClient
+    import register_model
+
+    config = OmegaConf.load(CONFIG_PATH)
+    config.mlflow.registry_index = os.path.join(workdir, 'registry_index')
+    subba = SUBBAS[0]
+    model_name = register_model.registered_model_name(config, subba)
+
+    mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_URI'])
+    client = MlflowClient()
+    experiment_id = client.create_experiment(
+        config.mlflow.experiment_name,
+        artifact_location='file://' + os.path.join(workdir, 'artifacts')
+    )
+    client.create_registered_model(model_name)
+
+    rng = np.random.default_rng(0)
+    add_recent_runs(client, experiment_id, model_name, args.recent, rng)
+    logged = 0
+    failed = False
+    windowed_times = []
+    for size in args.sizes:
+        start = time.perf_counter()
+        add_runs(client, experiment_id, model_name, size - logged, logged, args, rng)
+        print(f"logged {size - logged} runs in {time.perf_counter() - start:.1f} s")
+        logged = size
+
+        legacy_time, legacy = best_of(
+            legacy_path, args.repeat, config, subba, model_name
+        )
+        filtered_time, filtered = best_of(
+            windowed_path, args.repeat, config, subba, model_name
+        )
+        index = register_model.RegistryIndex(config.mlflow.registry_index, model_name)
+        indexed_time, indexed = best_of(
+            windowed_path, args.repeat, config, subba, model_name, index
+        )
+        windowed_times.append(indexed_time)
+
+        picks = {(run.info.run_id, str(version))
+                 for run, version in (legacy, filtered, indexed)}
+        if len(picks) != 1:
+            print(f"{size} runs: the paths disagree: {picks}")
+            failed = True
+
+        print(f"{size + args.recent:6d} runs: "
+              f"experiment-wide {legacy_time * 1e3:8.1f} ms  "
+              f"windowed + filtered {filtered_time * 1e3:7.1f} ms  "
+              f"windowed + index {indexed_time * 1e3:7.1f} ms")
+
+    growth = windowed_times[-1] / windowed_times[0]
+    print(f"windowed path growth {growth:.2f}x")
+    if args.max_growth is not None and growth > args.max_growth:
+        print(f"Windowed path slows down more than {args.max_growth}x")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Latency and parity of BoosterScorer against the MLflow pyfunc model.
+
+Trains a model on a synthetic series in every --encodings encoding,
+saves it in MLflow format as training logs it, and loads it back both as
+a pyfunc model and as a BoosterScorer. Times a single row, as
+app.predict scores the prepared recent day, and a --batch-row batch,
+from a DataFrame and from float32 rows converted ahead. Exits non-zero
+when the predictions differ by more than --rtol, or when the scorer is
+less than --min-speedup times faster than pyfunc on either size:
+
+    python benchmarks/bench_scoring.py --batch 10000 --min-speedup 1.2
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'prediction'))
+from xgboost import XGBRegressor
+from data_preprocessing import preprocess
+from scoring import BoosterScorer
+from synthetic import demand_frame
+from timing import best_of
+
+
+def load_both(model, workdir, encoding):
+    """
+    Save `model` as tracking.RunLogger does and load it back both ways.
+    """
+    import mlflow.pyfunc
+    import mlflow.xgboost
+
+    path = os.path.join(workdir, encoding)
+    mlflow.xgboost.save_model(model, path)
+    pyfunc = mlflow.pyfunc.load_model(path)
+    return pyfunc, mlflow.xgboost.load_model(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--encodings', nargs='+', default=['native', 'onehot'])
+    parser.add_argument('--rtol', type=float, default=1e-6)
+    parser.add_argument('--min-speedup', type=float, default=None)
+    args = parser.parse_args()
+
+    df = demand_frame(max(args.batch // 2 + 400, 3653))
+    workdir = tempfile.mkdtemp(prefix='bench-scoring-')
+    failed = False
+    for encoding in args.encodings:
+        df_processed, _ = preprocess(df, encoding=encoding)
+        X = df_processed.drop(columns=['value']).iloc[-args.batch:].reset_index(drop=True)
+        y = df_processed['value'].iloc[-args.batch:]
+
+        model_params = {'enable_categorical': True, 'tree_method': 'hist'} \
+            if encoding == 'native' else {}
+        # Early stopping, so that both paths must stop at the best iteration.
+        model = XGBRegressor(n_estimators=300, max_depth=6,
+                             early_stopping_rounds=20, **model_params)
+        split = len(X) * 4 // 5
+        model.fit(X.iloc[:split], y.iloc[:split],
+                  eval_set=[(X.iloc[split:], y.iloc[split:])], verbose=False)
+
+        pyfunc, loaded = load_both(model, workdir, encoding)
+        scorer = BoosterScorer.from_model(loaded, X.columns.tolist())
+        scorer.check_frame(X)
+        single = X.iloc[[-1]]
+        single_rows = scorer.rows(single).copy()
+        batch_rows = scorer.rows(X).copy()
+
+        timings = {}
+        for size, frame, rows, repeat in (
+                ('single', single, single_rows, args.repeat),
+                ('batch', X, batch_rows, max(1, args.repeat // 20))):
+            pyfunc_time, expected = best_of(pyfunc.predict, repeat, frame)
+            frame_time, from_frame = best_of(scorer.predict_frame, repeat, frame)
+            rows_time, from_rows = best_of(scorer.predict, repeat, rows)
+            timings[size] = pyfunc_time / rows_time
+
+            for name, values in (('frame', from_frame), ('rows', from_rows)):
+                if not np.allclose(values, np.asarray(expected), rtol=args.rtol):
+                    print(f"{encoding} {size}: scorer {name} predictions differ "
+                          f"from pyfunc")
+                    failed = True
+            print(f"{encoding:>6} {size:>6} ({len(frame):5d} rows): "
+                  f"pyfunc {pyfunc_time * 1e3:8.3f} ms  "
+                  f"scorer frame {frame_time * 1e3:8.3f} ms  "
+                  f"rows {rows_time * 1e3:8.3f} ms  "
+                  f"({timings[size]:.1f}x)")
+
+        if args.min_speedup is not None and min(timings.values()) < args.min_speedup:
+            print(f"{encoding}: scorer less than {args.min_speedup}x faster")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compare cold-start time of the MLflow handler and the lean bundle handler.
+
+Trains a small model on a synthetic series, registers it in Production in
+a local file MLflow store and exports its inference bundle. Every handler
+is then started in a fresh interpreter, which reports the import time of
+the module and the time of the first prediction:
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+from omegaconf import OmegaConf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+from xgboost import XGBRegressor
+from data_preprocessing import preprocess, prepare_for_inference, WINDOW_SIZE
+from run_artifacts import save_artifacts
+from synthetic import demand_frame
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+CONFIG_PATH = os.path.join(ROOT, 'src', 'conf', 'config.yaml')
+SUBBA = 'ZONJ'
+
+# Run inside the serving directory by a fresh interpreter.
+PROBE = """
+import json, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+result = {module}.lambda_handler(None, None)
+predicted = time.perf_counter()
+print(json.dumps({{
+    'import': imported - start,
+    'first_prediction': predicted - imported,
+    'result': result,
+}}))
+"""
+
+
+def build_model(config, workdir, encoding):
+    """
+    Register a model trained on synthetic data and export its bundle.
+
+    Returns:
+        tuple: Tracking URI of the file store and the bundle directory.
+    """
+    import mlflow
+    from mlflow import MlflowClient
+
+    df = demand_frame(3653, timezones=('Eastern',))
+    df_processed, ohe = preprocess(df, encoding=encoding)
+    X = df_processed.drop(columns=['value'])
+    y = df_processed.value
+    schema = X.columns.tolist()
+
+    model_params = {'enable_categorical': True, 'tree_method': 'hist'} \
+        if encoding == 'native' else {}
+    model = XGBRegressor(n_estimators=200, max_depth=6, **model_params)
+    model.fit(X, y)
+
+    recent_prepared = prepare_for_inference(
+        df=df.iloc[[-1]].reset_index(drop=True),
+        last_day_rolling_vals=df_processed[['rolling_mean', 'rolling_std']].iloc[-1].to_numpy(),
+        ohe=ohe,
+        schema=schema,
+        encoding=encoding
+    )
+
+    recent_values = {
+        'period': df['period'].iloc[-1].strftime('%Y-%m-%d'),
+        'window': df_processed['value'].to_numpy()[-WINDOW_SIZE:].tolist(),
+    }
+
+    artifacts_path = os.path.join(workdir, 'artifacts')
+    save_artifacts(artifacts_path, ohe=ohe, schema=schema,
+                   recent_prepared=recent_prepared,
+                   recent_values=recent_values, encoding=encoding)
+
+    tracking_uri = 'file://' + os.path.join(workdir, 'mlruns')
+    mlflow.set_tracking_uri(tracking_uri)
+    model_name = f"{config.mlflow.model_name}-{SUBBA}-reg"
+    with mlflow.start_run() as run:
+        mlflow.xgboost.log_model(model, artifact_path='models_mlflow')
+        mlflow.log_artifacts(artifacts_path)
+
+    client = MlflowClient()
+    version = mlflow.register_model(
+        f"runs:/{run.info.run_id}/models_mlflow", model_name
+    )
+    client.transition_model_version_stage(
+        model_name, version.version, stage='Production'
+    )
+
+    bundle_path = os.path.join(workdir, 'bundle')
+    save_artifacts(bundle_path, ohe=ohe, schema=schema,
+                   recent_prepared=recent_prepared,
+                   recent_values=recent_values, encoding=encoding, model=model)
+    return tracking_uri, bundle_path
+
+
+def serving_dir(workdir):
+    """
+    Lay out the handlers like the Lambda task root of the Dockerfile.
+    """
+    path = os.path.join(workdir, 'task')
+    os.makedirs(path)
+    for name in ('app.py', 'lean_app.py', 'scoring.py'):
+        shutil.copy(os.path.join(ROOT, 'src', 'prediction', name), path)
+    for name in ('calendar_features.py', 'instrumentation.py', 'run_artifacts.py'):
+        shutil.copy(os.path.join(ROOT, 'src', 'training', name), path)
+    shutil.copytree(os.path.join(ROOT, 'src', 'conf'), os.path.join(path, 'conf'))
+    return path
+
+
+def probe(module, task_root, env):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module)],
+        cwd=task_root, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    # Handlers may print; the measurements are on the last line.
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--encoding', default=None,
+                        help='Feature encoding, training.ENCODING by default.')
+    args = parser.parse_args()
+
+    config = OmegaConf.load(CONFIG_PATH)
+    encoding = args.encoding or config.training.ENCODING
+
+    workdir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        tracking_uri, bundle_path = build_model(config, workdir, encoding)
+        task_root = serving_dir(workdir)
+
+        env = dict(os.environ)
+        env.update({
+            'MLFLOW_TRACKING_URI': tracking_uri,
+            'SUBBA': SUBBA,
+            'BUNDLE_URI': bundle_path,
+            'MODEL_CACHE_DIR': os.path.join(workdir, 'model-cache'),
+        })
+        # Interpolated by the config even though a file store is used.
+        for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST',
+                     'DB_PORT', 'API_KEY', 'S3_BUCKET_NAME'):
+            env.setdefault(name, 'unused')
+
+        predictions = {}
+        for module in ('app', 'lean_app'):
+            runs = []
+            for _ in range(args.repeat):
+                # Every run starts without a downloaded model.
+                shutil.rmtree(env['MODEL_CACHE_DIR'], ignore_errors=True)
+                runs.append(probe(module, task_root, env))
+
+            result = runs[-1]['result']
+            if 'prediction' not in result:
+                print(f"{module}: {result}")
+                sys.exit(1)
+            predictions[module] = float(result['prediction'])
+
+            import_time = np.median([run['import'] for run in runs])
+            first_time = np.median([run['first_prediction'] for run in runs])
+            print(f"{module:>9}: import {import_time * 1e3:8.1f} ms  "
+                  f"first prediction {first_time * 1e3:8.1f} ms  "
+                  f"total {(import_time + first_time) * 1e3:8.1f} ms")
+
+        if not np.isclose(predictions['app'], predictions['lean_app'], rtol=1e-5):
+            print("Predictions differ:", predictions)
+            sys.exit(1)
+        print("Predictions match:", predictions['lean_app'])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Time the streaming preprocessing state against a batch recompute.
+
+Builds a PreprocessState on all but the last --new-days rows of a
+synthetic series, feeds it those rows one day at a time with a JSON
+round trip between days, as the feature cache does, and times it against
+filter_by_iqr -> extract_features -> transform_to_supervised over the
+whole series. With --hourly the series is hourly and the features use
+the hourly window, lags and lagged windows of the config. Equivalence of
+both paths is tested in tests/test_streaming_stats.py:
+
+    python benchmarks/bench_streaming.py --rows 87660 --new-days 30
+    python benchmarks/bench_streaming.py --hourly --rows 87660 --new-days 720
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+from omegaconf import OmegaConf
+from data_preprocessing import (
+    iqr_bounds,
+    filter_by_iqr,
+    extract_features,
+    transform_to_supervised,
+)
+from streaming_stats import PreprocessState
+from synthetic import demand_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=3653)
+    parser.add_argument('--new-days', type=int, default=30)
+    parser.add_argument('--hourly', action='store_true')
+    args = parser.parse_args()
+
+    config = OmegaConf.load(CONFIG_PATH)
+    params = config.features['hourly' if args.hourly else 'daily']
+    window_size, lags = params.WINDOW_SIZE, tuple(params.LAGS)
+    rolling = tuple(tuple(pair) for pair in params.ROLLING)
+
+    if args.hourly:
+        df = demand_frame(args.rows, hourly=True)
+    else:
+        df = demand_frame(args.rows, timezones=('Eastern',))
+    split = len(df) - args.new_days
+    bounds = iqr_bounds(df['value'])
+    state = PreprocessState.from_history(
+        df.iloc[:split], bounds=bounds, window_size=window_size,
+        lags=lags, rolling=rolling, hourly=args.hourly
+    )
+
+    update_time = 0.0
+    for i in range(split, len(df)):
+        state = PreprocessState.from_dict(json.loads(json.dumps(state.to_dict())))
+        start = time.perf_counter()
+        state.process(df.iloc[[i]].reset_index(drop=True))
+        update_time += time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_newfeat = extract_features(
+        filter_by_iqr(df, bounds), window_size=window_size, hourly=args.hourly
+    )
+    transform_to_supervised(
+        df_newfeat, lags=lags, rolling=rolling,
+        unit='h' if args.hourly else None
+    )
+    batch_time = time.perf_counter() - start
+
+    print(f"per-row update {update_time / args.new_days * 1e3:.3f} ms  "
+          f"batch recompute {batch_time * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Count tracking backend calls of a tracked train.train run.
+
+Trains on a synthetic series against a local file-store tracking URI,
+once with the per-fold logging train.train used to do and once through
+tracking.RunLogger, counting the calls that reach the tracking store and
+the artifact repository. Exits non-zero when the RunLogger run needs
+more than two log_batch calls, logs single metrics or params, uploads
+more than the artifacts and the model once, or misses any fold metric:
+
+    python benchmarks/check_tracking.py
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import functools
+from collections import Counter
+
+from omegaconf import OmegaConf
+from xgboost import XGBRegressor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+import train
+from data_preprocessing import preprocess
+from synthetic import demand_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+calls = Counter()
+
+
+def count_calls(cls, names):
+    for name in names:
+        method = getattr(cls, name, None)
+        if method is None:
+            continue
+
+        def wrapper(self, *args, _method=method, _name=name, **kwargs):
+            calls[f"{cls.__name__}.{_name}"] += 1
+            return _method(self, *args, **kwargs)
+        setattr(cls, name, functools.wraps(method)(wrapper))
+
+
+def legacy_train(config, model, X, y, n_splits, artifacts_path):
+    """
+    Tracked training with the logging calls of the old fold loop.
+    """
+    import mlflow
+    from sklearn.model_selection import TimeSeriesSplit
+    from sklearn.metrics import mean_absolute_error
+
+    with mlflow.start_run(tags={'subba': 'legacy'}):
+        for train_index, test_index in TimeSeriesSplit(n_splits=n_splits).split(X):
+            X_train, X_test = X.iloc[train_index], X.iloc[test_index]
+            y_train, y_test = y.iloc[train_index], y.iloc[test_index]
+            model.fit(X_train, y_train, eval_set=[(X_test, y_test)], verbose=False)
+
+            mlflow.log_params(model.get_params())
+            mlflow.log_metric('mae_train', mean_absolute_error(y_train, model.predict(X_train)))
+            mlflow.log_metric('mae_test', mean_absolute_error(y_test, model.predict(X_test)))
+            mlflow.xgboost.log_model(model, 'xgb_best')
+            mlflow.log_artifacts(artifacts_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=3000)
+    parser.add_argument('--sync', action='store_true',
+                        help='Upload on the training thread.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='check-tracking-')
+    os.environ['MLFLOW_TRACKING_URI'] = 'file://' + os.path.join(workdir, 'mlruns')
+    # Interpolated by the config even though a file store is used.
+    for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST',
+                 'DB_PORT', 'API_KEY', 'S3_BUCKET_NAME'):
+        os.environ.setdefault(name, 'unused')
+
+    import mlflow
+    from mlflow import MlflowClient
+    from mlflow.store.tracking.file_store import FileStore
+    from mlflow.store.artifact.local_artifact_repo import LocalArtifactRepository
+
+    count_calls(FileStore, ('log_metric', 'log_param', 'set_tag', 'log_batch'))
+    count_calls(LocalArtifactRepository, ('log_artifact', 'log_artifacts'))
+
+    config = OmegaConf.load(CONFIG_PATH)
+    config.mlflow.async_uploads = not args.sync
+    n_splits = config.training.N_SPLITS
+
+    # Keep the artifacts in the local store rather than on S3.
+    mlflow.set_tracking_uri(os.environ['MLFLOW_TRACKING_URI'])
+    mlflow.create_experiment(config.mlflow.experiment_name)
+    mlflow.set_experiment(config.mlflow.experiment_name)
+
+    artifacts_path = os.path.join(workdir, 'artifacts')
+    os.makedirs(artifacts_path)
+    with open(os.path.join(artifacts_path, 'afts.bin'), 'wb') as f_out:
+        f_out.write(os.urandom(1 << 20))
+
+    df_processed, _ = preprocess(
+        demand_frame(args.rows, timezones=('Eastern',)), encoding=config.training.ENCODING
+    )
+    X = df_processed.drop(columns=['value'])
+    y = df_processed.value
+
+    def make_model():
+        return XGBRegressor(
+            n_estimators=100, max_depth=6, early_stopping_rounds=10,
+            **train.model_params(config)
+        )
+
+    results = {}
+    for name in ('legacy', 'run_logger'):
+        calls.clear()
+        start = time.perf_counter()
+        if name == 'legacy':
+            legacy_train(config, make_model(), X, y, n_splits, artifacts_path)
+        else:
+            train.train(config, make_model(), X, y, n_splits, track=True,
+                        artifacts_path=artifacts_path, tags={'subba': 'new'})
+        results[name] = (time.perf_counter() - start, dict(calls))
+        print(f"{name:>10}: {results[name][0]:6.2f} s  "
+              + "  ".join(f"{k}={v}" for k, v in sorted(calls.items())))
+
+    _, new_calls = results['run_logger']
+    failed = False
+    if new_calls.get('FileStore.log_batch', 0) > 2 \
+            or new_calls.get('FileStore.log_metric', 0) \
+            or new_calls.get('FileStore.log_param', 0):
+        print("Params and metrics were not sent in one batch each")
+        failed = True
+    uploads = new_calls.get('LocalArtifactRepository.log_artifacts', 0) \
+        + new_calls.get('LocalArtifactRepository.log_artifact', 0)
+    if uploads > 2:
+        print("Model and artifacts were uploaded more than once")
+        failed = True
+
+    client = MlflowClient()
+    run = client.search_runs(
+        [mlflow.get_experiment_by_name(config.mlflow.experiment_name).experiment_id],
+        filter_string="tags.subba = 'new'"
+    )[0]
+    history = client.get_metric_history(run.info.run_id, 'mae_test')
+    artifacts = {f.path for f in client.list_artifacts(run.info.run_id)}
+    if sorted(m.step for m in history) != list(range(n_splits)):
+        print("Fold metrics are missing:", [m.step for m in history])
+        failed = True
+    if not {'afts.bin', 'xgb_best'} <= artifacts:
+        print("Artifacts are missing:", artifacts)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
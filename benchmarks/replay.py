@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Replay a request log against the prediction handler and report latency.
+
+Every line of the log is a JSON object, either a handler event or
+{"event": {...}}. Lines without event keys replay as the default single
+prediction, so the repo's requests.jsonl works as it is. --synthetic N
+generates a mix of single, multi-day and batch requests instead.
+
+The model is trained on synthetic data and registered in a local file
+MLflow store, so no network is needed. Requests run in this process
+(--mode inprocess) or through a local HTTP wrapper around
+lambda_handler (--mode http). The first request after every
+(re)start is reported as cold:
+
+    python benchmarks/replay.py --synthetic 500 --concurrency 4 --rate 50
+    python benchmarks/replay.py --log requests.jsonl --mode http --restart-every 100
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import resource
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from omegaconf import OmegaConf
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_startup import CONFIG_PATH, SUBBA, build_model, serving_dir
+
+EVENT_KEYS = {'subbas', 'dates', 'horizon'}
+
+
+def read_log(path):
+    events = []
+    with open(path) as f_in:
+        for line in f_in:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            event = record.get('event', record)
+            events.append({k: v for k, v in event.items() if k in EVENT_KEYS})
+    return events
+
+
+def synthetic_log(n_requests, seed=0):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(n_requests):
+        kind = rng.random()
+        if kind < 0.4:
+            events.append({})
+        elif kind < 0.8:
+            events.append({'horizon': rng.randint(2, 14)})
+        else:
+            events.append({'subbas': [SUBBA] * rng.randint(2, 5),
+                           'horizon': rng.randint(1, 7)})
+    return events
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class InProcessTarget(object):
+    """
+    Calls lambda_handler of an app module imported into this process.
+    """
+    def __init__(self, task_root, env):
+        os.environ.update(env)
+        sys.path.insert(0, task_root)
+        import app
+        self.app = app
+        self.cache_dir = env['MODEL_CACHE_DIR']
+
+    def start(self):
+        # Drop what a new container would not have. Import time is not
+        # part of in-process cold requests.
+        self.app._models.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def call(self, event):
+        return self.app.lambda_handler(event, None), max_rss_mb()
+
+    def stop(self):
+        pass
+
+
+class HTTPTarget(object):
+    """
+    Posts events to a wrapper process started with --serve.
+    """
+    def __init__(self, task_root, env):
+        self.task_root = task_root
+        self.env = dict(os.environ, **env)
+        self.process = None
+
+    def start(self):
+        self.stop()
+        shutil.rmtree(self.env['MODEL_CACHE_DIR'], ignore_errors=True)
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', self.task_root],
+            env=self.env, stdout=subprocess.PIPE, text=True
+        )
+        # The wrapper prints its port once it accepts requests.
+        port = int(self.process.stdout.readline())
+        self.url = f'http://127.0.0.1:{port}/'
+
+    def call(self, event):
+        request = urllib.request.Request(
+            self.url, data=json.dumps(event).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request) as response:
+            body = json.loads(response.read())
+        return body['result'], body['max_rss_mb']
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+
+def serve(task_root):
+    """
+    Serve lambda_handler over HTTP, one JSON event per POST.
+    """
+    sys.path.insert(0, task_root)
+    import app
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            event = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            body = json.dumps({
+                'result': app.lambda_handler(event, None),
+                'max_rss_mb': max_rss_mb(),
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+def replay(target, events, concurrency, rate, restart_every):
+    """
+    Send `events` to `target` and time every request.
+
+    With a rate, requests are sent on a fixed schedule and latency is
+    measured from the scheduled time, so that a slow handler is not
+    hidden by requests queueing behind it.
+
+    Returns:
+        tuple: Per-request records and the elapsed wall time.
+    """
+    segment = restart_every or len(events)
+    records = []
+
+    def send(event, scheduled, cold):
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent = time.perf_counter()
+        result, rss = target.call(event)
+        done = time.perf_counter()
+        return {
+            'latency': done - (scheduled if rate else sent),
+            'cold': cold,
+            'error': 'Exception' in result,
+            'forecasts': len(result.get('forecasts', [None])),
+            'max_rss_mb': rss,
+        }
+
+    elapsed = 0.0
+    for first in range(0, len(events), segment):
+        chunk = events[first:first + segment]
+        target.start()
+
+        segment_start = time.perf_counter()
+        # The cold request runs alone, like the first one of a container.
+        records.append(send(chunk[0], segment_start, cold=True))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(
+                    send, event,
+                    start + (i / rate if rate else 0.0),
+                    False
+                )
+                for i, event in enumerate(chunk[1:])
+            ]
+            records.extend(future.result() for future in futures)
+        elapsed += time.perf_counter() - segment_start
+    target.stop()
+    return records, elapsed
+
+
+def summarize(records, elapsed):
+    latencies = np.array([r['latency'] for r in records]) * 1e3
+    cold = np.array([r['cold'] for r in records])
+
+    summary = {
+        'requests': len(records),
+        'forecasts': int(sum(r['forecasts'] for r in records)),
+        'errors': int(sum(r['error'] for r in records)),
+        'throughput_rps': len(records) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'cold_requests': int(cold.sum()),
+        'cold_p50_ms': float(np.median(latencies[cold])),
+        'peak_rss_mb': max(r['max_rss_mb'] for r in records),
+    }
+    if (~cold).any():
+        summary['warm_p50_ms'] = float(np.median(latencies[~cold]))
+        summary['warm_p95_ms'] = float(np.percentile(latencies[~cold], 95))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--log', default=None, help='jsonl request log.')
+    parser.add_argument('--synthetic', type=int, default=200,
+                        help='Number of generated requests without --log.')
+    parser.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='Requests per second, 0 sends as fast as possible.')
+    parser.add_argument('--restart-every', type=int, default=0,
+                        help='Requests per handler (re)start, 0 for one start.')
+    parser.add_argument('--encoding', default=None,
+                        help='Feature encoding, training.ENCODING by default.')
+    parser.add_argument('--max-p95-ms', type=float, default=None,
+                        help='Fail when the warm p95 latency exceeds this.')
+    parser.add_argument('--output', default=None, help='Write the summary as JSON.')
+    parser.add_argument('--serve', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve)
+        return
+
+    config = OmegaConf.load(CONFIG_PATH)
+    encoding = args.encoding or config.training.ENCODING
+    events = read_log(args.log) if args.log else synthetic_log(args.synthetic)
+
+    workdir = tempfile.mkdtemp(prefix='bench-replay-')
+    try:
+        tracking_uri, _ = build_model(config, workdir, encoding)
+        task_root = serving_dir(workdir)
+
+        env = {
+            'MLFLOW_TRACKING_URI': tracking_uri,
+            'SUBBA': SUBBA,
+            'MODEL_CACHE_DIR': os.path.join(workdir, 'model-cache'),
+        }
+        # Interpolated by the config even though a file store is used.
+        for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST',
+                     'DB_PORT', 'API_KEY', 'S3_BUCKET_NAME'):
+            env[name] = os.environ.get(name, 'unused')
+
+        target_cls = InProcessTarget if args.mode == 'inprocess' else HTTPTarget
+        target = target_cls(task_root, env)
+        records, elapsed = replay(
+            target, events, args.concurrency, args.rate, args.restart_every
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(records, elapsed)
+    for key, value in summary.items():
+        print(f"{key:>15}: {value:.1f}" if isinstance(value, float)
+              else f"{key:>15}: {value}")
+    if args.output:
+        with open(args.output, 'w') as f_out:
+            json.dump(summary, f_out, indent=2)
+
+    failed = summary['errors'] > 0
+    if args.max_p95_ms is not None \
+            and summary.get('warm_p95_ms', summary['p95_ms']) > args.max_p95_ms:
+        print(f"Warm p95 above {args.max_p95_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
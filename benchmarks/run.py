@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark suite of the ingestion, training and serving hot paths.
+
+Every benchmark runs on synthetic demand from synthetic.py and offline:
+SQLite stands in for Postgres, with the demand table and the upsert
+clause of the config, and a local file store for MLflow (--postgres
+inserts into a scratch table of the DB_* database instead). The suite
+covers
+
+* ingest.encode: API rows to tuples and COPY text, per chunk;
+* ingest.insert / ingest.upsert: chunked upserts into an empty table and
+  again over the same rows, as an overlapping incremental load does;
+* preprocess.daily / preprocess.hourly: preprocess over every subba;
+* train.cv: train.train cross-validation, fold matrices included;
+* tune.trial: one tuning trial on shared fold matrices;
+* predict.load / predict.single / predict.forecast: app.predict after a
+  restart, warm, and a 7-day forecast.
+
+Each benchmark is timed --repeat times, after any setup it needs, and
+the median is kept. Results are stored in --results-dir as
+<commit>.json with the parameters, package versions and machine, and
+compared with the results of --compare, a commit, or by default the
+latest other stored result run with the same parameters. Exits non-zero
+when a benchmark is more than --max-slowdown times slower:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --only preprocess train --compare HEAD~1 --max-slowdown 1.2
+"""
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+from omegaconf import OmegaConf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'training'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'prediction'))
+from synthetic import demand_panel, api_rows
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+CONFIG_PATH = os.path.join(ROOT, 'src', 'conf', 'config.yaml')
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+SCHEMA = "period, subba, subba_name, parent, parent_name, timezone, value, value_units"
+KEY = 'period, subba, timezone'
+
+
+class Benchmark(object):
+    """
+    A timed callable. `setup`, when given, runs untimed before every
+    call and returns the arguments of `run`. `calls` divides the time,
+    e.g. by the number of trials `run` executes.
+    """
+    def __init__(self, name, run, rows=None, setup=None, calls=1):
+        self.name = name
+        self.run = run
+        self.rows = rows
+        self.setup = setup
+        self.calls = calls
+
+    def measure(self, repeat):
+        timings = []
+        for _ in range(repeat):
+            args = self.setup() if self.setup is not None else ()
+            start = time.perf_counter()
+            self.run(*args)
+            timings.append((time.perf_counter() - start) / self.calls)
+        return {
+            'median_s': float(np.median(timings)),
+            'min_s': float(min(timings)),
+            'repeat': repeat,
+            'rows': self.rows,
+        }
+
+
+class Suite(object):
+    """
+    Shared data of the benchmarks, generated on first use.
+    """
+    def __init__(self, args, config, workdir):
+        self.args = args
+        self.config = config
+        self.workdir = workdir
+        self._panels = {}
+        self._features = None
+
+    def panel(self, hourly=False):
+        if hourly not in self._panels:
+            periods = self.args.hours if hourly else self.args.days
+            self._panels[hourly] = demand_panel(
+                periods, self.args.subbas, hourly=hourly, seed=self.args.seed
+            )
+        return self._panels[hourly]
+
+    def features(self):
+        """
+        Daily features of the first subba, as train_flow prepares them.
+        """
+        if self._features is None:
+            from data_preprocessing import preprocess
+
+            df = next(iter(self.panel().values()))
+            df_processed, _ = preprocess(
+                df, encoding=self.config.training.ENCODING,
+                **preprocess_params(self.config, hourly=False)
+            )
+            self._features = (df_processed.drop(columns=['value']),
+                              df_processed['value'])
+        return self._features
+
+
+def preprocess_params(config, hourly):
+    params = config.features['hourly' if hourly else 'daily']
+    return {
+        'window_size': params.WINDOW_SIZE,
+        'lags': tuple(params.LAGS),
+        'rolling': tuple(tuple(pair) for pair in params.ROLLING),
+        'hourly': hourly,
+    }
+
+
+def ingest_chunks(suite):
+    """
+    Daily API rows of every subba, in chunks of the download page size.
+    """
+    chunk_len = suite.config.data.api.query.CHUNK_LEN
+    chunks = []
+    for subba, df in suite.panel().items():
+        rows = api_rows(df, subba)
+        chunks.extend(rows[i:i + chunk_len] for i in range(0, len(rows), chunk_len))
+    return chunks
+
+
+def bench_ingest(suite):
+    from db_store import DatabaseHandler, copy_buffer
+
+    chunks = ingest_chunks(suite)
+    n_rows = sum(len(chunk) for chunk in chunks)
+    tuples = [[tuple(d.values()) for d in chunk] for chunk in chunks]
+
+    def encode():
+        # What ingest and copy_insert do with every downloaded chunk.
+        for chunk in chunks:
+            copy_buffer([tuple(d.values()) for d in chunk])
+
+    yield Benchmark('ingest.encode', encode, rows=n_rows)
+
+    if suite.args.postgres:
+        db_handler = DatabaseHandler(suite.config)
+        db_handler.connect()
+        tab_name = 'demand_bench'
+        tab_schema = suite.config.data.tab_params.tab_schema.demand.replace(
+            'demand', tab_name)
+
+        def empty():
+            db_handler.create_table(tab_name, tab_schema, rebuild=True)
+            return ()
+
+        def load():
+            for data in tuples:
+                db_handler.copy_insert(data=data, schema=SCHEMA, tab_name=tab_name)
+    else:
+        # Same table and upsert clause as Postgres, one commit per chunk.
+        statement = (f"INSERT INTO demand ({SCHEMA}) "
+                     f"VALUES ({', '.join('?' * len(SCHEMA.split(',')))}) "
+                     + DatabaseHandler.upsert_clause('demand', SCHEMA, KEY))
+        path = os.path.join(suite.workdir, 'demand.db')
+        conn = None
+
+        def empty():
+            nonlocal conn
+            if conn is not None:
+                conn.close()
+            if os.path.exists(path):
+                os.remove(path)
+            conn = sqlite3.connect(path)
+            conn.executescript(suite.config.data.tab_params.tab_schema.demand)
+            return ()
+
+        def load():
+            for data in tuples:
+                conn.executemany(statement, data)
+                conn.commit()
+
+    def filled():
+        empty()
+        load()
+        return ()
+
+    yield Benchmark('ingest.insert', load, rows=n_rows, setup=empty)
+    yield Benchmark('ingest.upsert', load, rows=n_rows, setup=filled)
+
+
+def bench_preprocess(suite):
+    from data_preprocessing import preprocess
+
+    for hourly in (False, True):
+        panel = suite.panel(hourly)
+        params = preprocess_params(suite.config, hourly)
+
+        def run(panel=panel, params=params):
+            for df in panel.values():
+                preprocess(df, encoding=suite.config.training.ENCODING, **params)
+
+        yield Benchmark(
+            f"preprocess.{'hourly' if hourly else 'daily'}", run,
+            rows=sum(len(df) for df in panel.values())
+        )
+
+
+def bench_train(suite):
+    import train
+    from xgboost import XGBRegressor
+
+    X, y = suite.features()
+    n_splits = suite.config.training.N_SPLITS
+
+    def run():
+        model = XGBRegressor(n_estimators=200, max_depth=6, learning_rate=0.1,
+                             **train.model_params(suite.config))
+        train.train(suite.config, model, X, y, n_splits,
+                    folds=train.FoldData(X, y, n_splits))
+
+    yield Benchmark('train.cv', run, rows=len(X))
+
+
+def bench_tune(suite):
+    import optuna
+    import train
+    import hp_optimization
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    X, y = suite.features()
+    config = copy.deepcopy(suite.config)
+    # In memory and unpruned, so that every trial trains every fold.
+    config.hyperparameters.STORAGE = None
+    config.hyperparameters.PRUNER = 'none'
+    config.hyperparameters.N_JOBS = 1
+    folds = train.FoldData(X, y, config.training.N_SPLITS)
+    trials = suite.args.trials
+
+    def run():
+        hp_optimization.tune_hyperparameters(
+            config=config, train_func=train.train, X=X, y=y,
+            n_trials=trials, n_splits=config.training.N_SPLITS, folds=folds
+        )
+
+    yield Benchmark('tune.trial', run, rows=len(X), calls=trials)
+
+
+def bench_predict(suite):
+    from bench_startup import SUBBA, build_model
+
+    os.environ.setdefault('MLFLOW_ENABLE_ARTIFACTS_PROGRESS_BAR', 'false')
+    tracking_uri, _ = build_model(suite.config, os.path.join(suite.workdir, 'model'),
+                                  suite.config.training.ENCODING)
+    cache_dir = os.path.join(suite.workdir, 'model-cache')
+    os.environ['MLFLOW_TRACKING_URI'] = tracking_uri
+    os.environ['MODEL_CACHE_DIR'] = cache_dir
+    import app
+
+    model_name = f"{suite.config.mlflow.model_name}-{SUBBA}-reg"
+
+    def restart():
+        # A new container: nothing loaded, nothing downloaded.
+        app._models.clear()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        return ()
+
+    yield Benchmark('predict.load', lambda: app.predict(model_name), rows=1,
+                    setup=restart)
+    app.predict(model_name)
+    yield Benchmark('predict.single', lambda: app.predict(model_name), rows=1)
+    yield Benchmark('predict.forecast', lambda: app.forecast(model_name, 7), rows=7)
+
+
+SUITE = (bench_ingest, bench_preprocess, bench_train, bench_tune, bench_predict)
+
+
+def git(*args):
+    return subprocess.run(['git', *args], cwd=ROOT, capture_output=True,
+                          text=True, check=True).stdout.strip()
+
+
+def current_commit():
+    """
+    Short hash of HEAD, marked -dirty when the code differs from it.
+    """
+    commit = git('rev-parse', '--short', 'HEAD')
+    if git('status', '--porcelain', '--', 'src', 'benchmarks'):
+        commit += '-dirty'
+    return commit
+
+
+def environment():
+    import pandas
+    import xgboost
+
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pandas.__version__,
+        'xgboost': xgboost.__version__,
+    }
+
+
+def stored_results(results_dir):
+    results = []
+    for name in os.listdir(results_dir):
+        if name.endswith('.json'):
+            with open(os.path.join(results_dir, name)) as f_in:
+                results.append(json.load(f_in))
+    return sorted(results, key=lambda result: result['date'])
+
+
+def baseline(results_dir, current, ref=None):
+    """
+    Stored result of the commit `ref`, or the latest other result with
+    the parameters of `current`.
+    """
+    stored = [result for result in stored_results(results_dir)
+              if result['commit'] != current['commit']]
+    if ref is not None:
+        commit = git('rev-parse', '--short', ref)
+        matches = [result for result in stored
+                   if result['commit'].split('-')[0] == commit]
+        if not matches:
+            print(f"No stored results for {ref} ({commit})")
+        return matches[-1] if matches else None
+    same = [result for result in stored if result['params'] == current['params']]
+    return same[-1] if same else None
+
+
+def compare(current, previous, max_slowdown):
+    """
+    Print the ratio of every median to the previous one.
+
+    Returns:
+        list: Benchmarks slower than `max_slowdown` times.
+    """
+    if previous['params'] != current['params']:
+        print(f"Parameters differ from {previous['commit']}:", previous['params'])
+    print(f"Compared with {previous['commit']} of {previous['date']}:")
+    slower = []
+    for name, result in current['results'].items():
+        before = previous['results'].get(name)
+        if before is None:
+            continue
+        ratio = result['median_s'] / before['median_s']
+        flag = ''
+        if max_slowdown is not None and ratio > max_slowdown:
+            flag = '  slower'
+            slower.append(name)
+        print(f"{name:>18}: {before['median_s'] * 1e3:10.2f} ms -> "
+              f"{result['median_s'] * 1e3:10.2f} ms  {ratio:5.2f}x{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--days', type=int, default=3653)
+    parser.add_argument('--hours', type=int, default=17532)
+    parser.add_argument('--subbas', type=int, default=3)
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='Run the benchmarks whose names start with these.')
+    parser.add_argument('--postgres', action='store_true')
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--max-slowdown', type=float, default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-suite-')
+    if not args.postgres:
+        # Interpolated by the config even though nothing connects.
+        for name in ('DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST',
+                     'DB_PORT', 'API_KEY', 'S3_BUCKET_NAME'):
+            os.environ.setdefault(name, 'unused')
+    config = OmegaConf.load(CONFIG_PATH)
+    suite = Suite(args, config, workdir)
+
+    results = {}
+    try:
+        for factory in SUITE:
+            prefix = factory.__name__[len('bench_'):]
+            if args.only and not any(prefix.startswith(name.split('.')[0])
+                                     for name in args.only):
+                continue
+            for bench in factory(suite):
+                if args.only and not any(bench.name.startswith(name)
+                                         for name in args.only):
+                    continue
+                results[bench.name] = result = bench.measure(args.repeat)
+                rate = ''
+                if result['rows']:
+                    rate = f"{result['rows'] / result['median_s']:14,.0f} rows/s"
+                print(f"{bench.name:>18}: {result['median_s'] * 1e3:10.2f} ms "
+                      f"(min {result['min_s'] * 1e3:10.2f} ms) {rate}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    params = {k: v for k, v in vars(args).items()
+              if k in ('days', 'hours', 'subbas', 'trials', 'seed', 'postgres')}
+    current = {
+        'commit': current_commit(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'params': params,
+        'environment': environment(),
+        'results': results,
+    }
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"{current['commit']}.json")
+    # Benchmarks left out by --only keep their earlier results.
+    if os.path.exists(path):
+        with open(path) as f_in:
+            earlier = json.load(f_in)
+        if earlier['params'] == params:
+            current['results'] = dict(earlier['results'], **results)
+    with open(path, 'w') as f_out:
+        json.dump(current, f_out, indent=2)
+    print(f"Results written to {path}")
+
+    slower = []
+    previous = baseline(args.results_dir, current, args.compare)
+    if previous is not None:
+        slower = compare(dict(current, results=results), previous,
+                         args.max_slowdown)
+    if slower:
+        print(f"Slower than {args.max_slowdown}x:", ', '.join(slower))
+    sys.exit(1 if slower else 0)
+
+
+if __name__ == "__main__":
+    main()
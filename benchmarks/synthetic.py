@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Synthetic daily and hourly demand shaped like the EIA subba data.
+
+Every subba gets its own level, trend and noise. Its demand peaks in
+summer and, less, in winter, dips on weekends and, for hourly data,
+follows a daily cycle with a morning and an evening peak. Weather is an
+AR(1) process around the seasonal curve, and a --outliers fraction of
+rows is spiked or zeroed as metering errors are. Daily rows repeat per
+timezone, as the daily endpoint returns them; hourly rows are UTC.
+
+demand_frame returns what DatabaseHandler.read_demand reads back and
+api_rows what the API returns to db_store.ingest. As a script, writes the
+rows of --subbas subbas as CSV:
+
+    python benchmarks/synthetic.py --rows 3653 --subbas 5 --out demand.csv
+    python benchmarks/synthetic.py --hourly --rows 87660 --subbas 2 --out hourly.csv
+"""
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+PARENT = ('NYIS', 'New York Independent System Operator')
+DAILY_TIMEZONES = ('Eastern', 'Central')
+
+
+def subba_codes(n_subbas):
+    """
+    `n_subbas` subba codes, ZONA, ZONB, ... then ZONAA, ZONAB, ...
+    """
+    codes = []
+    for i in range(n_subbas):
+        suffix = ''
+        i += 1
+        while i:
+            i, rest = divmod(i - 1, 26)
+            suffix = chr(ord('A') + rest) + suffix
+        codes.append(f'ZON{suffix}')
+    return codes
+
+
+def demand_values(n_periods, hourly=False, seed=0, start='2015-07-01',
+                  outliers=0.005):
+    """
+    Demand in MWh of one subba for `n_periods` consecutive days or hours.
+
+    Returns:
+        tuple: datetime64 periods and int32 values.
+    """
+    rng = np.random.default_rng(seed)
+    freq = 'h' if hourly else 'D'
+    period = pd.date_range(start, periods=n_periods, freq=freq)
+    period = period.to_numpy(dtype='datetime64[ns]')
+    t = np.arange(n_periods)
+    per_day = 24 if hourly else 1
+    days = t / per_day
+
+    # Hourly values are the daily ones spread over the hours.
+    level = rng.uniform(5000, 50000) / per_day
+    trend = rng.normal(0.01, 0.01) * days / 365
+    day_of_year = pd.DatetimeIndex(period).dayofyear.to_numpy()
+    # Summer peak in July, a smaller winter one in January.
+    seasonal = (0.15 * np.cos(2 * np.pi * (day_of_year - 200) / 365.25)
+                + 0.08 * np.cos(4 * np.pi * (day_of_year - 15) / 365.25))
+    day_of_week = pd.DatetimeIndex(period).dayofweek.to_numpy()
+    weekly = np.where(day_of_week >= 5, -0.08, 0.0)
+
+    # Weather: AR(1) anomalies that persist for a few days.
+    phi = 0.9 ** (1 / per_day)
+    shocks = rng.normal(0, 0.03 * np.sqrt(1 - phi ** 2), n_periods)
+    weather = np.empty(n_periods)
+    weather[0] = shocks[0]
+    for i in range(1, n_periods):
+        weather[i] = phi * weather[i - 1] + shocks[i]
+
+    shape = 1 + trend + seasonal + weekly + weather
+    if hourly:
+        hour = pd.DatetimeIndex(period).hour.to_numpy()
+        shape += (0.10 * np.cos(2 * np.pi * (hour - 18) / 24)
+                  + 0.05 * np.cos(4 * np.pi * (hour - 9) / 24))
+    value = level * shape * (1 + rng.normal(0, 0.01, n_periods))
+
+    # Metering errors: spikes and dropped readings.
+    n_outliers = int(outliers * n_periods)
+    if n_outliers:
+        idx = rng.choice(n_periods, size=n_outliers, replace=False)
+        value[idx] *= rng.choice([0.0, 3.0], size=n_outliers)
+    return period, np.round(value).astype('int32')
+
+
+def demand_frame(n_periods, hourly=False, seed=0, start='2015-07-01',
+                 outliers=0.005, timezones=None):
+    """
+    Rows of one subba as read_demand returns them: datetime64 periods,
+    categorical timezones and int32 values, ordered by period and
+    timezone.
+    """
+    timezones = timezones or (('UTC',) if hourly else DAILY_TIMEZONES)
+    period, value = demand_values(n_periods, hourly, seed, start, outliers)
+    n_tz = len(timezones)
+    # A timezone shifts the day boundary, so its values differ a little.
+    offsets = np.linspace(0, 0.01, n_tz)
+    return pd.DataFrame({
+        'period': np.repeat(period, n_tz),
+        'timezone': pd.Categorical(np.tile(timezones, n_periods),
+                                   categories=sorted(timezones)),
+        'value': np.round(np.repeat(value, n_tz)
+                          * np.tile(1 + offsets, n_periods)).astype('int32'),
+    })
+
+
+def demand_panel(n_periods, n_subbas, hourly=False, seed=0, **kwargs):
+    """
+    demand_frame of `n_subbas` subbas, keyed by subba code.
+    """
+    return {
+        subba: demand_frame(n_periods, hourly=hourly, seed=seed + i, **kwargs)
+        for i, subba in enumerate(subba_codes(n_subbas))
+    }
+
+
+def api_rows(df, subba, hourly=False):
+    """
+    Rows of `df` as the API returns them, before normalize_hourly: string
+    periods and values, hyphenated keys and, for hourly data, no
+    timezone.
+    """
+    fmt = '%Y-%m-%dT%H' if hourly else '%Y-%m-%d'
+    periods = pd.DatetimeIndex(df['period']).strftime(fmt)
+    rows = []
+    for period, timezone, value in zip(periods, df['timezone'].astype(str),
+                                       df['value'].astype(str)):
+        row = {
+            'period': period,
+            'subba': subba,
+            'subba-name': f'Zone {subba[3:]}',
+            'parent': PARENT[0],
+            'parent-name': PARENT[1],
+        }
+        if not hourly:
+            row['timezone'] = timezone
+        row['value'] = value
+        row['value-units'] = 'megawatthours'
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=3653,
+                        help='Days, or hours with --hourly, per subba.')
+    parser.add_argument('--subbas', type=int, default=1)
+    parser.add_argument('--hourly', action='store_true')
+    parser.add_argument('--outliers', type=float, default=0.005)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='CSV path, stdout by default.')
+    args = parser.parse_args()
+
+    frames = []
+    for subba, df in demand_panel(args.rows, args.subbas, hourly=args.hourly,
+                                  seed=args.seed, outliers=args.outliers).items():
+        frames.append(df.assign(subba=subba))
+    pd.concat(frames, ignore_index=True).to_csv(args.out or sys.stdout, index=False)
+
+
+if __name__ == "__main__":
+    main()
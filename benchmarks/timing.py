@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Timing helper shared by the benchmark scripts.
+"""
+import time
+
+
+def timings(func, repeat, *args):
+    """
+    Call `func(*args)` `repeat` times.
+
+    Returns:
+        tuple: Wall time of every call in seconds and the result of the
+              last one.
+    """
+    elapsed = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed.append(time.perf_counter() - start)
+    return elapsed, result
+
+
+def best_of(func, repeat, *args):
+    """
+    Fastest of `repeat` calls of `func(*args)` in seconds, and the result
+    of the last one.
+    """
+    elapsed, result = timings(func, repeat, *args)
+    return min(elapsed), result
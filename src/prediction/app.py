@@ -1,63 +1,351 @@
 # !/usr/bin/env python
 # coding: utf-8
 import os
+import time
+import shutil
 import mlflow
-import mlflow.pyfunc
+import mlflow.xgboost
+from mlflow import MlflowClient
 from mlflow.exceptions import MlflowException
 from hydra.core.global_hydra import GlobalHydra
 from hydra import initialize, compose
-import pickle
+import numpy as np
+from datetime import datetime, timedelta
+from calendar_features import calendar_features
+from scoring import BoosterScorer
+import run_artifacts
+import instrumentation
+
+# Downloaded models survive in /tmp while the container is reused.
+CACHE_DIR = os.getenv('MODEL_CACHE_DIR', '/tmp/model-cache')
+# Seconds between checks for a new Production version.
+CHECK_INTERVAL = float(os.getenv('MODEL_CHECK_INTERVAL', '300'))
+
+# Kept across warm invocations of the same container.
+_config = None
+_models = {}
+
+def get_config():
+    global _config
+    if _config is None:
+        if GlobalHydra().is_initialized() == False:
+            initialize(version_base=None, config_path='conf/', job_name="lambda_job")
+        _config = compose(config_name="config.yaml")
+        instrumentation.configure(_config)
+    return _config
+
+def production_version(model_name):
+    """
+    Return the Production version of `model_name`, or None without one.
+    """
+    client = MlflowClient()
+    versions = client.get_latest_versions(model_name, stages=["Production"])
+    return versions[0] if versions else None
+
+def download_bundle(run_id, dst_path, cached_paths):
+    """
+    Download the versioned artifacts of a run into `dst_path`.
+
+    Only the manifest is downloaded when one of `cached_paths` holds a
+    bundle with the same content hash; its files are linked instead.
+    """
+    mlflow.artifacts.download_artifacts(
+        run_id=run_id,
+        artifact_path=run_artifacts.MANIFEST,
+        dst_path=dst_path
+    )
+    manifest = run_artifacts.read_manifest(dst_path)
+    for other in cached_paths:
+        try:
+            if run_artifacts.read_manifest(other)['content_hash'] \
+                    == manifest['content_hash']:
+                for name in manifest['files']:
+                    os.link(os.path.join(other, name), os.path.join(dst_path, name))
+                return
+        except (OSError, ValueError):
+            # A partial copy.
+            continue
+
+    for name in manifest['files']:
+        mlflow.artifacts.download_artifacts(
+            run_id=run_id,
+            artifact_path=name,
+            dst_path=dst_path
+        )
+    run_artifacts.verify_files(dst_path, manifest)
+
+def download_version(model_name, version):
+    """
+    Download a model version and its run artifacts into the disk cache,
+    unless a previous invocation of this container already did.
+    """
+    model_dir = os.path.join(CACHE_DIR, model_name)
+    path = os.path.join(model_dir, str(version.version))
+
+    if not os.path.isdir(path):
+        artifacts = {
+            f.path for f in MlflowClient().list_artifacts(version.run_id)
+        }
+        if run_artifacts.MANIFEST not in artifacts:
+            raise ValueError(
+                f"{model_name} version {version.version} has no "
+                f"{run_artifacts.MANIFEST}, its run {version.run_id} was "
+                "not trained with the run artifacts."
+            )
+
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        mlflow.artifacts.download_artifacts(
+            artifact_uri=f"models:/{model_name}/{version.version}",
+            dst_path=os.path.join(tmp_path, 'model')
+        )
+        cached_paths = [
+            os.path.join(model_dir, other) for other in os.listdir(model_dir)
+            if other != os.path.basename(tmp_path)
+        ]
+        download_bundle(version.run_id, tmp_path, cached_paths)
+        os.replace(tmp_path, path)
+
+        # Older versions will not be served again.
+        for other in os.listdir(model_dir):
+            if other != str(version.version):
+                shutil.rmtree(os.path.join(model_dir, other), ignore_errors=True)
+    return path
+
+def load_artifacts(path, model):
+    """
+    Build the scorer of a downloaded version and read its artifacts,
+    checked against the features of the model.
+
+    Returns:
+        tuple: BoosterScorer, float32 recent feature rows and the recent
+            values of multi-day forecasts.
+    """
+    manifest = run_artifacts.read_manifest(path)
+    scorer = BoosterScorer.from_model(model, manifest['schema'])
+    scorer.check_types(manifest['feature_types'])
+    recent = run_artifacts.load_recent(path, manifest)
+    return scorer, recent, manifest['recent_values']
+
+def load_model(model_name):
+    """
+    Return the cached Production model and artifacts of `model_name`.
+
+    The registry is asked for the current Production version at most
+    every CHECK_INTERVAL seconds. The model is only downloaded and
+    deserialized again when that version changes. It is served by a
+    BoosterScorer, with the prepared recent features as its float32
+    rows.
+    """
+    cached = _models.get(model_name)
+    now = time.monotonic()
+    if cached is not None and now - cached['checked_at'] < CHECK_INTERVAL:
+        return cached
+
+    try:
+        version = production_version(model_name)
+    except MlflowException as e:
+        if cached is None:
+            raise
+        print("Version check failed, serving the cached model:", e)
+        cached['checked_at'] = now
+        return cached
+
+    if version is None:
+        if cached is None:
+            raise ValueError(f"{model_name} has no Production version.")
+        print(f"{model_name} has no Production version, serving the cached model.")
+        cached['checked_at'] = now
+        return cached
+
+    if cached is not None and cached['version'] == version.version:
+        cached['checked_at'] = now
+        return cached
+
+    print(f"Loading {model_name} version {version.version}...")
+    with instrumentation.stage('load_model', model=model_name,
+                               version=version.version):
+        path = download_version(model_name, version)
+        model = mlflow.xgboost.load_model(os.path.join(path, 'model'))
+        scorer, recent, recent_values = load_artifacts(path, model)
+
+    cached = {
+        'version': version.version,
+        'scorer': scorer,
+        'recent': recent,
+        'recent_values': recent_values,
+        'checked_at': now,
+    }
+    _models[model_name] = cached
+    return cached
 
 def predict(model_name):
-    stage = "Production"
-    model_uri = f"models:/{model_name}/{stage}"
-    print("Model URI:", model_uri)
-    model = mlflow.pyfunc.load_model(model_uri=model_uri)
-
-    best_run_id = model.metadata.run_id
-
-    local_path = mlflow.artifacts.download_artifacts(run_id=best_run_id)
-    print(local_path)
-    with open(local_path + '/afts.bin', 'rb') as f_in:
-        artifacts = pickle.load(f_in)
-    
-    last_day_vals = artifacts[2]
-    y_pred = model.predict(last_day_vals)
+    cached = load_model(model_name)
+    y_pred = cached['scorer'].predict(cached['recent'])
     return y_pred[0]
 
-def make_prediction():    
-    config_path = 'conf/'
+def period_step(recent_values):
+    """
+    Time between two periods of the series. Older runs only stored the
+    day of daily series.
+    """
+    if recent_values.get('frequency', 'daily') == 'hourly':
+        return timedelta(hours=1)
+    return timedelta(days=1)
+
+def period_label(period, step):
+    # Daily forecasts keep their YYYY-MM-DD labels.
+    if step == timedelta(days=1):
+        return period.date().isoformat()
+    return period.isoformat()
 
-    if GlobalHydra().is_initialized() == False:
-        initialize(version_base=None, config_path=config_path, job_name="lambda_job")
-        config = compose(config_name="config.yaml")
+def forecast(model_name, horizon):
+    """
+    Forecast the `horizon` periods that follow the last observed one.
+
+    The feature rows of all steps are built up front, calendar features
+    included. Step h is fed the prediction of step h - 1 as its lag and
+    the rolling statistics of a window that moves over the predictions,
+    so that step 1 reproduces `predict`.
+
+    Args:
+        model_name (str): Registered model name.
+        horizon (int): Number of periods, days or hours, to forecast.
+
+    Returns:
+        tuple: First forecast period, the step between periods and a
+            float64 array of predictions.
+    """
+    cached = load_model(model_name)
+    scorer = cached['scorer']
+    recent = cached['recent']
+    recent_values = cached['recent_values']
+
+    # Only the lag and the rolling statistics are updated between steps.
+    fixed = [c for c in scorer.schema
+             if c == 'hour' or c.startswith(('lag_', 'rolling_mean_', 'rolling_std_'))]
+    if horizon > 1 and fixed:
+        raise ValueError(
+            f"{model_name} uses {', '.join(fixed)}, "
+            "only a horizon of 1 is available."
+        )
+
+    last_period = datetime.fromisoformat(recent_values['period'])
+    step_size = period_step(recent_values)
+    window = np.asarray(recent_values['window'], dtype='float64')
+
+    # Step h reuses the calendar of the period its lag belongs to.
+    periods = np.datetime64(last_period, 'h') \
+        + np.arange(horizon) * np.timedelta64(step_size)
+    days = periods.astype('datetime64[D]').astype('int64')
+    rows = scorer.buffer(horizon)
+    rows[:] = recent[0]
+    for name, values in calendar_features(days).items():
+        if name in scorer.schema:
+            rows[:, scorer.index(name)] = values
+
+    # Steps are updated in the float32 rows the booster is fed.
+    lag_idx = scorer.index('lag')
+    mean_idx = scorer.index('rolling_mean')
+    std_idx = scorer.index('rolling_std')
+    lag = float(recent[0, lag_idx])
+
+    y_pred = np.empty(horizon, dtype='float64')
+    for step in range(horizon):
+        if step > 0:
+            lag = y_pred[step - 1]
+            window = np.append(window[1:], lag)
+            rows[step, lag_idx] = lag
+            rows[step, mean_idx] = window.mean()
+            rows[step, std_idx] = window.std(ddof=1)
+        y_pred[step] = scorer.predict(rows[step:step + 1])[0]
+    return last_period + step_size, step_size, y_pred
+
+def batch_forecast(config, event):
+    """
+    Answer a batch request for several subbas, dates and horizons.
+
+    The event may hold `subbas` (defaults to SUBBA), `dates` as
+    YYYY-MM-DD strings, or ISO timestamps for hourly models, and
+    `horizon` in periods of the model's series. Without dates every
+    period of the horizon is returned, otherwise only the requested ones,
+    with the horizon extended to reach the latest of them.
+
+    Returns:
+        list: One dict with subba, date and prediction per forecast,
+            dated YYYY-MM-DD for daily and by ISO timestamp for hourly
+            models.
+    """
+    subbas = event.get('subbas') or [os.getenv('SUBBA', config.data.api.query.SUBBA)]
+    if isinstance(subbas, str):
+        subbas = [subbas]
+    dates = [datetime.fromisoformat(d) for d in event.get('dates') or []]
+    horizon = int(event.get('horizon', 1))
+
+    forecasts = []
+    for subba in subbas:
+        model_name = f"{config.mlflow.model_name}-{subba}-reg"
+        recent_values = load_model(model_name)['recent_values']
+
+        steps = horizon
+        step_size = period_step(recent_values)
+        if dates:
+            last_period = datetime.fromisoformat(recent_values['period'])
+            if min(dates) <= last_period:
+                raise ValueError(
+                    f"{subba} can only be forecast after "
+                    f"{period_label(last_period, step_size)}."
+                )
+            steps = max(horizon, -(-(max(dates) - last_period) // step_size))
+
+        first_period, step_size, y_pred = forecast(model_name, steps)
+        wanted = {period_label(d, step_size) for d in dates}
+        for step, value in enumerate(y_pred):
+            label = period_label(first_period + step * step_size, step_size)
+            if not wanted or label in wanted:
+                forecasts.append({'subba': subba, 'date': label,
+                                  'prediction': float(value)})
+    return forecasts
+
+def make_prediction(event=None):
+    config = get_config()
 
     dbname = config.data.conn_params.dbname
     user = config.data.conn_params.user
     password = config.data.conn_params.password
     host = config.data.conn_params.host
     port = config.data.conn_params.port
-    
-    TRACKING_URI = f'postgresql://{user}:{password}@{host}:{port}/{dbname}'
-    mlflow.set_tracking_uri(TRACKING_URI)
-    
-    model_name = config.mlflow.model_name + '-reg'
-    
-    try: 
+
+    # An explicit MLFLOW_TRACKING_URI (e.g. a local file store) wins.
+    if 'MLFLOW_TRACKING_URI' not in os.environ:
+        TRACKING_URI = f'postgresql://{user}:{password}@{host}:{port}/{dbname}'
+        mlflow.set_tracking_uri(TRACKING_URI)
+
+    subba = os.getenv('SUBBA', config.data.api.query.SUBBA)
+    model_name = f"{config.mlflow.model_name}-{subba}-reg"
+
+    try:
         os.chdir("/tmp")
+        if event and event.keys() & {'subbas', 'dates', 'horizon'}:
+            return {"forecasts": batch_forecast(config, event)}
+
         pred = predict(model_name=model_name)
 
         # Return the result as JSON
         result = {"prediction": str(float(pred))}
         return result
-    
+
     except Exception as e:
         return {"Exception": str(e)}
 
 #
 def lambda_handler(event, context):
-    result = make_prediction()
+    # The first invocation also composes the config, which turns the
+    # instrumentation on; later ones are timed from the start.
+    with instrumentation.stage('lambda_handler') as stage:
+        result = make_prediction(event)
+        stage.set(rows=len(result.get('forecasts', [result])))
     return result
 
 if __name__ == "__main__":
-    lambda_handler()
\ No newline at end of file
+    lambda_handler(None, None)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Lean prediction handler serving an exported inference bundle.
+
+Only numpy and xgboost are imported. Configuration comes from plain
+environment variables:
+
+    BUNDLE_URI             s3://bucket/bundles/<model> or a local directory
+    BUNDLE_DIR             local copies of S3 bundles, /tmp/bundle by default
+    BUNDLE_CHECK_INTERVAL  seconds between checks for a newly published
+                           bundle, 300 by default
+"""
+import os
+import time
+import shutil
+
+import xgboost as xgb
+
+import run_artifacts
+from scoring import BoosterScorer
+
+BUNDLE_DIR = os.getenv('BUNDLE_DIR', '/tmp/bundle')
+CHECK_INTERVAL = float(os.getenv('BUNDLE_CHECK_INTERVAL', '300'))
+
+# Kept across warm invocations of the same container.
+_bundle = None
+
+def s3_client():
+    # boto3 ships with the Lambda runtime; only imported for S3 bundles.
+    import boto3
+    return boto3.client('s3')
+
+def s3_key(uri, name):
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    return bucket, prefix.rstrip('/') + '/' + name
+
+def bundle_version(uri):
+    """
+    Version of the bundle published at `uri`: the ETag of its manifest
+    on S3, a single HEAD request, or the content hash of a local one.
+    """
+    if not uri.startswith('s3://'):
+        return run_artifacts.read_manifest(uri)['content_hash']
+    bucket, key = s3_key(uri, run_artifacts.MANIFEST)
+    return s3_client().head_object(Bucket=bucket, Key=key)['ETag']
+
+def fetch_bundle(uri, dst_root):
+    """
+    Return a local directory holding the bundle found at `uri`, and the
+    bundle's version.
+
+    S3 bundles are downloaded into a directory of their own under
+    `dst_root`, so that the bundle being served is left intact. The
+    manifest comes first, and the files it lists are checked against
+    their hashes.
+    """
+    if not uri.startswith('s3://'):
+        return uri, bundle_version(uri)
+
+    s3 = s3_client()
+    bucket, key = s3_key(uri, run_artifacts.MANIFEST)
+    response = s3.get_object(Bucket=bucket, Key=key)
+    version = response['ETag']
+
+    dst_path = os.path.join(dst_root, version.strip('"'))
+    os.makedirs(dst_path, exist_ok=True)
+    with open(os.path.join(dst_path, run_artifacts.MANIFEST), 'wb') as f_out:
+        f_out.write(response['Body'].read())
+    manifest = run_artifacts.read_manifest(dst_path)
+    for name in manifest['files']:
+        s3.download_file(bucket, s3_key(uri, name)[1], os.path.join(dst_path, name))
+    run_artifacts.verify_files(dst_path, manifest)
+    return dst_path, version
+
+def load_bundle(path):
+    manifest = run_artifacts.read_manifest(path)
+    if run_artifacts.MODEL not in manifest['files']:
+        raise ValueError(f"{path} holds run artifacts without a model.")
+
+    booster = xgb.Booster()
+    booster.load_model(os.path.join(path, run_artifacts.MODEL))
+
+    # Checks the bundle schema and feature types against the model.
+    scorer = BoosterScorer(booster, manifest['schema'])
+    scorer.check_types(manifest['feature_types'])
+    return {
+        'scorer': scorer,
+        'recent': run_artifacts.load_recent(path, manifest),
+        'path': path,
+    }
+
+def get_bundle():
+    """
+    Return the cached bundle, loading it on the first call.
+
+    The published bundle's version is checked at most every
+    CHECK_INTERVAL seconds, and a newly published bundle is fetched and
+    loaded. If the check or the new bundle fails, the cached bundle
+    keeps being served until the next check.
+    """
+    global _bundle
+    now = time.monotonic()
+    if _bundle is not None and now - _bundle['checked_at'] < CHECK_INTERVAL:
+        return _bundle
+
+    uri = os.environ['BUNDLE_URI']
+    try:
+        if _bundle is not None and bundle_version(uri) == _bundle['version']:
+            _bundle['checked_at'] = now
+            return _bundle
+        path, version = fetch_bundle(uri, BUNDLE_DIR)
+        bundle = load_bundle(path)
+    except Exception as e:
+        if _bundle is None:
+            raise
+        print("Bundle check failed, serving the cached bundle:", e)
+        _bundle['checked_at'] = now
+        return _bundle
+
+    bundle.update(version=version, checked_at=now)
+    if uri.startswith('s3://') and os.path.isdir(BUNDLE_DIR):
+        # Older copies will not be served again.
+        for other in os.listdir(BUNDLE_DIR):
+            if os.path.join(BUNDLE_DIR, other) != path:
+                shutil.rmtree(os.path.join(BUNDLE_DIR, other), ignore_errors=True)
+    _bundle = bundle
+    return _bundle
+
+def predict(bundle, X):
+    # Categorical splits are evaluated on the codes as they are.
+    return bundle['scorer'].predict(X)
+
+def lambda_handler(event, context):
+    try:
+        bundle = get_bundle()
+        pred = predict(bundle, bundle['recent'])
+        return {"prediction": str(float(pred[0]))}
+    except Exception as e:
+        return {"Exception": str(e)}
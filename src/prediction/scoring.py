@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Scoring with a raw XGBoost booster, shared by the prediction handlers.
+
+Only numpy, xgboost and run_artifacts are imported, so that the lean
+image can use it.
+"""
+import threading
+
+import numpy as np
+import xgboost as xgb
+
+from run_artifacts import feature_rows
+
+
+class BoosterScorer(object):
+    """
+    Score float32 feature rows with a raw XGBoost booster.
+
+    Rows are in schema order, with category codes for categorical
+    features and NaN for unknown values, and are scored with
+    inplace_predict: no DMatrix, no pandas conversion and no schema
+    enforcement per call. The schema is checked against the booster's
+    feature names once, when the scorer is built, and frames with
+    `check_frame` when they are first seen. Frames are converted into a
+    float32 buffer of the calling thread that is reused between calls.
+    """
+    def __init__(self, booster: xgb.Booster, schema: list):
+        names = booster.feature_names
+        if names is not None and list(names) != list(schema):
+            raise ValueError("Schema does not match the model features.")
+
+        self.booster = booster
+        self.schema = list(schema)
+        types = booster.feature_types or ['float'] * len(self.schema)
+        self.categorical = [t == 'c' for t in types]
+
+        # Only the trees up to the early stopping point were validated.
+        best_iteration = booster.attr('best_iteration')
+        self.iteration_range = (
+            (0, int(best_iteration) + 1) if best_iteration is not None else (0, 0)
+        )
+        self._local = threading.local()
+
+    @classmethod
+    def from_model(cls, model, schema: list):
+        """
+        Scorer of a fitted XGBRegressor, e.g. from mlflow.xgboost.load_model.
+        """
+        return cls(model.get_booster(), schema)
+
+    def index(self, column: str) -> int:
+        return self.schema.index(column)
+
+    def buffer(self, n_rows: int) -> np.ndarray:
+        """
+        Preallocated float32 rows of this thread, grown when needed.
+        """
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or len(buffer) < n_rows:
+            buffer = np.empty((n_rows, len(self.schema)), dtype='float32')
+            self._local.buffer = buffer
+        return buffer[:n_rows]
+
+    def check_frame(self, df):
+        """
+        Raise a ValueError unless `df` holds every feature of the schema,
+        categorical where the model expects a category.
+        """
+        missing = [c for c in self.schema if c not in df.columns]
+        if missing:
+            raise ValueError(f"Missing features: {', '.join(missing)}.")
+        for column, categorical in zip(self.schema, self.categorical):
+            if hasattr(df[column], 'cat') != categorical:
+                raise ValueError(
+                    f"{column} should {'' if categorical else 'not '}be categorical."
+                )
+
+    def check_types(self, feature_types: list):
+        """
+        Raise a ValueError unless `feature_types` mark the same features
+        as categorical as the model.
+        """
+        if [t == 'c' for t in feature_types] != self.categorical:
+            raise ValueError("Feature types do not match the model features.")
+
+    def rows(self, df, out: np.ndarray = None) -> np.ndarray:
+        """
+        Write the features of a checked frame in schema order into
+        `out`, the buffer of this thread by default. The buffer is
+        overwritten by the next call; copy rows that are kept.
+        """
+        return feature_rows(
+            df, self.schema, self.buffer(len(df)) if out is None else out
+        )
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predict float32 rows of shape (n, len(schema)).
+        """
+        return self.booster.inplace_predict(X, iteration_range=self.iteration_range)
+
+    def predict_frame(self, df) -> np.ndarray:
+        return self.predict(self.rows(df))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+
+
+def civil_from_days(days: np.ndarray) -> tuple:
+    """
+    Convert days since 1970-01-01 to proleptic Gregorian dates.
+
+    Uses integer arithmetic only (H. Hinnant's `civil_from_days`), so the
+    whole array is converted without going through datetime objects.
+
+    Args:
+        days (np.ndarray): int64 days since the Unix epoch.
+
+    Returns:
+        tuple: year, month and day arrays.
+    """
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def days_from_civil(year: np.ndarray, month: int = 1, day: int = 1) -> np.ndarray:
+    """
+    Inverse of `civil_from_days`: days since 1970-01-01 for a date.
+    """
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def calendar_features(days: np.ndarray) -> dict:
+    """
+    Compute calendar features from an int64 epoch-day array.
+
+    Args:
+        days (np.ndarray): int64 days since the Unix epoch.
+
+    Returns:
+        dict: Compact integer arrays keyed by feature name. The day of
+              the week is coded 0 (Monday) to 6 (Sunday).
+    """
+    year, month, day = civil_from_days(days)
+
+    # 1970-01-01 was a Thursday.
+    day_of_week = (days + 3) % 7
+
+    # ISO weeks belong to the year of their Thursday.
+    thursday = days - day_of_week + 3
+    iso_year, _, _ = civil_from_days(thursday)
+    week_of_year = (thursday - days_from_civil(iso_year)) // 7 + 1
+
+    return {
+        'year': year.astype('int16'),
+        'month': month.astype('int16'),
+        'day': day.astype('int16'),
+        'day_of_week': day_of_week.astype('int8'),
+        'quarter': ((month - 1) // 3 + 1).astype('int8'),
+        'week_of_year': week_of_year.astype('int16'),
+        'is_weekend': (day_of_week >= 5).astype('int8'),
+    }
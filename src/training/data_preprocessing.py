@@ -1,12 +1,25 @@
 #!/usr/bin/env python
 # coding: utf-8
+import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 
 from sklearn.preprocessing import OneHotEncoder
 # from prefect import task, flow
 import hydra
 
 from db_store import DatabaseHandler
+from calendar_features import calendar_features
+
+# Days covered by the rolling statistics.
+WINDOW_SIZE = 7
+
+
+def lag_name(lag: int) -> str:
+    """
+    Column name of a lag feature, 'lag' for the previous period.
+    """
+    return 'lag' if lag == 1 else f'lag_{lag}'
 
 # @task(retries=3, retry_delay_seconds=5)
 # def read_from_db(
@@ -33,25 +46,42 @@ from db_store import DatabaseHandler
 #         df = pd.read_sql_query(query, conn).reset_index(drop=True)
 #     return df
 
-# @task(retries=3, retry_delay_seconds=5)
-def filter_by_iqr(df: pd.DataFrame) -> pd.DataFrame:
+def iqr_bounds(values: pd.Series) -> tuple:
     """
-    Filter DataFrame using the Interquartile Range (IQR) method.
+    Compute the acceptable range of values using the IQR rule.
 
     Args:
-        df (pd.DataFrame): DataFrame containing the "value" column.
+        values (pd.Series): Values to compute the bounds from.
 
     Returns:
-        pd.DataFrame: Filtered DataFrame with outliers removed.
+        tuple: Lower and upper bound.
     """
     # Compute the IQR for the "value" column
-    Q1 = df['value'].quantile(0.25)
-    Q3 = df['value'].quantile(0.75)
+    Q1 = values.quantile(0.25)
+    Q3 = values.quantile(0.75)
     IQR = Q3 - Q1
 
     # Define bounds for the acceptable range
     lower_bound = Q1 - 1.5 * IQR
     upper_bound = Q3 + 1.5 * IQR
+    return float(lower_bound), float(upper_bound)
+
+# @task(retries=3, retry_delay_seconds=5)
+def filter_by_iqr(df: pd.DataFrame, bounds: tuple = None) -> pd.DataFrame:
+    """
+    Filter DataFrame using the Interquartile Range (IQR) method.
+
+    Args:
+        df (pd.DataFrame): DataFrame containing the "value" column.
+        bounds (tuple): Precomputed (lower, upper) bounds. Computed from
+            `df` when not given.
+
+    Returns:
+        pd.DataFrame: Filtered DataFrame with outliers removed.
+    """
+    if bounds is None:
+        bounds = iqr_bounds(df['value'])
+    lower_bound, upper_bound = bounds
 
     # Remove rows where the "value" column is outside the bounds.
     filt = (df['value'] >= lower_bound) & (df['value'] <= upper_bound)
@@ -62,85 +92,227 @@ def filter_by_iqr(df: pd.DataFrame) -> pd.DataFrame:
 # @task(retries=3, retry_delay_seconds=5)
 def extract_features(
         df: pd.DataFrame,
-        window_size=7,
-        inference=False
+        window_size=WINDOW_SIZE,
+        inference=False,
+        hourly=False
 ) -> pd.DataFrame:
     """
     Extract date-related and rolling statistics features from DataFrame.
 
+    All calendar features are computed with integer arithmetic on one
+    epoch-day array, and the result is assembled into a new frame once.
+    The day of the week is an integer code, 0 (Monday) to 6 (Sunday).
+    Values are kept as int32 and the rolling statistics are stored as
+    float32, the precision XGBoost trains with.
+
     Args:
         df (pd.DataFrame): DataFrame with 'period' and 'value' columns.
+        window_size (int): Rows covered by the rolling statistics.
+        hourly (bool): Add the hour of the day as an 'hour' column.
 
     Returns:
         pd.DataFrame: DataFrame with added date features and rolling stats.
     """
-    df = df.copy()
-    df['period'] = df['period'].astype('datetime64[ns]')
-    df['timezone'] = df['timezone'].astype('category')
-    df['value'] = df['value'].astype('int64')
+    period = df['period'].to_numpy()
+    if not np.issubdtype(period.dtype, np.datetime64):
+        period = pd.to_datetime(df['period']).to_numpy()
+    hours = period.astype('datetime64[h]').astype('int64')
+    days = hours // 24
+    value = df['value'].to_numpy(dtype='int32')
+
+    # Rows before the first full rolling window have no statistics.
+    keep = slice(None) if inference else slice(window_size - 1, None)
+
+    data = {}
+    for column in df.columns:
+        if column == 'period':
+            data[column] = period[keep]
+        elif column == 'value':
+            data[column] = value[keep]
+        elif column == 'timezone':
+            data[column] = pd.Categorical(df[column])[keep]
+        else:
+            data[column] = df[column].to_numpy()[keep]
+
+    for name, values in calendar_features(days[keep]).items():
+        data[name] = values
+    if hourly:
+        data['hour'] = (hours[keep] % 24).astype('int8')
 
-    # Separate date features
-    df['year'] = df['period'].dt.year.astype('int16')
-    df['month'] = df['period'].dt.month.astype('int16')
-    df['day'] = df['period'].dt.day.astype('int16')
+    if not inference:
+        # Rolling sums from exact integer prefix sums
+        value = value.astype('int64')
+        csum = np.concatenate(([0], np.cumsum(value)))
+        csum2 = np.concatenate(([0], np.cumsum(value * value)))
+        total = (csum[window_size:] - csum[:-window_size]).astype('float64')
+        total2 = (csum2[window_size:] - csum2[:-window_size]).astype('float64')
 
-    # Extract the day of the week
-    df['day_of_week'] = df['period'].dt.day_name().astype('category')
+        data['rolling_mean'] = (total / window_size).astype('float32')
+        data['rolling_std'] = np.sqrt(np.maximum(
+            (total2 - total * total / window_size) / (window_size - 1), 0
+        )).astype('float32')
 
-    # Extract quarterly and weekly information to capture seasonality
-    df['quarter'] = df['period'].dt.quarter.astype('int8')
-    df['week_of_year'] = df['period'].dt.isocalendar().week.astype('int16')
+    return pd.DataFrame(data, copy=False)
 
-    # Mark the weekends
-    df['is_weekend'] = (df['period'].dt.weekday >= 5).astype('int8')
-    
-    if not inference:
-        # Create rolling mean feature
-        df['rolling_mean'] = df['value'].rolling(window=window_size).mean()
-    
-        # Create rolling standard deviation feature
-        df['rolling_std'] = df['value'].rolling(window=window_size).std()
-    
-    # Remove NaNs introduced by the rolling mean and std
-    df = df.dropna().copy().reset_index(drop=True)
+def lag_schema(lags: tuple = (1,), rolling: tuple = ()) -> list:
+    """
+    Names of the columns built by lag_features, in order.
+    """
+    names = [lag_name(lag) for lag in lags]
+    for lag, window in rolling:
+        names += [f'rolling_mean_{lag}_{window}', f'rolling_std_{lag}_{window}']
+    return names
+
+def lag_features(
+        value: np.ndarray,
+        lags: tuple = (1,),
+        rolling: tuple = (),
+        positions: np.ndarray = None
+):
+    """
+    Build lag and lagged rolling window features into one array.
 
-    return df
+    The series is laid out on a regular grid, padded in front so that
+    every feature of a row lies within the padded grid. Lags are read
+    from a strided sliding-window view of the grid. A lagged window
+    (lag, window) covers the `window` steps ending `lag` steps before the
+    row; its mean and sample standard deviation come from prefix sums
+    that are shared by all windows, and are NaN with fewer than two
+    observed values. Every feature is written straight into its column
+    of one preallocated array, so the temporary memory does not grow
+    with the number of features.
+
+    Rows are kept when all their lags are observed and all their windows
+    start within the series.
+
+    Args:
+        value (np.ndarray): Integer values of the series.
+        lags (tuple): Lags in grid steps.
+        rolling (tuple): (lag, window) pairs in grid steps.
+        positions (np.ndarray): Grid step of every value, increasing.
+            Consecutive rows are consecutive steps when not given.
+
+    Returns:
+        tuple: float32 array of shape (kept rows, features) in column
+              major order, its column names from lag_schema and the mask
+              of the kept rows.
+    """
+    reach = max([*lags, *(lag + window - 1 for lag, window in rolling)])
+    if positions is None:
+        positions = np.arange(len(value))
+    elif len(positions):
+        positions = positions - positions[0]
+    size = int(positions[-1]) + 1 if len(positions) else 0
+
+    grid = np.zeros(size + reach, dtype='int64')
+    observed = np.zeros(size + reach, dtype=bool)
+    grid[positions + reach] = value
+    observed[positions + reach] = True
+
+    # Window p holds grid steps p - reach .. p, so lag k is column
+    # reach - k of the window of the row's own step.
+    lag_columns = reach - np.asarray(lags)[None, :]
+    complete = positions >= reach
+    complete[complete] = sliding_window_view(observed, reach + 1)[
+        positions[complete][:, None], lag_columns
+    ].all(axis=1)
+    kept = positions[complete]
+
+    schema = lag_schema(lags, rolling)
+    features = np.empty((len(kept), len(schema)), dtype='float32', order='F')
+    windows = sliding_window_view(grid, reach + 1)
+    for j, lag in enumerate(lags):
+        features[:, j] = windows[kept, reach - lag]
+
+    if rolling:
+        # Exact integer prefix sums over the padded grid.
+        csum = np.concatenate(([0], np.cumsum(grid)))
+        csum2 = np.concatenate(([0], np.cumsum(grid * grid)))
+        ccount = np.concatenate(([0], np.cumsum(observed)))
+
+    j = len(lags)
+    for lag, window in rolling:
+        # Padded steps kept - lag - window + 1 + reach .. kept - lag + reach
+        stop = kept + (reach - lag + 1)
+        start = stop - window
+        count = (ccount[stop] - ccount[start]).astype('float64')
+        total = (csum[stop] - csum[start]).astype('float64')
+        total2 = (csum2[stop] - csum2[start]).astype('float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            features[:, j] = np.where(count >= 2, total / count, np.nan)
+            features[:, j + 1] = np.where(count >= 2, np.sqrt(np.maximum(
+                (total2 - total * total / count) / (count - 1), 0
+            )), np.nan)
+        j += 2
+    return features, schema, complete
 
 # @task(retries=3, retry_delay_seconds=5)
-def transform_to_supervised(df: pd.DataFrame) -> pd.DataFrame:
+def transform_to_supervised(
+        df: pd.DataFrame,
+        lags: tuple = (1,),
+        rolling: tuple = (),
+        unit: str = None
+) -> pd.DataFrame:
     """
     Transform DataFrame into a supervised learning format.
 
+    The input frame is not modified. Its columns are subset to the kept
+    rows once, and the lag features are added as columns of the array
+    built by lag_features.
+
     Args:
         df (pd.DataFrame): Input DataFrame.
+        lags (tuple): Lags of the value to add as features.
+        rolling (tuple): (lag, window) pairs of lagged rolling windows.
+        unit (str): NumPy datetime unit of the period grid, e.g. 'h'.
+            Lags then count periods, so that a missing or filtered
+            period is not bridged. Lags count rows when None.
 
     Returns:
-        pd.DataFrame: DataFrame with 'lag' column and 'period' dropped.
+        pd.DataFrame: DataFrame with the lag_schema columns appended,
+            without rows lacking a lag, and 'period' dropped.
     """
-    
-    # Create 'lag' column by shifting 'value' column
-    df.loc[:, 'lag'] = df['value'].shift()
-
-    # Remove rows with missing values (NaN) due to the shift
-    df.dropna(inplace=True)
-
-    # Convert 'lag' column to unsigned 64-bit integer type
-    df.lag = df.lag.astype('int64')
-
-    # Drop the 'period' column from the DataFrame
-    df = df.drop(columns=['period'])
-    return df
+    positions = None
+    if unit is not None:
+        positions = df['period'].to_numpy().astype(f'datetime64[{unit}]').astype('int64')
+    features, schema, complete = lag_features(
+        df['value'].to_numpy(), lags, rolling, positions
+    )
+
+    data = {}
+    for column in df.columns:
+        if column == 'period':
+            continue
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            data[column] = pd.Categorical(df[column])[complete]
+        else:
+            data[column] = df[column].to_numpy()[complete]
+    for j, name in enumerate(schema):
+        data[name] = features[:, j]
+    return pd.DataFrame(data, index=df.index[complete], copy=False)
 
 # @task(retries=3, retry_delay_seconds=5)
-def encode_categorical(df: pd.DataFrame, ohe=None, fit=True) -> pd.DataFrame:
+def encode_categorical(
+        df: pd.DataFrame, 
+        ohe=None, 
+        fit=True, 
+        encoding='onehot'
+) -> pd.DataFrame:
     """
-    Encode categorical columns as dummy variables.
+    Encode categorical columns as dummy variables or category codes.
+
+    With `encoding='native'` each categorical column is kept as a single
+    pandas category column whose categories are fixed to the ones learned
+    by the encoder, for XGBoost's `enable_categorical`. Values unseen
+    during fitting become missing. The encoder is fitted in both modes so
+    that the saved artifact has the same shape.
 
     Args:
         df (pd.DataFrame): Input DataFrame.
+        encoding (str): 'onehot' for dense dummies, 'native' for codes.
 
     Returns:
-        pd.DataFrame: DataFrame with categorical columns encoded as dummy variables.
+        pd.DataFrame: DataFrame with categorical columns encoded.
     """ 
     df = df.reset_index(drop=True)
     
@@ -150,6 +322,13 @@ def encode_categorical(df: pd.DataFrame, ohe=None, fit=True) -> pd.DataFrame:
     # List of columns to encode as dummy variables
     feat_to_enc = df.select_dtypes('category')
 
+    if encoding == 'native':
+        if fit == True:
+            ohe.fit(feat_to_enc)
+        for column, categories in zip(feat_to_enc.columns, ohe.categories_):
+            df[column] = pd.Categorical(df[column], categories=categories)
+        return df, ohe
+
     # Get dummy variables for the specified columns
     if fit == True:
         dummies = pd.DataFrame(ohe.fit_transform(feat_to_enc))
@@ -164,25 +343,36 @@ def encode_categorical(df: pd.DataFrame, ohe=None, fit=True) -> pd.DataFrame:
 def prepare_for_inference(df: pd.DataFrame,
         last_day_rolling_vals: pd.DataFrame,
         ohe: OneHotEncoder, 
-        schema: list
+        schema: list,
+        encoding: str = 'onehot',
+        lag_values: dict = None
 ) -> pd.DataFrame:
-        df = extract_features(df, inference=True)
+        df = extract_features(df, inference=True, hourly='hour' in schema)
         df = df.rename(columns={'value': 'lag'})
-        df, _ = encode_categorical(df, ohe=ohe, fit=False)
+        # Lag features other than the last observation, e.g. from
+        # PreprocessState.inference_features.
+        for name, value in (lag_values or {}).items():
+            df[name] = value
+        df, _ = encode_categorical(df, ohe=ohe, fit=False, encoding=encoding)
         df[['rolling_mean', 'rolling_std']] = last_day_rolling_vals
         X_recent = df[schema]
         return X_recent
 
 # @hydra.main(config_path='conf/', config_name='config.yaml')
 # @flow(name="data_preprocessing flow", retries=3, retry_delay_seconds=5)
-def preprocess(df):
+def preprocess(df, bounds=None, encoding='onehot',
+               window_size=WINDOW_SIZE, lags=(1,), rolling=(), hourly=False):
     # Clean it up, extract date features and running statistics.
-    df_no_outliers = filter_by_iqr(df)
-    df_newfeat= extract_features(df_no_outliers)
+    df_no_outliers = filter_by_iqr(df, bounds=bounds)
+    df_newfeat= extract_features(
+        df_no_outliers, window_size=window_size, hourly=hourly
+    )
     
     # Preprocess the dataset for model input.
-    df_transformed = transform_to_supervised(df_newfeat)
-    df_encoded, ohe = encode_categorical(df_transformed)
+    df_transformed = transform_to_supervised(
+        df_newfeat, lags=lags, rolling=rolling, unit='h' if hourly else None
+    )
+    df_encoded, ohe = encode_categorical(df_transformed, encoding=encoding)
     return df_encoded, ohe
 
 if __name__ == "__main__":
@@ -1,32 +1,49 @@
 #!/usr/bin/env python
 # coding: utf-8
 import os
+import io
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from hydra import initialize, compose
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timedelta
 
 import psycopg2
 from psycopg2 import extras
 from psycopg2.errors import OperationalError
 
+import instrumentation
+
 
 class URLParser(object):
-    def __init__(self, config):
+    def __init__(self, config, subba=None, start_date=None):
         self.config = config
         
-        self.subba = config.data.api.query.SUBBA
-        self.start_date = config.data.api.query.START_DATE
+        self.subba = subba or config.data.api.query.SUBBA
+        self.start_date = start_date or config.data.api.query.START_DATE
         self.end_date = config.data.api.query.END_DATE
         self.offset = config.data.api.query.OFFSET
         self.chunk_len = config.data.api.query.CHUNK_LEN
         self.api_key = os.getenv('API_KEY')
 
-    def construct_url(self, tab_name):
+    def construct_url(self, tab_name, offset=None):
+        """
+        Build the request URL for a table.
+
+        The offset can be passed explicitly so that several workers can
+        build URLs for different pages without touching shared state.
+        """
+        if offset is None:
+            offset = self.offset
+
         replacements = {
             "<SUBBA_CODE>": str(self.subba),
             "<START_DATE>": str(self.start_date),
-            "<OFFSET>": str(self.offset),
+            "<OFFSET>": str(offset),
             "<CHUNK_LEN>": str(self.chunk_len),
             "<API_KEY>": str(self.api_key)
         }
@@ -44,11 +61,139 @@ class URLParser(object):
         for old, new in replacements.items():
             url = url.replace(old, new)
         return url
-        
+
+
+class ChunkDownloader(object):
+    """
+    Download API pages concurrently over a pooled HTTP session.
+
+    Page offsets are derived from the total row count reported by the
+    first response. Offsets that have been stored are written to a
+    checkpoint file with the query's start date, so an interrupted
+    backfill resumes with the pages that are still missing.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, urlparser, tab_name, max_workers=4, max_retries=5,
+                 backoff=1.0, timeout=30, checkpoint_path=None):
+        self.urlparser = urlparser
+        self.tab_name = tab_name
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.checkpoint_path = checkpoint_path
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, url):
+        """
+        GET a page and return the decoded JSON, retrying with
+        exponential backoff on connection errors and retryable statuses.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in self.RETRY_STATUSES:
+                    response.raise_for_status()
+                error = f"status code {response.status_code}"
+            except requests.exceptions.HTTPError:
+                raise
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+
+            if attempt < self.max_retries:
+                delay = self.backoff * 2 ** attempt
+                print(f"Request failed ({error}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+        raise requests.exceptions.RetryError(
+            f"Giving up after {self.max_retries + 1} attempts: {error}"
+        )
+
+    def _checkpoint_key(self):
+        # A checkpoint is only valid for the exact query it was written for.
+        parser = self.urlparser
+        return ":".join(str(part) for part in (
+            self.tab_name, parser.subba, parser.start_date,
+            parser.end_date, parser.chunk_len
+        ))
+
+    def load_checkpoint(self):
+        if self.checkpoint_path is None \
+                or not os.path.isfile(self.checkpoint_path):
+            return set()
+
+        with open(self.checkpoint_path) as f_in:
+            checkpoint = json.load(f_in)
+
+        if checkpoint.get('key') != self._checkpoint_key():
+            return set()
+        return set(checkpoint['done'])
+
+    def save_checkpoint(self, done):
+        if self.checkpoint_path is None:
+            return
+
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f_out:
+            json.dump({'key': self._checkpoint_key(),
+                       'start_date': str(self.urlparser.start_date),
+                       'done': sorted(done)}, f_out)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        if self.checkpoint_path is not None \
+                and os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def offsets(self, total_rows):
+        return range(self.urlparser.offset, total_rows,
+                     self.urlparser.chunk_len)
+
+    def download(self, total_rows, first_page=None, done=()):
+        """
+        Yield (offset, rows) for every page not listed in `done`.
+
+        Args:
+            total_rows (int): Total row count reported by the API.
+            first_page (dict): Already fetched response for the first
+                offset, reused instead of being downloaded again.
+            done (set): Offsets that are already stored.
+
+        Yields:
+            tuple: Page offset and the list of rows on that page.
+        """
+        pending = [o for o in self.offsets(total_rows) if o not in done]
+
+        if first_page is not None and pending \
+                and pending[0] == self.urlparser.offset:
+            yield pending.pop(0), first_page['response']['data']
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(
+                    self.fetch,
+                    self.urlparser.construct_url(self.tab_name, offset)
+                ): offset
+                for offset in pending
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()['response']['data']
+
 class DatabaseHandler(object):
     def __init__(self, config):
         self.config = config
         self.conn = None
+        self.layout = config.data.tab_params.LAYOUT
             
     def connect(self):
         # Connection logic
@@ -90,14 +235,18 @@ class DatabaseHandler(object):
         cur.close()
         return exists
     
-    def create_table(self, tab_name, tab_schema):
+    def create_table(self, tab_name, tab_schema, rebuild=False):
+        """
+        Create the table from its schema. The schema is idempotent, so an
+        existing table is kept unless `rebuild` asks for a drop first.
+        """
         if self.conn is not None:
             cur = self.conn.cursor()
-            if self.table_exists(tab_name):
+            if rebuild and self.table_exists(tab_name):
                 print(f"Table {tab_name} already exists. Dropping it " \
                       + "and creating a new one.")
                 
-                cur.execute(f"DROP TABLE {tab_name};")
+                cur.execute(f"DROP TABLE {tab_name} CASCADE;")
                 self.conn.commit()
 
             cur.execute(tab_schema)
@@ -115,11 +264,103 @@ class DatabaseHandler(object):
             print(f"Failed to fetch data. Status code: {response.status_code}")
             return None
 
+    def storage_table(self, tab_name, layout=None):
+        """
+        Name of the table that physically stores `tab_name` rows.
+        """
+        if (layout or self.layout) == 'typed':
+            return f"{tab_name}_typed"
+        return tab_name
+
+    def read_relation(self, tab_name):
+        """
+        Relation exposing `tab_name` rows with the legacy column names.
+        """
+        if self.layout == 'typed':
+            return f"{tab_name}_typed_v"
+        return tab_name
+
+    def table_schema(self, tab_name, layout=None):
+        """
+        DDL for the storage table of the configured layout.
+        """
+        tab_params = self.config.data.tab_params
+        tab_schema = tab_params.tab_schema[self.storage_table(tab_name, layout)]
+
+        partition = ''
+        if tab_params.PARTITION == 'monthly':
+            partition = 'PARTITION BY RANGE (period)'
+        return tab_schema.replace('<PARTITION_CLAUSE>', partition)
+
+    def ensure_partitions(self, tab_name, start, end):
+        """
+        Create the monthly range partitions covering [start, end].
+        """
+        if self.config.data.tab_params.PARTITION != 'monthly' \
+                or start is None:
+            return
+
+        cur = self.conn.cursor()
+        month = start.replace(day=1)
+        while month <= end:
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            cur.execute(
+                f"""CREATE TABLE IF NOT EXISTS {tab_name}_{month:%Y%m}
+                PARTITION OF {tab_name}
+                FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month:%Y-%m-%d}');"""
+            )
+            month = next_month
+        cur.close()
+
+    def latest_periods(self, tab_name):
+        """
+        Return the most recent stored period for every subba.
+        """
+        cur = self.conn.cursor()
+        if self.layout == 'typed':
+            # One primary key probe per subba instead of a full scan.
+            cur.execute(
+                f"""SELECT s.subba, (
+                    SELECT max(d.period) FROM {tab_name}_typed d
+                    WHERE d.subba_code = s.code
+                ) FROM subba_codes s;"""
+            )
+        else:
+            cur.execute(
+                f"SELECT subba, max(period) FROM {tab_name} GROUP BY subba;"
+            )
+        latest = dict(cur.fetchall())
+        cur.close()
+        return latest
+
+    @staticmethod
+    def upsert_clause(tab_name, schema, key):
+        """
+        Build the ON CONFLICT clause that updates revised rows on the
+        natural key and leaves unchanged rows untouched.
+        """
+        key_columns = [c.strip() for c in key.split(',')]
+        updates = [
+            c.strip() for c in schema.split(',')
+            if c.strip() not in key_columns
+        ]
+        set_clause = ", ".join(f"{c} = EXCLUDED.{c}" for c in updates)
+        changed = " OR ".join(
+            f"{tab_name}.{c} IS DISTINCT FROM EXCLUDED.{c}" for c in updates
+        )
+        return f"""ON CONFLICT ({key})
+                DO UPDATE SET {set_clause}
+                WHERE {changed}"""
+
     def insert(self,
         data: list,
-        schema: list,
+        schema: str,
         tab_name: str,
+        key: str = 'period, subba, timezone',
     ) -> None:
+        """
+        Upsert rows with a multi-row VALUES statement.
+        """
         if self.conn is not None:
             cur = self.conn.cursor()
 
@@ -128,8 +369,7 @@ class DatabaseHandler(object):
                 cur,
                 f"""INSERT INTO {tab_name} ({schema}) 
                 VALUES %s
-                ON CONFLICT ({schema})
-                DO NOTHING;""",
+                {self.upsert_clause(tab_name, schema, key)};""",
                 data
             )
 
@@ -138,14 +378,424 @@ class DatabaseHandler(object):
         else:
             print("Not connected to a db.")
 
-    def query(self, query):
+    def stage(self, cur, data, schema, tab_name):
+        """
+        COPY rows into a temporary staging table shaped like the read
+        relation of `tab_name` and return the staging table name.
+        """
+        staging = f"{tab_name}_staging"
+
+        # Rows are dropped from the staging table on every commit.
+        cur.execute(
+            f"""CREATE TEMP TABLE IF NOT EXISTS {staging}
+            ON COMMIT DELETE ROWS
+            AS SELECT {schema} FROM {self.read_relation(tab_name)}
+            WITH NO DATA;"""
+        )
+        cur.copy_expert(
+            f"COPY {staging} ({schema}) FROM STDIN",
+            copy_buffer(data)
+        )
+        return staging
+
+    def copy_insert(self,
+        data: list,
+        schema: str,
+        tab_name: str,
+        key: str = 'period, subba, timezone',
+    ) -> None:
+        """
+        Upsert rows by streaming them into a temporary staging table
+        with COPY and merging it into the target in one statement.
+        """
+        if self.conn is not None:
+            if self.layout == 'typed':
+                return self.copy_insert_typed(data, schema, tab_name)
+
+            cur = self.conn.cursor()
+            staging = self.stage(cur, data, schema, tab_name)
+            cur.execute(
+                f"""INSERT INTO {tab_name} ({schema})
+                SELECT DISTINCT ON ({key}) {schema} FROM {staging}
+                ORDER BY {key}
+                {self.upsert_clause(tab_name, schema, key)};"""
+            )
+
+            self.conn.commit()
+            cur.close()
+        else:
+            print("Not connected to a db.")
+
+    def copy_insert_typed(self, data, schema, tab_name):
+        """
+        Upsert rows into the typed layout through a staging table.
+        """
+        cur = self.conn.cursor()
+        staging = self.stage(cur, data, schema, tab_name)
+        self.merge_typed(cur, staging, tab_name)
+        self.conn.commit()
+        cur.close()
+
+    def merge_typed(self, cur, source, tab_name):
+        """
+        Merge rows with legacy column names from `source` into the typed
+        table, assigning codes to subbas and timezones not seen before.
+        """
+        typed = f"{tab_name}_typed"
+        # Hourly tables store timestamps, daily ones dates.
+        period = 'timestamp' if tab_name.endswith('_hourly') else 'date'
+
+        cur.execute(f"SELECT min(period)::date, max(period)::date FROM {source};")
+        self.ensure_partitions(typed, *cur.fetchone())
+
+        # NOT EXISTS keeps the code sequences from advancing on conflicts.
+        cur.execute(
+            f"""INSERT INTO subba_codes
+                (subba, subba_name, parent, parent_name, value_units)
+            SELECT DISTINCT ON (subba)
+                subba, subba_name, parent, parent_name, value_units
+            FROM {source} src
+            WHERE NOT EXISTS (
+                SELECT 1 FROM subba_codes c WHERE c.subba = src.subba
+            )
+            ORDER BY subba
+            ON CONFLICT (subba) DO NOTHING;"""
+        )
+        cur.execute(
+            f"""INSERT INTO timezone_codes (timezone)
+            SELECT DISTINCT timezone FROM {source} src
+            WHERE NOT EXISTS (
+                SELECT 1 FROM timezone_codes c WHERE c.timezone = src.timezone
+            )
+            ON CONFLICT (timezone) DO NOTHING;"""
+        )
+        cur.execute(
+            f"""INSERT INTO {typed} (subba_code, period, timezone_code, value)
+            SELECT DISTINCT ON (s.code, src.period::{period}, t.code)
+                s.code, src.period::{period}, t.code, src.value
+            FROM {source} src
+            JOIN subba_codes s ON s.subba = src.subba
+            JOIN timezone_codes t ON t.timezone = src.timezone
+            ORDER BY s.code, src.period::{period}, t.code
+            ON CONFLICT (subba_code, period, timezone_code)
+            DO UPDATE SET value = EXCLUDED.value
+            WHERE {typed}.value IS DISTINCT FROM EXCLUDED.value;"""
+        )
+
+    def migrate_to_typed(self, tab_name):
+        """
+        Copy the rows of a legacy VARCHAR table into the typed layout.
+        The legacy table is left in place; switch LAYOUT to `typed` once
+        the copy has been checked.
+        """
+        cur = self.conn.cursor()
+        cur.execute(self.table_schema(tab_name, layout='typed'))
+        self.merge_typed(cur, tab_name, tab_name)
+        self.conn.commit()
+
+        cur.execute(f"SELECT count(*) FROM {tab_name};")
+        legacy_rows = cur.fetchone()[0]
+        cur.execute(f"SELECT count(*) FROM {tab_name}_typed;")
+        typed_rows = cur.fetchone()[0]
+        cur.close()
+        print(f"Migrated {legacy_rows} rows of {tab_name} " \
+              + f"into {typed_rows} rows of {tab_name}_typed.")
+
+    def read_demand(self,
+        tab_name: str,
+        subba: str = None,
+        start: str = None,
+        end: str = None,
+        columns: tuple = ('period', 'timezone', 'value'),
+        chunksize: int = None,
+    ):
+        """
+        Read rows for a time window ordered by subba, period and timezone.
+
+        Rows are streamed through a server-side cursor and decoded batch
+        by batch into typed columns: datetime64 periods, int32 values
+        and categoricals for strings.
+
+        Args:
+            tab_name (str): Base table name, resolved through the layout.
+            subba (str): Only read this subba when given.
+            start (str): First period to read (inclusive).
+            end (str): Last period to read (inclusive).
+            columns (tuple): Columns to project.
+            chunksize (int): Yield DataFrames of at most this many rows
+                instead of returning a single DataFrame.
+
+        Returns:
+            pd.DataFrame or iterator of pd.DataFrame.
+        """
+        where, params = self.window_filter(subba, start, end)
+        query = f"""SELECT {", ".join(columns)}
+            FROM {self.read_relation(tab_name)} {where}
+            ORDER BY subba, period, timezone;"""
+
+        batches = self._read_batches(query, params, columns,
+                                     chunksize or 50000)
+        if chunksize is not None:
+            return batches
+        return concat_batches(list(batches), columns)
+
+    @staticmethod
+    def window_filter(subba=None, start=None, end=None):
+        """
+        Build the WHERE clause and parameters for a subba/period window.
+        """
+        filters, params = [], {}
+        if subba is not None:
+            filters.append("subba = %(subba)s")
+            params['subba'] = subba
+        if start is not None:
+            filters.append("period >= %(start)s")
+            params['start'] = str(start)
+        if end is not None:
+            filters.append("period <= %(end)s")
+            params['end'] = str(end)
+
+        where = ("WHERE " + " AND ".join(filters)) if filters else ""
+        return where, params
+
+    def watermark(self, tab_name, subba=None, start=None, end=None):
+        """
+        Return the latest period and the row count of a window.
+        """
+        where, params = self.window_filter(subba, start, end)
+        cur = self.conn.cursor()
+        cur.execute(
+            f"""SELECT max(period), count(*)
+            FROM {self.read_relation(tab_name)} {where};""",
+            params
+        )
+        latest, n_rows = cur.fetchone()
+        cur.close()
+        return latest, n_rows
+
+    def _read_batches(self, query, params, columns, batch_size):
+        # A named cursor keeps the result set on the server.
+        cur = self.conn.cursor(name='read_demand')
+        cur.itersize = batch_size
+        try:
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield decode_rows(rows, columns)
+        finally:
+            cur.close()
+            self.conn.commit()
+
+    def query(self, query, params=None):
         if self.conn is not None:
             import pandas as pd
-            df = pd.read_sql(query, self.conn)
+            df = pd.read_sql(query, self.conn, params=params)
             return df
         else:
             print("Not connected to a db.")
 
+def decode_rows(rows, columns):
+    """
+    Decode fetched tuples column by column into a typed DataFrame.
+    """
+    import numpy as np
+    import pandas as pd
+
+    data = {}
+    for name, values in zip(columns, zip(*rows)):
+        if name == 'period':
+            data[name] = np.array(values, dtype='datetime64[ns]')
+        elif name == 'value':
+            # INTEGER column, int32 is exact.
+            dtype = 'float64' if None in values else 'int32'
+            data[name] = np.array(values, dtype=dtype)
+        else:
+            data[name] = pd.Categorical(values)
+    return pd.DataFrame(data, columns=list(columns), copy=False)
+
+def concat_batches(batches, columns):
+    """
+    Concatenate decoded batches, merging categorical vocabularies.
+    """
+    import numpy as np
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+
+    if not batches:
+        return decode_rows([], columns)
+    if len(batches) == 1:
+        return batches[0]
+
+    data = {}
+    for name in columns:
+        parts = [batch[name] for batch in batches]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            data[name] = union_categoricals(parts)
+        else:
+            data[name] = np.concatenate([part.to_numpy() for part in parts])
+        for batch in batches:
+            del batch[name]
+    return pd.DataFrame(data, columns=list(columns), copy=False)
+
+def copy_buffer(rows):
+    """
+    Encode rows in the COPY text format into an in-memory buffer.
+    """
+    def encode(value):
+        if value is None:
+            return '\\N'
+        return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+
+    buffer = io.StringIO()
+    buffer.writelines(
+        '\t'.join(map(encode, row)) + '\n' for row in rows
+    )
+    buffer.seek(0)
+    return buffer
+
+def table_name(config):
+    """
+    Base table of the configured data frequency: `tabname` for daily
+    rows and `tabname`_hourly for hourly ones.
+    """
+    tab_name = config.data.tab_params.tabname
+    if config.data.api.query.FREQUENCY == 'hourly':
+        return f"{tab_name}_hourly"
+    return tab_name
+
+def normalize_hourly(data_list):
+    """
+    Make hourly API rows fit the daily row layout. Hourly periods such
+    as 2024-01-01T05 are UTC and come without a timezone.
+    """
+    for row in data_list:
+        row['period'] = row['period'] + ':00'
+        row.setdefault('timezone', 'UTC')
+    return data_list
+
+def checkpoint_path(config, tab_name, subba):
+    """
+    Checkpoint file of one table and subba, named after CHECKPOINT, or
+    None when checkpoints are disabled.
+    """
+    path = config.data.api.download.CHECKPOINT
+    if path is None:
+        return None
+    root, ext = os.path.splitext(path)
+    return f"{root}-{tab_name}-{subba}{ext}"
+
+def checkpoint_start(path):
+    """
+    Start date of the unfinished download checkpointed in `path`, or
+    None.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+    with open(path) as f_in:
+        return json.load(f_in).get('start_date')
+
+def incremental_start(config, latest_period):
+    """
+    Pick the first date to request for a subba: the stored watermark
+    minus an overlap window for late revisions, never before START_DATE.
+    """
+    start_date = datetime.strptime(
+        str(config.data.api.query.START_DATE), '%Y-%m-%d'
+    )
+    if latest_period is None:
+        return start_date.strftime('%Y-%m-%d')
+
+    latest = datetime.strptime(str(latest_period)[:10], '%Y-%m-%d')
+    overlap = timedelta(days=config.data.api.query.OVERLAP_DAYS)
+    return max(start_date, latest - overlap).strftime('%Y-%m-%d')
+
+def ingest_start(config, tab_name, subba, latest_period):
+    """
+    Pick the first date to request for a subba.
+
+    Pages finish out of order and a page that fails to store is skipped,
+    so the watermark can already be past rows that are still missing.
+    An unfinished download of the subba therefore resumes from its own
+    start date, and only a finished one lets the watermark advance.
+    """
+    start_date = checkpoint_start(checkpoint_path(config, tab_name, subba))
+    if start_date is not None:
+        print(f"Resuming the download of {subba} since {start_date}")
+        return start_date
+    return incremental_start(config, latest_period)
+
+def ingest(config, db_store, tab_name, subba, start_date):
+    """
+    Download the rows of a subba since `start_date` and upsert them.
+
+    Returns:
+        tuple: Rows stored and seconds spent storing them.
+    """
+    stored, insert_time = 0, 0.0
+    urlparser = URLParser(config, subba=subba, start_date=start_date)
+    download_params = config.data.api.download
+    downloader = ChunkDownloader(
+        urlparser,
+        tab_name,
+        max_workers=download_params.MAX_WORKERS,
+        max_retries=download_params.MAX_RETRIES,
+        backoff=download_params.BACKOFF,
+        timeout=download_params.TIMEOUT,
+        checkpoint_path=checkpoint_path(config, tab_name, subba)
+    )
+
+    url = urlparser.construct_url(tab_name)
+    data = downloader.fetch(url)
+
+    if data:
+        if tab_name in ('demand', 'demand_hourly'):
+            total_rows = int(data['response']['total'])
+            print(f"Total rows for {subba} since {start_date}:", total_rows)
+
+            done = downloader.load_checkpoint()
+            total_chunks = len(downloader.offsets(total_rows))
+            print("Total chunks to download:", total_chunks - len(done))
+
+            if config.data.tab_params.LOADER == 'copy':
+                load = db_store.copy_insert
+            else:
+                load = db_store.insert
+
+            failed = False
+            for offset, data_list in downloader.download(
+                    total_rows, first_page=data, done=done):
+                if data_list:
+                    if tab_name.endswith('_hourly'):
+                        data_list = normalize_hourly(data_list)
+                    data_tuples = [tuple(d.values()) for d in data_list]
+                    schema = ", ".join(data_list[0].keys()).replace("-", "_")
+
+                    start = time.perf_counter()
+                    try:
+                        load(
+                            data=data_tuples,
+                            schema=schema,
+                            tab_name=tab_name
+                        )
+                    except Exception as e:
+                        print(str(e))
+                        db_store.conn.rollback()
+                        failed = True
+                        continue
+                    finally:
+                        insert_time += time.perf_counter() - start
+                    stored += len(data_tuples)
+
+                done.add(offset)
+                downloader.save_checkpoint(done)
+
+            if not failed:
+                downloader.clear_checkpoint()
+    return stored, insert_time
+
 def main():
     if os.path.isfile('.env'):
         from dotenv import load_dotenv
@@ -155,51 +805,58 @@ def main():
     config = compose(config_name='config.yaml')   
     print(config) 
     print(os.getenv('API_KEY'))
+    instrumentation.configure(config)
 
     # Connect to db
     db_store = DatabaseHandler(config)
     db_store.connect()
 
-    # Create a table
-    tab_name = config.data.tab_params.tabname
-    tab_schema = eval(
-        f'config.data.tab_params.tab_schema.{tab_name}'
+    # Create a table, dropping the old one only for a full reload
+    tab_name = table_name(config)
+    tab_schema = db_store.table_schema(tab_name)
+    full_reload = config.data.api.query.MODE == 'full'
+
+    db_store.create_table(
+        db_store.storage_table(tab_name), tab_schema, rebuild=full_reload
     )
 
-    db_store.create_table(tab_name, tab_schema)
+    subbas = config.data.api.query.SUBBA
+    if isinstance(subbas, str):
+        subbas = [subbas]
 
-    urlparser = URLParser(config)
-    url = urlparser.construct_url(tab_name)
+    latest = {} if full_reload else db_store.latest_periods(tab_name)
+    for subba in subbas:
+        path = checkpoint_path(config, tab_name, subba)
+        if full_reload and path is not None and os.path.isfile(path):
+            # Its pages were stored in the dropped table.
+            os.remove(path)
+        start_date = ingest_start(config, tab_name, subba, latest.get(subba))
+        # Download time is the stage's wall time minus insert_s.
+        with instrumentation.stage('ingest', subba=subba,
+                                   start_date=start_date) as stage:
+            rows, insert_time = ingest(config, db_store, tab_name, subba, start_date)
+            stage.set(rows=rows, insert_s=round(insert_time, 6))
 
-    data = db_store.request_data(url)
+    # Close the connection
+    db_store.close()
 
-    if data:
-        if tab_name == 'demand':
-            total_rows = data['response']['total']
-            print("Total rows:", total_rows)
-            chunk_len = urlparser.chunk_len
-            total_chunks = int(total_rows / chunk_len) + 1
-            print("Total chunks to download:", total_chunks)            
-
-            for i in range(total_chunks):
-                url = urlparser.construct_url(tab_name)
-                data = db_store.request_data(url)
-                data_list = data['response']['data']
-                data_tuples = [tuple(d.values()) for d in data_list]
-                schema = ", ".join(data_list[0].keys()).replace("-", "_")
-
-                try:
-                    db_store.insert(
-                        data=data_tuples,
-                        schema=schema,
-                        tab_name=tab_name
-                    )
-                except Exception as e:
-                    print(str(e))
-                
-                urlparser.offset += chunk_len
+def migrate():
+    if os.path.isfile('.env'):
+        from dotenv import load_dotenv
+        load_dotenv()
 
-    # Close the connection
+    initialize(version_base=None, config_path='../conf/', job_name='demand-forecast')
+    config = compose(config_name='config.yaml')
+    instrumentation.configure(config)
+
+    db_store = DatabaseHandler(config)
+    db_store.connect()
+    with instrumentation.stage('migrate'):
+        db_store.migrate_to_typed(table_name(config))
     db_store.close()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if sys.argv[1:] == ['migrate']:
+        migrate()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from hydra import initialize, compose
+
+THREAD_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+
+def plan_workers(n_tasks, max_workers=None, cores_per_worker=None):
+    """
+    Split the machine's cores between worker processes.
+
+    Returns:
+        tuple: Number of workers and number of cores given to each.
+    """
+    n_cores = os.cpu_count() or 1
+    if cores_per_worker is None:
+        workers = min(max_workers or n_cores, n_tasks, n_cores)
+        cores_per_worker = max(1, n_cores // workers)
+    if max_workers is None:
+        max_workers = max(1, n_cores // cores_per_worker)
+    return min(max_workers, n_tasks), cores_per_worker
+
+
+def _init_worker(cores):
+    # Must run before numpy/xgboost are imported in the worker.
+    for var in THREAD_VARS:
+        os.environ[var] = str(cores)
+
+
+def _train_subba(subba, cores):
+    import main_flow
+
+    start = time.perf_counter()
+    main_flow.train_flow(subba=subba, n_jobs=cores)
+    return time.perf_counter() - start
+
+
+def train_many(subbas, max_workers=None, cores_per_worker=None):
+    """
+    Train one model per subba across a pool of processes.
+
+    Every worker is capped at `cores_per_worker` threads through the
+    OpenMP/BLAS environment and XGBoost's `n_jobs`, so that concurrent
+    workers do not oversubscribe the machine.
+
+    Args:
+        subbas (list): Subba codes to train.
+        max_workers (int): Number of worker processes.
+        cores_per_worker (int): Threads available to each worker.
+
+    Returns:
+        dict: Wall time in seconds per subba, None for failed subbas.
+    """
+    workers, cores = plan_workers(len(subbas), max_workers, cores_per_worker)
+    print(f"Training {len(subbas)} subbas on {workers} workers " \
+          + f"with {cores} cores each...")
+
+    timings = {}
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(cores,)
+    ) as executor:
+        futures = {
+            executor.submit(_train_subba, subba, cores): subba
+            for subba in subbas
+        }
+        for future in as_completed(futures):
+            subba = futures[future]
+            try:
+                timings[subba] = future.result()
+                print(f"{subba}: trained in {timings[subba]:.1f}s")
+            except Exception as e:
+                timings[subba] = None
+                print(f"{subba}: failed: {e}")
+
+    total = time.perf_counter() - start
+    print("Per-subba training time:")
+    for subba in subbas:
+        elapsed = timings[subba]
+        status = "failed" if elapsed is None else f"{elapsed:.1f}s"
+        print(f"    {subba}: {status}")
+    print(f"Total wall time: {total:.1f}s")
+    return timings
+
+
+def main():
+    with initialize(
+        version_base=None, 
+        config_path='../conf/', 
+        job_name='demand-forecast'
+    ):
+        config = compose(config_name='config.yaml')
+
+    subbas = config.data.api.query.SUBBA
+    if isinstance(subbas, str):
+        subbas = [subbas]
+
+    train_many(
+        list(subbas),
+        max_workers=config.training.MAX_WORKERS,
+        cores_per_worker=config.training.CORES_PER_WORKER
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import json
+import time
+import shutil
+import pickle
+import hashlib
+
+import pandas as pd
+import pyarrow as pa
+
+import calendar_features
+import data_preprocessing
+import streaming_stats
+from db_store import table_name
+from data_preprocessing import (
+    iqr_bounds,
+    encode_categorical,
+    preprocess,
+)
+from streaming_stats import PreprocessState
+
+INPUT_SCHEMA = ('period', 'timezone', 'value')
+
+
+def feature_params(config) -> dict:
+    """
+    Preprocessing parameters of the configured data frequency, as
+    keyword arguments of preprocess and PreprocessState.
+    """
+    frequency = config.data.api.query.FREQUENCY
+    params = config.features[frequency]
+    return {
+        'window_size': params.WINDOW_SIZE,
+        'lags': tuple(params.LAGS),
+        'rolling': tuple(tuple(pair) for pair in params.ROLLING),
+        'hourly': frequency == 'hourly',
+    }
+
+
+def fingerprint(config) -> str:
+    """
+    Hash the preprocessing code and the config it depends on, so that
+    cached features are invalidated whenever either changes. The history
+    window is part of the entry key already.
+    """
+    digest = hashlib.sha256()
+    for module in (data_preprocessing, streaming_stats, calendar_features):
+        with open(module.__file__, 'rb') as f_in:
+            digest.update(f_in.read())
+    digest.update(json.dumps({
+        **feature_params(config),
+        'encoding': config.training.ENCODING,
+    }).encode())
+    return digest.hexdigest()[:16]
+
+
+class FeatureStore(object):
+    """
+    On-disk cache of preprocessed feature frames.
+
+    Every entry is a directory holding the features as an Arrow IPC file,
+    the fitted encoder and a JSON metadata file with the data watermark
+    it was built from. Entries are written into a `<key>.<pid>.tmp`
+    directory first, which readers skip, so that processes sharing the
+    store never see a half-written entry.
+    """
+    def __init__(self, root, max_bytes=None, max_age_days=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+
+    def entry_path(self, subba, watermark, n_rows, fprint):
+        key = hashlib.sha256(
+            f"{subba}:{watermark}:{n_rows}:{fprint}".encode()
+        ).hexdigest()[:16]
+        return os.path.join(self.root, subba, key)
+
+    def entries(self):
+        """
+        Yield the metadata of every complete entry in the store.
+        """
+        if not os.path.isdir(self.root):
+            return
+        for subba in os.listdir(self.root):
+            subba_path = os.path.join(self.root, subba)
+            for key in os.listdir(subba_path):
+                if key.endswith('.tmp'):
+                    continue
+                path = os.path.join(subba_path, key)
+                try:
+                    with open(os.path.join(path, 'meta.json')) as f_in:
+                        meta = json.load(f_in)
+                    meta['path'] = path
+                    meta['mtime'] = os.path.getmtime(path)
+                    meta['size'] = sum(
+                        os.path.getsize(os.path.join(path, f))
+                        for f in os.listdir(path)
+                    )
+                except FileNotFoundError:
+                    # Incomplete, or replaced or evicted by another process.
+                    continue
+                yield meta
+
+    def latest(self, subba, fprint):
+        """
+        Return the metadata of the most recent entry for a subba that was
+        built by the same preprocessing code and config.
+        """
+        candidates = [
+            meta for meta in self.entries()
+            if meta['subba'] == subba and meta['fingerprint'] == fprint
+        ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda meta: meta['watermark'])
+
+    def load(self, path):
+        """
+        Read an entry. Numeric and category code columns without nulls
+        are read-only views of the memory-mapped Arrow file: one block per
+        column keeps pandas from consolidating them into copies.
+        """
+        # Keeping a reference to the memory map is left to the buffers.
+        source = pa.memory_map(os.path.join(path, 'features.arrow'), 'r')
+        df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+
+        with open(os.path.join(path, 'ohe.bin'), 'rb') as f_in:
+            ohe = pickle.load(f_in)
+        with open(os.path.join(path, 'meta.json')) as f_in:
+            meta = json.load(f_in)
+
+        # Mark the entry as recently used for eviction.
+        os.utime(path)
+        return df, ohe, meta
+
+    def save(self, path, df, ohe, meta):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(os.path.join(tmp_path, 'features.arrow'), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        with open(os.path.join(tmp_path, 'ohe.bin'), 'wb') as f_out:
+            pickle.dump(ohe, f_out)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f_out:
+            json.dump(meta, f_out)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        Remove entries older than `max_age_days`, then the least recently
+        used ones until the store fits into `max_bytes`.
+        """
+        entries = sorted(self.entries(), key=lambda meta: meta['mtime'])
+        total = sum(meta['size'] for meta in entries)
+        now = time.time()
+
+        for meta in entries:
+            too_old = self.max_age_days is not None \
+                and now - meta['mtime'] > self.max_age_days * 86400
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if too_old or too_big:
+                shutil.rmtree(meta['path'])
+                total -= meta['size']
+
+
+def last_row_meta(df: pd.DataFrame) -> dict:
+    last = df.iloc[-1]
+    return {
+        'period': pd.Timestamp(last['period']).isoformat(),
+        'timezone': str(last['timezone']),
+        'value': int(last['value']),
+    }
+
+
+def last_row_frame(meta: dict) -> pd.DataFrame:
+    row = meta['last_row']
+    return pd.DataFrame({
+        'period': pd.to_datetime([row['period']]),
+        'timezone': pd.Categorical([row['timezone']]),
+        'value': [row['value']],
+    })
+
+
+def revision(rows: pd.DataFrame) -> str:
+    """
+    Hash raw rows, so that values revised in place are noticed.
+    """
+    hashed = pd.util.hash_pandas_object(rows.reset_index(drop=True), index=False)
+    return hashlib.sha256(hashed.to_numpy().tobytes()).hexdigest()[:16]
+
+
+def settle_point(config, watermark) -> str:
+    """
+    First day an incremental ingest after `watermark` may still revise,
+    as db_store.incremental_start picks it.
+    """
+    overlap = pd.Timedelta(days=config.data.api.query.OVERLAP_DAYS)
+    return (pd.Timestamp(watermark).normalize() - overlap).strftime('%Y-%m-%d')
+
+
+def settle(config, df, state, watermark):
+    """
+    Split the features of raw rows at the start of the window the next
+    incremental ingest may still revise.
+
+    Args:
+        df (pd.DataFrame): Raw rows newer than `state`, in period order.
+        state (PreprocessState): Consumes the rows.
+        watermark (str): Latest period of the data.
+
+    Returns:
+        tuple: Feature rows of the settled and of the revisable rows, and
+              the settle point with the state as of it.
+    """
+    settled_until = settle_point(config, watermark)
+    before = (df['period'] < pd.Timestamp(settled_until)).to_numpy()
+    settled_rows = state.process(df[before].reset_index(drop=True))
+    settled = {'settled_until': settled_until, 'settled': state.to_dict()}
+    open_rows = state.process(df[~before].reset_index(drop=True))
+    return settled_rows, open_rows, settled
+
+
+def extend_features(config, cached, ohe, meta, rows, watermark):
+    """
+    Preprocess the rows from a cached entry's settle point on again and
+    replace the features it built from them.
+
+    Incremental ingests upsert the last OVERLAP_DAYS again, so values
+    after the settle point may have been revised in place. The entry
+    keeps the PreprocessState as of that point, which carries the rolling
+    window and lag of the history and filters outliers with the cached
+    IQR bounds, and the revisable rows are streamed through it together
+    with the new ones. The state's quartile sketches follow the whole
+    history, so when the bounds a rebuild would use move more than
+    BOUNDS_TOLERANCE of their range away from the cached ones, the entry
+    is rebuilt instead.
+
+    Args:
+        rows (pd.DataFrame): Raw rows from the entry's settle point on.
+        watermark (str): Latest period of `rows`.
+
+    Returns:
+        tuple: Extended features, the last raw row, the updated state and
+              the new settle point, or None when the rows cannot be
+              encoded with the cached encoder or the IQR bounds have
+              drifted.
+    """
+    state = PreprocessState.from_dict(meta['settled'])
+    settled_rows, open_rows, settled = settle(config, rows, state, watermark)
+
+    drift = state.bounds_drift()
+    if drift > config.features.BOUNDS_TOLERANCE:
+        print(f"IQR bounds moved by {drift:.1%} of their range.")
+        return None
+
+    df_transformed = pd.concat((settled_rows, open_rows), ignore_index=True)
+    df_transformed['timezone'] = pd.Categorical(df_transformed['timezone'])
+    try:
+        df_encoded, _ = encode_categorical(
+            df_transformed, ohe=ohe, fit=False,
+            encoding=config.training.ENCODING
+        )
+    except ValueError as e:
+        print("New rows do not fit the cached encoder:", e)
+        return None
+
+    df_processed = pd.concat(
+        (cached.iloc[:meta['settled_features']], df_encoded[cached.columns]),
+        ignore_index=True
+    )
+    settled['settled_features'] = meta['settled_features'] + len(settled_rows)
+    return df_processed, last_row_meta(rows), state, settled
+
+
+def load_features(config, db_handler, subba):
+    """
+    Return preprocessed features for a subba, reusing the feature cache.
+
+    Besides a max(period)/count(*) query against the database, a cached
+    entry costs reading the rows from its settle point on, i.e. the last
+    OVERLAP_DAYS the ingest may have revised. When they are unchanged and
+    no rows were appended, the entry is served as it is. Otherwise only
+    these rows are preprocessed. Anything else triggers a full rebuild.
+
+    Returns:
+        tuple: Preprocessed DataFrame, fitted encoder, a one-row
+              DataFrame with the last raw observation and the
+              PreprocessState to process later rows with.
+    """
+    tab_name = table_name(config)
+    params = feature_params(config)
+    window = {
+        'subba': subba,
+        'start': config.training.HISTORY_START,
+        'end': config.training.HISTORY_END,
+    }
+
+    if config.features.CACHE_DIR is None:
+        df = db_handler.read_demand(tab_name, columns=INPUT_SCHEMA, **window)
+        bounds = iqr_bounds(df['value'])
+        df_processed, ohe = preprocess(
+            df, bounds=bounds, encoding=config.training.ENCODING, **params
+        )
+        state = PreprocessState.from_history(df, bounds=bounds, **params)
+        return df_processed, ohe, df.iloc[[-1]].reset_index(drop=True), state
+
+    store = FeatureStore(
+        config.features.CACHE_DIR,
+        max_bytes=config.features.MAX_BYTES,
+        max_age_days=config.features.MAX_AGE_DAYS
+    )
+    latest, n_rows = db_handler.watermark(tab_name, **window)
+    watermark = pd.Timestamp(latest).isoformat()
+    fprint = fingerprint(config)
+    path = store.entry_path(subba, watermark, n_rows, fprint)
+
+    extended = None
+    previous = store.latest(subba, fprint)
+    if previous is not None and previous['watermark'] <= watermark \
+            and previous['n_rows'] <= n_rows:
+        cached, ohe, meta = store.load(previous['path'])
+        rows = db_handler.read_demand(
+            tab_name, subba=subba, start=meta['settled_until'],
+            end=config.training.HISTORY_END, columns=INPUT_SCHEMA
+        )
+        if previous['path'] == path and revision(rows) == meta['revision']:
+            print("Feature cache hit:", path)
+            state = PreprocessState.from_dict(meta['state'])
+            return cached, ohe, last_row_frame(meta), state
+
+        print("Extending cached features from", meta['settled_until'])
+        extended = extend_features(config, cached, ohe, meta, rows, watermark)
+
+    if extended is not None:
+        df_processed, last_row, state, settled = extended
+        bounds = tuple(meta['iqr_bounds'])
+    else:
+        print("Building features from scratch...")
+        df = db_handler.read_demand(tab_name, columns=INPUT_SCHEMA, **window)
+        bounds = iqr_bounds(df['value'])
+        df_processed, ohe = preprocess(
+            df, bounds=bounds, encoding=config.training.ENCODING, **params
+        )
+        last_row = last_row_meta(df)
+        state = PreprocessState.from_history(df, bounds=bounds, **params)
+
+        # The next extension starts over from the settle point.
+        settled_until = settle_point(config, watermark)
+        before = (df['period'] < pd.Timestamp(settled_until)).to_numpy()
+        if before.any():
+            settled_state = PreprocessState.from_history(
+                df[before], bounds=bounds, **params
+            )
+        else:
+            settled_state = PreprocessState(bounds, **params)
+        settled = {'settled_until': settled_until,
+                   'settled': settled_state.to_dict()}
+        rows = df[~before].reset_index(drop=True)
+        open_rows = settled_state.process(rows)
+        settled['settled_features'] = len(df_processed) - len(open_rows)
+
+    meta = {
+        'subba': subba,
+        'watermark': watermark,
+        'n_rows': n_rows,
+        'fingerprint': fprint,
+        'iqr_bounds': list(bounds),
+        'last_row': last_row,
+        'state': state.to_dict(),
+        'revision': revision(rows),
+        **settled,
+    }
+    store.save(path, df_processed, ohe, meta)
+    store.evict()
+    return df_processed, ohe, last_row_frame(meta), state
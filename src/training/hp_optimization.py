@@ -1,9 +1,71 @@
 #!/usr/bin/env python
 # coding: utf-8
+import os
+
 import optuna
+from optuna.trial import TrialState
 from xgboost import XGBRegressor
+from train import model_params, FoldData
+
+def journal_path(storage, study_name):
+    """
+    Journal file of one study, or None when the storage is not a journal.
+
+    Each study gets a file of its own, as opening a journal replays all
+    the studies it ever recorded.
+    """
+    if storage is None or '://' in storage:
+        return None
+    if study_name is None:
+        return storage
+    root, ext = os.path.splitext(storage)
+    return f"{root}-{study_name}{ext}"
+
+def make_storage(storage, study_name=None):
+    """
+    Return an Optuna storage for a database URL or a journal file path,
+    or None to keep the study in memory.
+    """
+    if storage is None:
+        return None
+    if '://' in storage:
+        return storage
+    return optuna.storages.JournalStorage(
+        optuna.storages.JournalFileStorage(journal_path(storage, study_name))
+    )
+
+def make_pruner(config, n_splits):
+    pruner = config.hyperparameters.PRUNER
+    if pruner == 'median':
+        return optuna.pruners.MedianPruner(
+            n_startup_trials=5,
+            n_warmup_steps=config.hyperparameters.PRUNER_WARMUP
+        )
+    if pruner == 'hyperband':
+        return optuna.pruners.HyperbandPruner(
+            min_resource=1, max_resource=n_splits
+        )
+    return optuna.pruners.NopPruner()
+
+def tune_hyperparameters(config, train_func, X, y, n_trials=100, n_splits=5,
+                         n_jobs=None, study_name=None, folds=None):
+    """
+    Search XGBoost hyperparameters with Optuna.
+
+    Trials run N_JOBS at a time and report the running test MAE after
+    every fold, so the pruner can stop poor trials early. With a STORAGE
+    configured the study is persisted under `study_name` and a restarted
+    run only executes the trials that are still missing. A journal file
+    is removed once its study has finished.
+    """
+    # Every trial trains on the same quantized fold matrices.
+    if folds is None:
+        folds = FoldData(X, y, config.training.N_SPLITS)
+
+    # Share the cores between concurrent trials.
+    parallel_trials = config.hyperparameters.N_JOBS
+    trial_jobs = max(1, (n_jobs or os.cpu_count() or 1) // parallel_trials)
 
-def tune_hyperparameters(config, train_func, X, y, n_trials=100, n_splits=5):
     def objective(trial):
         params = {
             'n_estimators': trial.suggest_int(
@@ -54,25 +116,54 @@ def tune_hyperparameters(config, train_func, X, y, n_trials=100, n_splits=5):
             ),
 
             'early_stopping_rounds': 
-                config.hyperparameters.sample_space.EARLY_STOPPING_ROUNDS
+                config.hyperparameters.sample_space.EARLY_STOPPING_ROUNDS,
+
+            'n_jobs': trial_jobs
     }
 
-        model = XGBRegressor(**params)
+        def report(fold, mae_test_avg):
+            trial.report(mae_test_avg, fold)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        model = XGBRegressor(**params, **model_params(config))
         mae_train_avg, mae_test_avg = train_func(
             config=config, 
             model=model, 
             X=X, y=y, 
-            n_splits=config.training.N_SPLITS)
+            n_splits=config.training.N_SPLITS,
+            fold_callback=report,
+            folds=folds)
         return mae_test_avg
 
     sampler = optuna.samplers.TPESampler(config.hyperparameters.SEED)
-    study = optuna.create_study(direction='minimize', sampler=sampler)
+    study = optuna.create_study(
+        study_name=study_name,
+        storage=make_storage(config.hyperparameters.STORAGE, study_name),
+        direction='minimize', 
+        sampler=sampler,
+        pruner=make_pruner(config, n_splits),
+        load_if_exists=True
+    )
+
+    # Trials left running by an interrupted run will never finish.
+    for trial in study.get_trials(deepcopy=False, states=(TrialState.RUNNING,)):
+        study.tell(trial.number, state=TrialState.FAIL)
+
+    finished = study.get_trials(
+        deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED)
+    )
+    remaining = max(0, n_trials - len(finished))
+    if finished:
+        print(f'Resuming study with {len(finished)} finished trials...')
 
     # Optimize the study, the objective function is passed in as the first argument
-    study.optimize(objective, n_trials=n_trials)
+    study.optimize(objective, n_trials=remaining, n_jobs=parallel_trials)
 
     # Results
+    pruned = study.get_trials(deepcopy=False, states=(TrialState.PRUNED,))
     print('Number of finished trials: ', len(study.trials))
+    print('Number of pruned trials: ', len(pruned))
     print('Best trial:')
     trial = study.best_trial
     
@@ -80,5 +171,10 @@ def tune_hyperparameters(config, train_func, X, y, n_trials=100, n_splits=5):
     print('Params: ')
     for key, value in trial.params.items():
         print(f'    {key}: {value}')
-    
+
+    # Only an interrupted study is ever resumed.
+    path = journal_path(config.hyperparameters.STORAGE, study_name)
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
     return trial.params
\ No newline at end of file
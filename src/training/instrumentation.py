@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import sys
+import json
+import time
+import resource
+import functools
+from collections import deque
+
+# Set from the `instrumentation` section of the config by configure.
+_settings = {
+    'enabled': False,
+    'profile_dir': None,
+    'profiler': 'cprofile',
+}
+# Finished stages, for log_metrics. Bounded for long-lived containers.
+_records = deque(maxlen=1000)
+_profiling = False
+
+
+def configure(config):
+    """
+    Enable stage timing and profiling as set in `config.instrumentation`,
+    and forget the stages recorded so far.
+    """
+    _records.clear()
+    params = config.instrumentation
+    _settings['enabled'] = bool(params.ENABLED)
+    _settings['profile_dir'] = params.PROFILE_DIR
+    _settings['profiler'] = params.PROFILER
+
+
+def peak_rss_mb() -> float:
+    """
+    High-water mark of the resident set size of this process.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    if sys.platform == 'darwin':
+        return peak / 2**20
+    return peak / 2**10
+
+
+class Stage(object):
+    """
+    Time a pipeline stage and log it as one JSON line.
+
+    Records wall time, CPU time of the process, the peak RSS and how much
+    the stage raised it, the row count set with `set` and any extra
+    fields. With a PROFILE_DIR a cProfile or pyinstrument dump is written
+    per stage; nested stages are covered by the profile of the outermost
+    one. Does nothing but check a flag when instrumentation is disabled.
+    """
+    def __init__(self, name, rows=None, **fields):
+        self.name = name
+        self.fields = dict(fields, rows=rows)
+        self.enabled = _settings['enabled']
+        self.profiler = None
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        global _profiling
+        if _settings['profile_dir'] is not None and not _profiling:
+            self.profiler = self.start_profiler()
+            _profiling = True
+        self.peak_rss = peak_rss_mb()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        peak_rss = peak_rss_mb()
+        if self.profiler is not None:
+            self.stop_profiler()
+
+        record = {
+            'stage': self.name,
+            'status': 'ok' if exc_type is None else 'error',
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'peak_rss_mb': round(peak_rss, 1),
+            'peak_rss_growth_mb': round(peak_rss - self.peak_rss, 1),
+        }
+        record.update(self.fields)
+        _records.append(record)
+        print(json.dumps(record, default=str))
+        return False
+
+    def start_profiler(self):
+        if _settings['profiler'] == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop_profiler(self):
+        global _profiling
+        profile_dir = _settings['profile_dir']
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(
+            profile_dir, f"{self.name}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        )
+        if _settings['profiler'] == 'pyinstrument':
+            self.profiler.stop()
+            with open(path + '.html', 'w') as f_out:
+                f_out.write(self.profiler.output_html())
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(path + '.prof')
+        self.profiler = None
+        _profiling = False
+
+
+class _Disabled(object):
+    """
+    Shared stand-in for stages while instrumentation is disabled.
+    """
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_disabled = _Disabled()
+
+
+def stage(name, rows=None, **fields):
+    """
+    Context manager timing the stage `name`, see Stage.
+    """
+    if not _settings['enabled']:
+        return _disabled
+    return Stage(name, rows=rows, **fields)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function as a stage, named after
+    the function unless `name` is given.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _settings['enabled']:
+                return func(*args, **kwargs)
+            with Stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def records():
+    return list(_records)
+
+
+def log_metrics(run_id, client=None):
+    """
+    Log the recorded stages as MLflow metrics of a run, named
+    stage.<name>.<measure>, in one batch. Repeated stages are logged as
+    steps of the same metric.
+    """
+    from mlflow import MlflowClient
+    from mlflow.entities import Metric
+
+    client = client or MlflowClient()
+    timestamp = int(time.time() * 1000)
+    steps = {}
+    metrics = []
+    for record in _records:
+        step = steps.get(record['stage'], 0)
+        steps[record['stage']] = step + 1
+        for key in ('wall_s', 'cpu_s', 'peak_rss_mb', 'rows'):
+            if record.get(key) is not None:
+                metrics.append(Metric(f"stage.{record['stage']}.{key}",
+                                      float(record[key]), timestamp, step))
+    # Within the 1000 metrics of a single log_batch request.
+    for i in range(0, len(metrics), 1000):
+        client.log_batch(run_id, metrics=metrics[i:i + 1000])
@@ -1,38 +1,82 @@
 #!/usr/bin/env python
 # coding: utf-8
 import os
-import pickle
+import json
+import shutil
+import mlflow
 from hydra import initialize, compose
 from xgboost import XGBRegressor
-import train, hp_optimization, register_model
-from data_preprocessing import preprocess, prepare_for_inference
+import train, hp_optimization, register_model, warm_start
+import instrumentation
+from run_artifacts import save_artifacts
+from data_preprocessing import prepare_for_inference
+from feature_store import load_features, feature_params
 import db_store
 # from prefect import flow
 
+@instrumentation.timed('export_bundle')
+def log_bundle(config, model, ohe, schema, recent_prepared, recent_values,
+               subba, run_id):
+    print('Exporting the inference bundle...')
+    # The run's artifacts with the booster, served by lean_app.
+    bundle_path = os.path.join(os.getcwd(), 'bundles', subba)
+    shutil.rmtree(bundle_path, ignore_errors=True)
+    save_artifacts(
+        bundle_path,
+        ohe=ohe,
+        schema=schema,
+        recent_prepared=recent_prepared,
+        recent_values=recent_values,
+        encoding=config.training.ENCODING,
+        model=model
+    )
+    mlflow.MlflowClient().log_artifacts(run_id, bundle_path, 'bundle')
+
+def log_stages(config, run_id):
+    # Stage timings of this process so far, next to the run's metrics.
+    if config.instrumentation.MLFLOW:
+        instrumentation.log_metrics(run_id)
+
 # @flow(name='train_flow', retries=3, retry_delay_seconds=5)
-def train_flow():
+def train_flow(subba=None, n_jobs=None, retrain=None):
+    """
+    Preprocess, tune, train and register the model of one subba.
+
+    In incremental mode the Production model is warm started on the new
+    rows instead, unless `warm_start` asks for a full retrain. The model
+    of that retrain then replaces Production directly: the champion
+    search would compare it with the validated MAE of the rejected model.
+
+    Args:
+        subba (str): Subba to train, defaults to data.api.query.SUBBA.
+        n_jobs (int): Threads used by XGBoost, all cores when None.
+        retrain (str): 'full' or 'incremental', defaults to
+            training.RETRAIN.
+    """
     with initialize(
         version_base=None, 
         config_path='../conf/', 
         job_name='demand-forecast'
     ):
         config = compose(config_name='config.yaml')   
+    instrumentation.configure(config)
+
+    if subba is None:
+        subba = config.data.api.query.SUBBA
+    if retrain is None:
+        retrain = config.training.RETRAIN
 
     db_handler = db_store.DatabaseHandler(config)
 
     db_handler.connect()
 
-    input_schema = ['period', 'timezone', 'value']
-    tab_name = config.data.tab_params.tabname
-    schema_str = ",".join(input_schema)
-
-    query = f'SELECT {schema_str} FROM {tab_name};'
-    
-    df = db_handler.query(query)
+    with instrumentation.stage('load_features', subba=subba) as stage:
+        df_processed, ohe, last_day_demand, preprocess_state = load_features(
+            config, db_handler, subba
+        )
+        stage.set(rows=len(df_processed))
     
     db_handler.close()
-
-    df_processed, ohe = preprocess(df)
     
     # Separate features and target.
     X = df_processed.drop(columns=['value'])
@@ -40,51 +84,110 @@ def train_flow():
     
     schema = X.columns.tolist()
     
-    last_day_demand = df.iloc[-1].to_frame().T
     last_day_rolling_vals = df_processed.iloc[-1][['rolling_mean', 'rolling_std']]
     recent_prepared = prepare_for_inference(
         df = last_day_demand,
         last_day_rolling_vals=last_day_rolling_vals,
         ohe=ohe,
-        schema=schema
+        schema=schema,
+        encoding=config.training.ENCODING,
+        lag_values=preprocess_state.inference_features()
     )
 
+    # Seeds the recursive updates of multi-day forecasts.
+    window_size = feature_params(config)['window_size']
+    recent_values = {
+        'period': last_day_demand['period'].iloc[-1].isoformat(),
+        'frequency': config.data.api.query.FREQUENCY,
+        'window': df_processed['value'].to_numpy()[-window_size:].tolist(),
+    }
+
     print('Saving artifacts...')
-    artifacts = [ohe, schema, recent_prepared]
-    artifacts_path = os.getcwd() + '/artifacts'
-    if not os.path.exists(artifacts_path):
-        os.mkdir(artifacts_path)
-    with open(artifacts_path + '/afts.bin', 'wb') as f_out:
-        pickle.dump(artifacts, f_out)
+    artifacts_path = os.path.join(os.getcwd(), 'artifacts', subba)
+    save_artifacts(
+        artifacts_path,
+        ohe=ohe,
+        schema=schema,
+        recent_prepared=recent_prepared,
+        recent_values=recent_values,
+        encoding=config.training.ENCODING
+    )
+    with open(artifacts_path + '/preprocess_state.json', 'w') as f_out:
+        json.dump(preprocess_state.to_dict(), f_out)
 
-    print('Tuning hyperparameters...')
-    best_params = hp_optimization.tune_hyperparameters(
-        config=config,
-        train_func=train.train,
-        X=X, y=y,
-        n_trials=config.hyperparameters.N_TRIALS,
-        n_splits=config.training.N_SPLITS,
+    if retrain == 'incremental':
+        print('Warm starting the Production model...')
+        with instrumentation.stage('warm_start', rows=len(X), subba=subba):
+            result = warm_start.warm_start(
+                config, subba, X, y, artifacts_path, n_jobs=n_jobs
+            )
+        if result is not None:
+            model, run_id = result
+            if run_id is not None:
+                log_bundle(config, model, ohe, schema, recent_prepared,
+                           recent_values, subba, run_id)
+                log_stages(config, run_id)
+                with instrumentation.stage('register', subba=subba):
+                    register_model.register_run(
+                        config, subba, mlflow.MlflowClient().get_run(run_id)
+                    )
+            return
+        print('Falling back to a full retrain...')
 
-    )
+    # Binned once, shared by the tuning trials and the final training.
+    folds = train.FoldData(X, y, config.training.N_SPLITS)
+
+    print('Tuning hyperparameters...')
+    with instrumentation.stage('tune', rows=len(X), subba=subba,
+                               trials=config.hyperparameters.N_TRIALS):
+        best_params = hp_optimization.tune_hyperparameters(
+            config=config,
+            train_func=train.train,
+            X=X, y=y,
+            n_trials=config.hyperparameters.N_TRIALS,
+            n_splits=config.training.N_SPLITS,
+            n_jobs=n_jobs,
+            # Only a rerun on the same data resumes a persisted study.
+            study_name=f"{config.hyperparameters.STUDY_NAME}-{subba}-{len(X)}",
+            folds=folds
+        )
     
     print('Training using best hyperparameters...')
     model = XGBRegressor(
         **best_params,
         early_stopping_rounds=
         config.hyperparameters.sample_space.EARLY_STOPPING_ROUNDS,
-        random_state=config.hyperparameters.SEED
+        random_state=config.hyperparameters.SEED,
+        n_jobs=n_jobs,
+        **train.model_params(config)
     )
     
-    train.train(
-        config=config,
-        model=model, 
-        X=X, y=y, 
-        n_splits=config.training.N_SPLITS, 
-        track=True
-    )
+    with instrumentation.stage('train', rows=len(X), subba=subba):
+        train.train(
+            config=config,
+            model=model, 
+            X=X, y=y, 
+            n_splits=config.training.N_SPLITS, 
+            track=True,
+            artifacts_path=artifacts_path,
+            tags={'subba': subba, 'train_rows': str(len(X)), 'retrain': 'full'},
+            folds=folds
+        )
+
+    run_id = mlflow.last_active_run().info.run_id
+    log_bundle(config, model, ohe, schema, recent_prepared, recent_values,
+               subba, run_id)
+    log_stages(config, run_id)
 
     print('Registering the model...')
-    register_model.choose_and_register(config)
+    with instrumentation.stage('register', subba=subba):
+        # Incremental runs only get here when the warm start was refused.
+        if retrain == 'incremental':
+            register_model.register_run(
+                config, subba, mlflow.MlflowClient().get_run(run_id)
+            )
+        else:
+            register_model.choose_and_register(config, subba)
 
 if __name__ == "__main__":
     train_flow()
\ No newline at end of file
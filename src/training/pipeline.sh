@@ -24,6 +24,6 @@ pipenv run prefect cloud login --key $PREFECT_API_KEY --workspace $PREFECT_WORKS
 
 # Run training pipeline
 pipenv run python db_store.py
-pipenv run python main_flow.py
+pipenv run python fanout.py
 
 pipenv run prefect cloud logout
\ No newline at end of file
@@ -1,40 +1,175 @@
 #!/usr/bin/env python
 # coding: utf-8
+import os
+import json
+import time
 
 import mlflow
 from mlflow import MlflowClient
 from mlflow.entities import ViewType
+from mlflow.exceptions import MlflowException
+from mlflow.store.artifact.artifact_repository_registry import get_artifact_repository
 from pprint import pprint
 from prefect import flow, task
 
-@task(name="find best model", retries=5, retry_delay_seconds=5)
-def search_best(config):
-    dbname = config.data.conn_params.dbname
-    user = config.data.conn_params.user
-    password = config.data.conn_params.password
-    host = config.data.conn_params.host
-
-    TRACKING_URI = f'postgresql://{user}:{password}@{host}/{dbname}'
-    mlflow.set_tracking_uri(TRACKING_URI)
-    
-    experiment = mlflow.get_experiment_by_name(config.mlflow.experiment_name)
+import tracking
+import run_artifacts
+
+def registered_model_name(config, subba):
+    return f"{config.mlflow.model_name}-{subba}-reg"
 
-    run = MlflowClient().search_runs(
+def production_run(model_name, index=None):
+    """
+    Return the run of the Production version of a model, or None.
+
+    The version recorded in `index` is checked with a single version
+    lookup. Otherwise the registry is asked for the latest versions,
+    which loads every version of the model.
+    """
+    client = MlflowClient()
+    if index is not None and index.production is not None:
+        try:
+            version = client.get_model_version(model_name, index.production)
+            if version.current_stage == "Production":
+                return client.get_run(version.run_id)
+        except MlflowException:
+            pass
+
+    try:
+        versions = client.get_latest_versions(model_name, stages=["Production"])
+    except MlflowException:
+        return None
+    if not versions:
+        return None
+    if index is not None:
+        index.set_production(versions[0].version)
+    return client.get_run(versions[0].run_id)
+
+def best_runs(experiment, filter_string):
+    """
+    Return the matching run with the lowest `mae_test`, as a list.
+    """
+    return list(MlflowClient().search_runs(
         experiment_ids=experiment.experiment_id,
-        filter_string="",
+        filter_string=filter_string,
         run_view_type=ViewType.ACTIVE_ONLY,
         max_results=1,
         order_by=["metrics.mae_test ASC"],
-    )[0]
-    return run
+    ))
+
+@task(name="find best model", retries=5, retry_delay_seconds=5)
+def search_best(config, subba):
+    """
+    Return the finished run of a subba with the lowest `mae_test`.
+
+    Only runs started in the last `search_days` days are searched, so
+    the query does not grow with the experiment's history, and the run
+    of the current Production version competes with them. The whole
+    experiment is searched when neither exists.
+    """
+    tracking.setup_tracking(config)
+    experiment = mlflow.get_experiment_by_name(config.mlflow.experiment_name)
+
+    filter_string = f"tags.subba = '{subba}' AND attributes.status = 'FINISHED'"
+
+    if config.mlflow.search_days is None:
+        candidates = best_runs(experiment, filter_string)
+    else:
+        since = int((time.time() - config.mlflow.search_days * 86400) * 1000)
+        candidates = best_runs(
+            experiment, f"{filter_string} AND attributes.start_time >= {since}"
+        )
+        model_name = registered_model_name(config, subba)
+        production = production_run(
+            model_name, registry_index(config, model_name)
+        )
+        if production is not None:
+            candidates.append(production)
+        if not candidates:
+            candidates = best_runs(experiment, filter_string)
+
+    if not candidates:
+        raise LookupError(f"No finished runs for subba {subba}.")
+    return min(
+        candidates,
+        key=lambda run: run.data.metrics.get('mae_test', float('inf'))
+    )
+
+class RegistryIndex(object):
+    """
+    Local JSON cache of the versions registered for the runs of one
+    model and of its Production version, so that checking a run or
+    finding the Production model costs a single version lookup.
 
-def check_if_registered(model_name, run_id):
+    Entries are confirmed against the registry before they are trusted,
+    and stale ones are dropped, so a lost or outdated index only costs a
+    search.
+    """
+    def __init__(self, root, model_name):
+        self.path = os.path.join(root, f"{model_name}.json")
+        self.versions = {}
+        self.production = None
+        if os.path.isfile(self.path):
+            with open(self.path) as f_in:
+                data = json.load(f_in)
+            self.versions = data['versions']
+            self.production = data['production']
+
+    def get(self, run_id):
+        return self.versions.get(run_id)
+
+    def add(self, run_id, version):
+        self.versions[run_id] = str(version)
+        self.save()
+
+    def discard(self, run_id):
+        if self.versions.pop(run_id, None) is not None:
+            self.save()
+
+    def set_production(self, version):
+        self.production = str(version)
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f_out:
+            json.dump({'versions': self.versions,
+                       'production': self.production}, f_out)
+        os.replace(tmp_path, self.path)
+
+def registry_index(config, model_name):
+    if config.mlflow.registry_index is None:
+        return None
+    return RegistryIndex(config.mlflow.registry_index, model_name)
+
+def registered_version(model_name, run_id, index=None):
+    """
+    Return the version registered for a run, or None.
+    """
     client = MlflowClient()
-    for mv in client.search_model_versions(f"name='{model_name}'"):
-        # pprint(dict(mv), indent=4)
-        if dict(mv)['run_id'] == run_id:
-            return True
-    return False
+    if index is not None:
+        version = index.get(run_id)
+        if version is not None:
+            try:
+                if client.get_model_version(model_name, version).run_id == run_id:
+                    return version
+            except MlflowException:
+                pass
+            index.discard(run_id)
+
+    versions = client.search_model_versions(
+        f"name='{model_name}' AND run_id='{run_id}'"
+    )
+    if not versions:
+        return None
+    version = str(versions[0].version)
+    if index is not None:
+        index.add(run_id, version)
+    return version
+
+def check_if_registered(model_name, run_id, index=None):
+    return registered_version(model_name, run_id, index) is not None
 
 def promote_to_production(model_name, model_version):
     client = MlflowClient()
@@ -45,24 +180,63 @@ def promote_to_production(model_name, model_version):
         archive_existing_versions=True
     )
 
-def register_model(run, model_name):
+def bundle_uri(config, model_name):
+    return f"{config.mlflow.s3bucket}/bundles/{model_name}"
+
+def publish_bundle(config, run_id, model_name):
+    """
+    Copy the inference bundle of a run to the stable location read by
+    the lean prediction handler.
+    """
+    try:
+        local_path = mlflow.artifacts.download_artifacts(
+            run_id=run_id, artifact_path='bundle'
+        )
+    except (MlflowException, OSError) as e:
+        print(f"Run {run_id} has no inference bundle: {e}")
+        return None
+
+    uri = bundle_uri(config, model_name)
+    repository = get_artifact_repository(uri)
+    # The manifest goes last, so that readers find the files it lists.
+    names = sorted(
+        os.listdir(local_path), key=lambda name: name == run_artifacts.MANIFEST
+    )
+    for name in names:
+        repository.log_artifact(os.path.join(local_path, name))
+    return uri
+
+def register_model(run, model_name, index=None):
     run_id = run.info.run_id
     model_uri = 'runs:/' + run_id + '/xgb_best'
-    is_registered = check_if_registered(model_name, run_id)
+    is_registered = check_if_registered(model_name, run_id, index)
     if not is_registered:
         result = mlflow.register_model(
         model_uri, model_name
         )
+        if index is not None:
+            index.add(run_id, result.version)
         return result
     return None
 
-@flow(name="register model")
-def choose_and_register(config):
-    run = search_best(config)
-    model_name = config.mlflow.model_name + '-reg'
-    result = register_model(run, model_name)
+def register_run(config, subba, run):
+    """
+    Register the model of `run` and promote it to Production, unless it
+    already is a registered version.
+    """
+    model_name = registered_model_name(config, subba)
+    index = registry_index(config, model_name)
+    result = register_model(run, model_name, index)
     if result is not None:
         promote_to_production(model_name, result.version)
+        if index is not None:
+            index.set_production(result.version)
+        publish_bundle(config, run.info.run_id, model_name)
+
+@flow(name="register model")
+def choose_and_register(config, subba):
+    run = search_best(config, subba)
+    register_run(config, subba, run)
 
 if __name__ == "__main__":
     choose_and_register()
\ No newline at end of file
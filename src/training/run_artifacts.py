@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Versioned artifacts of a training run, read by both prediction handlers.
+
+A manifest.json holds the feature schema and types, the encoder
+categories, the last observed values for multi-day forecasts and the
+SHA-256 of every data file. The prepared features of the most recent
+rows are a float32 recent.npy in schema order, with category codes for
+categorical features, that can be memory-mapped. The manifest's
+content_hash covers all of it, so a reader can tell an unchanged bundle
+without downloading more than the manifest.
+
+The artifacts logged with a run leave the model to MLflow. The inference
+bundle of the lean handler is the same files plus the booster in
+XGBoost's native UBJSON format as model.ubj.
+
+Reading only needs json, hashlib and numpy.
+"""
+import os
+import json
+import hashlib
+
+import numpy as np
+
+ARTIFACTS_VERSION = 1
+MANIFEST = 'manifest.json'
+RECENT = 'recent.npy'
+MODEL = 'model.ubj'
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f_in:
+        for block in iter(lambda: f_in.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(manifest: dict) -> str:
+    """
+    SHA-256 of the manifest without its content_hash. The manifest holds
+    the hashes of the data files, so they are covered too.
+    """
+    body = {k: v for k, v in manifest.items() if k != 'content_hash'}
+    return hashlib.sha256(
+        json.dumps(body, sort_keys=True, separators=(',', ':')).encode()
+    ).hexdigest()
+
+
+def feature_rows(df, schema: list, out: np.ndarray = None) -> np.ndarray:
+    """
+    Write prepared features into float32 rows in schema order.
+
+    Categorical columns are replaced by their category codes, with
+    unknown values as NaN, which is what a booster trained with
+    `enable_categorical` expects.
+
+    Args:
+        df (pd.DataFrame): Prepared features.
+        schema (list): Feature names in model order.
+        out (np.ndarray): Rows of shape (len(df), len(schema)) to write
+            into, allocated when None.
+
+    Returns:
+        np.ndarray: The rows.
+    """
+    X = np.empty((len(df), len(schema)), dtype='float32') if out is None else out
+    for i, column in enumerate(schema):
+        values = df[column]
+        if hasattr(values, 'cat'):
+            codes = values.cat.codes.to_numpy()
+            X[:, i] = np.where(codes < 0, np.nan, codes)
+        else:
+            X[:, i] = values.to_numpy(dtype='float32')
+    return X
+
+
+def save_artifacts(
+        path: str,
+        ohe,
+        schema: list,
+        recent_prepared,
+        recent_values: dict,
+        encoding: str,
+        model=None
+) -> dict:
+    """
+    Write the run artifacts into the directory `path`, and the booster
+    of `model` too for an inference bundle.
+
+    Args:
+        ohe (OneHotEncoder): Fitted encoder, only its categories are kept.
+        schema (list): Feature names in model order.
+        recent_prepared (pd.DataFrame): Prepared features of the most
+            recent rows, as prepare_for_inference returns them.
+        recent_values (dict): Last period and window of observed values.
+        encoding (str): 'native' or 'onehot'.
+        model (XGBRegressor): Trained model of an inference bundle.
+
+    Returns:
+        dict: The manifest.
+    """
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, RECENT), feature_rows(recent_prepared, schema))
+    files = [RECENT]
+    if model is not None:
+        model.get_booster().save_model(os.path.join(path, MODEL))
+        files.append(MODEL)
+
+    manifest = {
+        'format_version': ARTIFACTS_VERSION,
+        'encoding': encoding,
+        'schema': list(schema),
+        'feature_types': [
+            'c' if hasattr(recent_prepared[c], 'cat') else 'float'
+            for c in schema
+        ],
+        'categories': {
+            column: [str(c) for c in categories]
+            for column, categories in zip(ohe.feature_names_in_, ohe.categories_)
+        },
+        'recent_values': recent_values,
+        'files': {name: file_hash(os.path.join(path, name)) for name in files},
+    }
+    manifest['content_hash'] = content_hash(manifest)
+    with open(os.path.join(path, MANIFEST), 'w') as f_out:
+        json.dump(manifest, f_out)
+    return manifest
+
+
+def read_manifest(path: str) -> dict:
+    """
+    Read and check the manifest in the directory `path`.
+
+    Raises:
+        ValueError: For an unknown format version or a manifest that
+            does not match its content_hash.
+    """
+    with open(os.path.join(path, MANIFEST)) as f_in:
+        manifest = json.load(f_in)
+    if manifest.get('format_version') != ARTIFACTS_VERSION:
+        raise ValueError(
+            f"Unsupported artifacts version {manifest.get('format_version')}."
+        )
+    if content_hash(manifest) != manifest['content_hash']:
+        raise ValueError("Artifact manifest does not match its content hash.")
+    return manifest
+
+
+def verify_files(path: str, manifest: dict):
+    """
+    Raise a ValueError unless the data files in `path` match the hashes
+    of the manifest. Meant for freshly downloaded bundles.
+    """
+    for name, expected in manifest['files'].items():
+        if file_hash(os.path.join(path, name)) != expected:
+            raise ValueError(f"{name} does not match the artifact manifest.")
+
+
+def load_recent(path: str, manifest: dict, mmap: bool = True) -> np.ndarray:
+    """
+    Prepared recent rows of shape (n, len(schema)), memory-mapped
+    read-only by default.
+    """
+    recent = np.load(os.path.join(path, RECENT), mmap_mode='r' if mmap else None)
+    if recent.dtype != np.float32 or recent.ndim != 2 \
+            or recent.shape[1] != len(manifest['schema']):
+        raise ValueError(
+            f"{RECENT} of shape {recent.shape} and type {recent.dtype} does "
+            f"not hold float32 rows of {len(manifest['schema'])} features."
+        )
+    return recent
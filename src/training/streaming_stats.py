@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# coding: utf-8
+import math
+
+import numpy as np
+import pandas as pd
+
+from calendar_features import calendar_features
+from data_preprocessing import (
+    WINDOW_SIZE,
+    lag_schema,
+    iqr_bounds,
+    filter_by_iqr,
+)
+
+
+class P2Quantile(object):
+    """
+    Streaming estimate of one quantile with the P² algorithm of Jain and
+    Chlamtac (1985), in constant memory.
+
+    Five markers track the minimum, the p/2, p and (1+p)/2 quantiles and
+    the maximum. Their heights are adjusted with a piecewise-parabolic
+    prediction as observations arrive.
+    """
+    def __init__(self, p):
+        self.p = p
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1 + 4 * dn for dn in self.increments]
+        self.count = 0
+
+    @classmethod
+    def from_values(cls, values, p):
+        """
+        Start from the exact quantiles of `values` instead of streaming
+        them one by one.
+        """
+        sketch = cls(p)
+        values = np.asarray(values, dtype='float64')
+        if len(values) < 20:
+            for x in values:
+                sketch.add(x)
+            return sketch
+
+        n = len(values)
+        sketch.count = n
+        sketch.heights = np.quantile(values, sketch.increments).tolist()
+        sketch.desired = [1 + (n - 1) * dn for dn in sketch.increments]
+        sketch.positions = [int(round(d)) for d in sketch.desired]
+        return sketch
+
+    def add(self, x):
+        x = float(x)
+        self.count += 1
+        if self.count <= 5:
+            self.heights.append(x)
+            self.heights.sort()
+            return
+
+        q, n = self.heights, self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = max(i for i in range(4) if q[i] <= x)
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if self.count == 0:
+            return math.nan
+        if self.count <= 5:
+            return float(np.quantile(self.heights, self.p))
+        return self.heights[2]
+
+    def to_dict(self):
+        return {
+            'p': self.p,
+            'heights': self.heights,
+            'positions': self.positions,
+            'desired': self.desired,
+            'count': self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['p'])
+        sketch.heights = list(data['heights'])
+        sketch.positions = list(data['positions'])
+        sketch.desired = list(data['desired'])
+        sketch.count = data['count']
+        return sketch
+
+
+class RollingWindow(object):
+    """
+    Mean and sample standard deviation of the last `size` values.
+
+    Values are kept in a ring buffer and the statistics are updated with
+    Welford's method when a value enters and the oldest one leaves. They
+    are recomputed from the buffer every time it wraps around, so that
+    rounding errors do not accumulate.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.buffer = []
+        self.head = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def push(self, x):
+        x = float(x)
+        if len(self.buffer) < self.size:
+            self.buffer.append(x)
+            delta = x - self.mean
+            self.mean += delta / len(self.buffer)
+            self.m2 += delta * (x - self.mean)
+            return
+
+        old = self.buffer[self.head]
+        self.buffer[self.head] = x
+        self.head = (self.head + 1) % self.size
+
+        mean = self.mean + (x - old) / self.size
+        self.m2 += (x - old) * (x - mean + old - self.mean)
+        self.mean = mean
+        if self.head == 0:
+            self.recompute()
+
+    def recompute(self):
+        values = np.asarray(self.buffer)
+        self.mean = float(values.mean())
+        self.m2 = float(((values - self.mean) ** 2).sum())
+
+    @property
+    def full(self):
+        return len(self.buffer) == self.size
+
+    @property
+    def last(self):
+        if not self.buffer:
+            return None
+        return self.buffer[self.head - 1]
+
+    @property
+    def std(self):
+        return math.sqrt(max(self.m2, 0.0) / (len(self.buffer) - 1))
+
+    def to_dict(self):
+        # Oldest value first, so that the state does not depend on head.
+        return {'size': self.size,
+                'values': self.buffer[self.head:] + self.buffer[:self.head]}
+
+    @classmethod
+    def from_dict(cls, data):
+        window = cls(data['size'])
+        for x in data['values']:
+            window.push(x)
+        window.recompute()
+        return window
+
+
+def grid_positions(period, hourly):
+    """
+    Hours since the epoch of hourly periods, None for daily data whose
+    lags count rows.
+    """
+    if not hourly:
+        return None
+    period = np.asarray(period)
+    if not np.issubdtype(period.dtype, np.datetime64):
+        period = pd.to_datetime(period).to_numpy()
+    return period.astype('datetime64[h]').astype('int64')
+
+
+class PreprocessState(object):
+    """
+    Everything the preprocessing of new rows needs from the history.
+
+    Holds P² sketches of the first and third quartile of all values, the
+    IQR bounds the features are filtered with, the rolling window of the
+    last kept values and the kept values the lags and lagged windows can
+    still reach, keyed by their row number or, for hourly data, their
+    hour. New rows are turned into supervised feature rows in
+    O(window + lags) time each, matching
+    filter_by_iqr -> extract_features -> transform_to_supervised run over
+    the whole history with the same bounds.
+    """
+    def __init__(self, bounds, window_size=WINDOW_SIZE, lags=(1,),
+                 rolling=(), hourly=False):
+        self.bounds = tuple(bounds)
+        self.q1 = P2Quantile(0.25)
+        self.q3 = P2Quantile(0.75)
+        self.window = RollingWindow(window_size)
+        self.lags = tuple(lags)
+        self.rolling = tuple(tuple(pair) for pair in rolling)
+        self.reach = max([*self.lags,
+                          *(lag + size - 1 for lag, size in self.rolling)])
+        self.hourly = hourly
+        # Kept values by position, oldest first.
+        self.recent = {}
+        self.rows = 0
+        # Position of the first row with a full rolling window.
+        self.start = None
+        self.last_period = None
+
+    @classmethod
+    def from_history(cls, df, bounds=None, window_size=WINDOW_SIZE,
+                     lags=(1,), rolling=(), hourly=False):
+        if bounds is None:
+            bounds = iqr_bounds(df['value'])
+        state = cls(bounds, window_size, lags, rolling, hourly)
+
+        values = df['value'].to_numpy(dtype='float64')
+        state.q1 = P2Quantile.from_values(values, 0.25)
+        state.q3 = P2Quantile.from_values(values, 0.75)
+
+        df_filtered = filter_by_iqr(df, bounds)
+        kept = df_filtered['value'].to_numpy(dtype='int64')
+        for x in kept[-window_size:]:
+            state.window.push(x)
+
+        state.rows = len(kept)
+        positions = grid_positions(df_filtered['period'].to_numpy(), hourly)
+        if positions is None:
+            positions = np.arange(len(kept))
+        if len(kept) >= window_size:
+            state.start = int(positions[window_size - 1])
+        tail = slice(max(0, len(kept) - state.reach), None)
+        state.recent = dict(zip(positions[tail].tolist(), kept[tail].tolist()))
+        state.last_period = pd.Timestamp(df['period'].iloc[-1]).isoformat()
+        return state
+
+    def sketch_bounds(self):
+        """
+        IQR bounds from the streamed quartiles, i.e. what iqr_bounds
+        would approximately return on the full history now.
+        """
+        q1, q3 = self.q1.value(), self.q3.value()
+        return q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+
+    def bounds_drift(self):
+        """
+        Largest shift of the sketch bounds from the bounds rows are
+        filtered with, as a fraction of the filter's range.
+        """
+        lower, upper = self.bounds
+        if not upper > lower:
+            return math.inf
+        return max(abs(s - b) for s, b in zip(self.sketch_bounds(), self.bounds)) \
+            / (upper - lower)
+
+    def remember(self, position, value):
+        self.recent[position] = value
+        # Positions only grow, so the oldest entries come first.
+        oldest = position + 1 - self.reach
+        while next(iter(self.recent)) < oldest:
+            del self.recent[next(iter(self.recent))]
+
+    def lag_row(self, position):
+        """
+        Lag features of a row at `position` in lag_schema order, with
+        None for missing lags.
+        """
+        row = [self.recent.get(position - lag) for lag in self.lags]
+        for lag, size in self.rolling:
+            values = [self.recent[p] for p in
+                      range(position - lag - size + 1, position - lag + 1)
+                      if p in self.recent]
+            if len(values) < 2:
+                row += [np.nan, np.nan]
+            else:
+                row += [np.mean(values), np.std(values, ddof=1)]
+        return row
+
+    def process(self, df):
+        """
+        Consume new raw rows and return their supervised feature rows.
+
+        Args:
+            df (pd.DataFrame): Rows with 'period', 'timezone' and 'value'
+                columns, in period order and all newer than the state.
+
+        Returns:
+            pd.DataFrame: Feature rows of the kept values, with the
+                  columns of transform_to_supervised.
+        """
+        lower, upper = self.bounds
+        period = df['period'].to_numpy()
+        if not np.issubdtype(period.dtype, np.datetime64):
+            period = pd.to_datetime(df['period']).to_numpy()
+        hours = grid_positions(period, self.hourly)
+
+        kept, lagged, means, stds = [], [], [], []
+        for i, value in enumerate(df['value'].to_numpy(dtype='int64').tolist()):
+            self.q1.add(value)
+            self.q3.add(value)
+            if not lower <= value <= upper:
+                continue
+
+            position = self.rows if hours is None else int(hours[i])
+            self.rows += 1
+            self.window.push(value)
+            if self.start is None and self.window.full:
+                self.start = position
+            # Windows may not start before the first row with features.
+            if not self.window.full or position - self.reach < self.start:
+                self.remember(position, value)
+                continue
+            row = self.lag_row(position)
+            self.remember(position, value)
+            if None in row:
+                continue
+            kept.append(i)
+            lagged.append(row)
+            means.append(self.window.mean)
+            stds.append(self.window.std)
+
+        if len(df):
+            self.last_period = pd.Timestamp(df['period'].iloc[-1]).isoformat()
+
+        rows = df.iloc[kept]
+        period = period[kept]
+        hours = period.astype('datetime64[h]').astype('int64')
+
+        data = {
+            'timezone': pd.Categorical(rows['timezone']),
+            'value': rows['value'].to_numpy(dtype='int32'),
+        }
+        data.update(calendar_features(hours // 24))
+        if self.hourly:
+            data['hour'] = (hours % 24).astype('int8')
+        data['rolling_mean'] = np.asarray(means, dtype='float32')
+        data['rolling_std'] = np.asarray(stds, dtype='float32')
+        schema = lag_schema(self.lags, self.rolling)
+        lagged = np.asarray(lagged, dtype='float32').reshape(-1, len(schema))
+        for j, name in enumerate(schema):
+            data[name] = lagged[:, j]
+        return pd.DataFrame(data, copy=False)
+
+    def inference_features(self):
+        """
+        Lag features of the step after the last row, for
+        prepare_for_inference, except 'lag': the previous period is the
+        last row itself. Lags that fall on a filtered or missing period
+        are NaN.
+        """
+        if self.hourly:
+            step = int(grid_positions([self.last_period], True)[0]) + 1
+        else:
+            step = self.rows
+        row = [np.nan if x is None else float(x) for x in self.lag_row(step)]
+        features = dict(zip(lag_schema(self.lags, self.rolling), row))
+        features.pop('lag', None)
+        return features
+
+    def to_dict(self):
+        return {
+            'bounds': list(self.bounds),
+            'q1': self.q1.to_dict(),
+            'q3': self.q3.to_dict(),
+            'window': self.window.to_dict(),
+            'lags': list(self.lags),
+            'rolling': [list(pair) for pair in self.rolling],
+            'hourly': self.hourly,
+            'recent': [[p, v] for p, v in self.recent.items()],
+            'rows': self.rows,
+            'start': self.start,
+            'last_period': self.last_period,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['bounds'], data['window']['size'], data['lags'],
+                    data['rolling'], data['hourly'])
+        state.q1 = P2Quantile.from_dict(data['q1'])
+        state.q3 = P2Quantile.from_dict(data['q3'])
+        state.window = RollingWindow.from_dict(data['window'])
+        state.recent = {p: v for p, v in data['recent']}
+        state.rows = data['rows']
+        state.start = data['start']
+        state.last_period = data['last_period']
+        return state
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+import os
+import time
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import mlflow
+import mlflow.xgboost
+from mlflow import MlflowClient
+from mlflow.entities import Metric, Param
+
+# Limits of a single log_batch request.
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+
+
+def setup_tracking(config):
+    """
+    Point MLflow at the Postgres tracking server and the experiment.
+
+    An MLFLOW_TRACKING_URI set in the environment, e.g. a local file
+    store, takes precedence over the configured database.
+    """
+    if 'MLFLOW_TRACKING_URI' not in os.environ:
+        dbname = config.data.conn_params.dbname
+        user = config.data.conn_params.user
+        password = config.data.conn_params.password
+        host = config.data.conn_params.host
+
+        TRACKING_URI = f'postgresql://{user}:{password}@{host}/{dbname}'
+        print("Setting tracking URI to:", TRACKING_URI)
+        mlflow.set_tracking_uri(TRACKING_URI)
+
+    try:
+        print("Creating experiment...", config.mlflow.experiment_name)
+        mlflow.create_experiment(
+            name=config.mlflow.experiment_name,
+            artifact_location=config.mlflow.s3bucket + '/mlruns'
+        )
+    except:
+        print("Creating failed, using existing experiment...", config.mlflow.experiment_name)
+    mlflow.set_experiment(config.mlflow.experiment_name)
+
+
+class RunLogger(object):
+    """
+    Buffered logging into one MLflow run.
+
+    Params and metrics are kept in memory, metrics with their step, and
+    sent with as few `log_batch` calls as the backend limits allow when
+    the logger is flushed. Artifact and model uploads go through a single
+    background thread when `async_uploads` is set, so training is not
+    blocked on the artifact store. `close` waits for them and re-raises
+    upload errors.
+    """
+    def __init__(self, run_id, async_uploads=False, client=None):
+        self.run_id = run_id
+        self.client = client or MlflowClient()
+        self.params = {}
+        self.metrics = []
+        self.uploads = []
+        self.executor = ThreadPoolExecutor(max_workers=1) \
+            if async_uploads else None
+
+    def log_params(self, params):
+        for key, value in params.items():
+            self.params[key] = str(value)
+
+    def log_metric(self, key, value, step=0):
+        self.metrics.append(
+            Metric(key, float(value), int(time.time() * 1000), step)
+        )
+
+    def flush(self):
+        params = [Param(key, value) for key, value in self.params.items()]
+        for i in range(0, len(params), MAX_PARAMS_PER_BATCH):
+            self.client.log_batch(
+                self.run_id, params=params[i:i + MAX_PARAMS_PER_BATCH]
+            )
+        for i in range(0, len(self.metrics), MAX_METRICS_PER_BATCH):
+            self.client.log_batch(
+                self.run_id, metrics=self.metrics[i:i + MAX_METRICS_PER_BATCH]
+            )
+        self.params = {}
+        self.metrics = []
+
+    def submit(self, func, *args):
+        if self.executor is None:
+            func(*args)
+        else:
+            self.uploads.append(self.executor.submit(func, *args))
+
+    def log_artifacts(self, local_dir, artifact_path=None):
+        self.submit(self.client.log_artifacts, self.run_id, local_dir, artifact_path)
+
+    def log_model(self, model, artifact_path):
+        """
+        Save an XGBoost model in MLflow format and upload it to the run.
+
+        The model is serialized right away, so it may be changed while
+        the upload is still running.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        local_path = os.path.join(tmp_dir, artifact_path)
+        mlflow.xgboost.save_model(model, local_path)
+
+        def upload():
+            try:
+                self.client.log_artifacts(self.run_id, local_path, artifact_path)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.submit(upload)
+
+    def close(self):
+        """
+        Wait for pending uploads and send the buffered params and metrics.
+        """
+        try:
+            for upload in self.uploads:
+                upload.result()
+        finally:
+            self.uploads = []
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.flush()
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 # coding: utf-8
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import mlflow
 # from prefect import task
 import pandas as pd
+import xgboost as xgb
 
 import matplotlib
 matplotlib.use('Agg')
@@ -13,21 +16,132 @@ from sklearn.preprocessing import OneHotEncoder
 from sklearn.model_selection import TimeSeriesSplit
 from sklearn.metrics import mean_absolute_error
 
+import tracking
+
+def model_params(config) -> dict:
+    """
+    XGBoost parameters required by the configured feature encoding.
+    """
+    if config.training.ENCODING == 'native':
+        return {'enable_categorical': True, 'tree_method': 'hist'}
+    return {}
+
+class FoldData(object):
+    """
+    Quantized training and test matrices of every TimeSeriesSplit fold.
+
+    Bin boundaries are computed once over the full feature matrix and
+    shared by all folds through `ref`. Every fold is binned from a prefix
+    slice of X instead of a copied `iloc[train_index]`. Matrices are
+    built on first use and kept, so repeated calls, e.g. one per tuning
+    trial, reuse them.
+    """
+    def __init__(self, X, y, n_splits, max_bin=256):
+        self.X = X
+        self.y = y
+        self.max_bin = max_bin
+        self.enable_categorical = any(
+            isinstance(dtype, pd.CategoricalDtype) for dtype in X.dtypes
+        )
+        # TimeSeriesSplit trains on a prefix and tests on the rows after it.
+        self.splits = [
+            (test_index[0], test_index[-1] + 1)
+            for _, test_index in TimeSeriesSplit(n_splits=n_splits).split(X)
+        ]
+        self._ref = None
+        self._folds = {}
+        self._lock = threading.Lock()
+
+    def matrix(self, start, stop, ref=None):
+        return xgb.QuantileDMatrix(
+            self.X.iloc[start:stop],
+            self.y.iloc[start:stop],
+            ref=ref,
+            max_bin=self.max_bin,
+            enable_categorical=self.enable_categorical
+        )
+
+    def fold(self, idx):
+        """
+        Return the training and test matrices of fold `idx`.
+        """
+        with self._lock:
+            if idx not in self._folds:
+                if self._ref is None:
+                    self._ref = self.matrix(0, len(self.X))
+                split, stop = self.splits[idx]
+                dtrain = self.matrix(0, split, ref=self._ref)
+                # Evaluation data has to reference its training matrix,
+                # which carries the same bins.
+                self._folds[idx] = (dtrain, self.matrix(split, stop, ref=dtrain))
+            return self._folds[idx]
+
+def fit_fold(model: XGBRegressor, folds: FoldData, idx: int, nthread: int) -> tuple:
+    """
+    Train the booster of one fold with the parameters of `model`.
+
+    Returns:
+        tuple: Booster, training MAE and test MAE.
+    """
+    dtrain, dtest = folds.fold(idx)
+    params = model.get_xgb_params()
+    params.pop('n_jobs', None)
+    params.update(nthread=nthread, tree_method='hist', max_bin=folds.max_bin)
+
+    booster = xgb.train(
+        params,
+        dtrain,
+        num_boost_round=model.n_estimators or 100,
+        evals=[(dtest, 'validation_0')],
+        early_stopping_rounds=model.early_stopping_rounds,
+        verbose_eval=False
+    )
+    # Same trees as XGBRegressor.predict after early stopping.
+    iteration_range = (0, booster.best_iteration + 1) \
+        if model.early_stopping_rounds else (0, 0)
+
+    split, stop = folds.splits[idx]
+    mae_train = mean_absolute_error(
+        folds.y.iloc[:split],
+        booster.predict(dtrain, iteration_range=iteration_range)
+    )
+    mae_test = mean_absolute_error(
+        folds.y.iloc[split:stop],
+        booster.predict(dtest, iteration_range=iteration_range)
+    )
+    return booster, mae_train, mae_test
+
 # @task(name='train func', retries=3, retry_delay_seconds=3)
 def train(config,
     model: XGBRegressor, 
     X: pd.DataFrame, 
     y: pd.Series,
     n_splits: int,
-    track=False
+    track=False,
+    artifacts_path='./artifacts',
+    tags=None,
+    fold_callback=None,
+    folds=None
 ) -> tuple:
     """
     Train a model using TimeSeriesSplit cross-validation.
 
+    Folds are trained with the native XGBoost API on the shared quantized
+    matrices of `folds`. Up to training.FOLD_WORKERS folds run at once,
+    splitting the threads of the model between them. `model` is left
+    holding the booster of the last fold.
+
     Args:
         model (XGBRegressor): XGBoost regressor using scikit-learn API.
         X (pd.DataFrame): Features DataFrame.
         y (pd.Series): Target values Series.
+        artifacts_path (str): Directory logged with the tracked run.
+        tags (dict): Tags set on the tracked run.
+        fold_callback (callable): Called after every fold with the fold
+            index and the average test MAE so far. It may raise to stop
+            the remaining folds, e.g. to prune a tuning trial.
+        folds (FoldData): Fold matrices of X and y to reuse, built here
+            when None.
 
     Returns:
         tuple: Contains average Mean Absolute Error on the training 
@@ -35,62 +149,67 @@ def train(config,
     """
 
     if track == True:
-        dbname = config.data.conn_params.dbname
-        user = config.data.conn_params.user
-        password = config.data.conn_params.password
-        host = config.data.conn_params.host
-
-        TRACKING_URI = f'postgresql://{user}:{password}@{host}/{dbname}'
-        print("Setting tracking URI to:", TRACKING_URI)
-        mlflow.set_tracking_uri(TRACKING_URI)
-        
-        try:
-            print("Creating experiment...", config.mlflow.experiment_name)
-            mlflow.create_experiment(
-                name=config.mlflow.experiment_name, 
-                artifact_location=config.mlflow.s3bucket + '/mlruns'
-            )
-        except:
-            print("Creating failed, using existing experiment...", config.mlflow.experiment_name)
-            mlflow.set_experiment(config.mlflow.experiment_name)
+        tracking.setup_tracking(config)
     # Lists to store mean absolute errors for training and test sets
     mae_train_hist = []
     mae_test_hist = []
     
-    tscv = TimeSeriesSplit(n_splits=n_splits)
+    if folds is None:
+        folds = FoldData(X, y, n_splits)
+
+    fold_workers = max(1, min(config.training.FOLD_WORKERS, n_splits))
+    threads = model.n_jobs if model.n_jobs and model.n_jobs > 0 \
+        else os.cpu_count() or 1
+    nthread = max(1, threads // fold_workers)
+
     if track == True:
-        run = mlflow.start_run()
-        
-    # Split the data using TimeSeriesSplit for cross-validation
-    for train_index, test_index in tscv.split(X):
-        # Split the data into training and test sets
-        X_train, X_test = X.iloc[train_index], X.iloc[test_index]
-        y_train, y_test = y.iloc[train_index], y.iloc[test_index]
-        
-        # Train the model
-        model.fit(X_train, y_train, eval_set=[(X_test, y_test)], verbose=False)
-        
-        # Predict on training and test sets
-        y_pred_train = model.predict(X_train)
-        y_pred_test = model.predict(X_test)
-        
-        # Calculate mean absolute error for training and test sets
-        mae_train = mean_absolute_error(y_train, y_pred_train)
-        mae_test = mean_absolute_error(y_test, y_pred_test)
-        
-        # Append the errors to their respective histories
-        mae_train_hist.append(mae_train)
-        mae_test_hist.append(mae_test)
-        if track == True:
-            mlflow.log_params(model.get_params())
-            mlflow.log_metric('mae_train', mae_train)
-            mlflow.log_metric('mae_test', mae_test)
-            mlflow.xgboost.log_model(model, 'xgb_best')
-            mlflow.log_artifacts('./artifacts')
+        run = mlflow.start_run(tags=tags)
+        run_logger = tracking.RunLogger(
+            run.info.run_id, async_uploads=config.mlflow.async_uploads
+        )
+        run_logger.log_params(model.get_params())
+        # Uploads while the folds train.
+        run_logger.log_artifacts(artifacts_path)
+
+    with ThreadPoolExecutor(max_workers=fold_workers) as executor:
+        futures = [
+            executor.submit(fit_fold, model, folds, idx, nthread)
+            for idx in range(n_splits)
+        ]
+        try:
+            # Folds are reported in order, whichever finishes first.
+            for future in futures:
+                booster, mae_train, mae_test = future.result()
+                model._Booster = booster
+
+                # Append the errors to their respective histories
+                mae_train_hist.append(mae_train)
+                mae_test_hist.append(mae_test)
+                if fold_callback is not None:
+                    fold_callback(
+                        len(mae_test_hist) - 1,
+                        sum(mae_test_hist) / len(mae_test_hist)
+                    )
+                if track == True:
+                    fold = len(mae_test_hist) - 1
+                    run_logger.log_metric('mae_train', mae_train, step=fold)
+                    run_logger.log_metric('mae_test', mae_test, step=fold)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            if track == True:
+                try:
+                    run_logger.close()
+                finally:
+                    mlflow.end_run(status='FAILED')
+            raise
 
     # Calculate average mean absolute error for training and test sets
     mae_train_avg = sum(mae_train_hist) / len(mae_train_hist)
     mae_test_avg = sum(mae_test_hist) / len(mae_test_hist)
     if track == True:
+        # Only the model of the last fold is kept.
+        run_logger.log_model(model, 'xgb_best')
+        run_logger.close()
         mlflow.end_run()
     return (mae_train_avg, mae_test_avg)
\ No newline at end of file
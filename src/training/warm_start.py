@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# coding: utf-8
+import numpy as np
+import pandas as pd
+import mlflow
+import mlflow.xgboost
+from mlflow import MlflowClient
+from mlflow.exceptions import MlflowException
+from xgboost import XGBRegressor
+from sklearn.metrics import mean_absolute_error
+
+import tracking
+from register_model import registered_model_name
+
+
+def production_model(config, subba):
+    """
+    Return the Production model of a subba and the run that trained it,
+    or None when no version is in Production.
+    """
+    client = MlflowClient()
+    model_name = registered_model_name(config, subba)
+    try:
+        versions = client.get_latest_versions(model_name, stages=["Production"])
+    except MlflowException:
+        return None
+    if not versions:
+        return None
+
+    model = mlflow.xgboost.load_model(f"models:/{model_name}/{versions[0].version}")
+    return model, client.get_run(versions[0].run_id)
+
+
+def base_booster(model: XGBRegressor):
+    """
+    Trees of `model` to continue boosting from.
+
+    Trees past the early stopping point are dropped, and the early
+    stopping attributes are cleared so that predictions use every tree
+    of the continued model.
+    """
+    booster = model.get_booster()
+    best_iteration = booster.attr('best_iteration')
+    if best_iteration is not None:
+        booster = booster[:int(best_iteration) + 1]
+    booster.set_attr(best_iteration=None, best_score=None)
+    return booster
+
+
+def parse_param(value: str):
+    """
+    Python value of a param logged as a string by RunLogger.
+    """
+    if value in ('True', 'False'):
+        return value == 'True'
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def base_params(client, run) -> tuple:
+    """
+    Hyperparameters of the full retrain that `run` descends from, and
+    that run's ID.
+
+    A model loaded with mlflow.xgboost.load_model keeps none of them:
+    `get_params` returns None for every tuned parameter, and added trees
+    would use XGBoost's defaults. They are read from the params logged
+    with the full run instead, found through the `full_run_id` tag of
+    warm started runs, or by following `base_run_id` for older ones.
+    Unset (None) params are left out.
+    """
+    full_run_id = run.data.tags.get('full_run_id')
+    if full_run_id is not None:
+        run = client.get_run(full_run_id)
+    while run.data.tags.get('retrain') == 'incremental':
+        run = client.get_run(run.data.tags['base_run_id'])
+
+    params = {
+        key: parse_param(value) for key, value in run.data.params.items()
+        if value != 'None'
+    }
+    return params, run.info.run_id
+
+
+def continue_model(booster, params: dict, X, y, n_rounds: int,
+                   n_jobs=None) -> XGBRegressor:
+    """
+    Add `n_rounds` trees fitted on X and y to the trees of `booster`,
+    with the hyperparameters `params` it was trained with.
+    """
+    params = dict(params)
+    for key in ('n_estimators', 'early_stopping_rounds', 'n_jobs', 'callbacks'):
+        params.pop(key, None)
+    new_model = XGBRegressor(**params, n_estimators=n_rounds, n_jobs=n_jobs)
+    new_model.fit(X, y, xgb_model=booster, verbose=False)
+    return new_model
+
+
+def drift_score(y_train: pd.Series, y_new: pd.Series) -> float:
+    """
+    Shift of the mean of the new targets, in standard deviations of the
+    targets the model was trained on.
+    """
+    std = y_train.std()
+    if not std > 0:
+        return np.inf
+    return abs(y_new.mean() - y_train.mean()) / std
+
+
+def warm_start(config, subba, X, y, artifacts_path, n_jobs=None):
+    """
+    Continue boosting the Production model of a subba on the new rows.
+
+    Rows past the `train_rows` tag of the Production run are new. The
+    Production model is first scored on them: a mean shift above
+    DRIFT_THRESHOLD or an MAE above MAE_TOLERANCE times the run's
+    validated `mae_test` means the model needs a full retrain, and so
+    does a model that would grow past MAX_TREES trees, so that scoring
+    and continuing it do not get slower with every run. Otherwise
+    RETRAIN_ROUNDS trees are added with the hyperparameters of the full
+    retrain the model descends from, fitted on the last RETRAIN_WINDOW
+    rows at least, so the cost does not grow with the history.
+
+    Args:
+        X (pd.DataFrame): Features of the full history.
+        y (pd.Series): Targets of the full history.
+        artifacts_path (str): Directory logged with the tracked run.
+        n_jobs (int): Threads used by XGBoost, all cores when None.
+
+    Returns:
+        tuple: The continued model and its run ID, the Production model
+              and None when there are no new rows, or None when a full
+              retrain is needed.
+    """
+    tracking.setup_tracking(config)
+
+    production = production_model(config, subba)
+    if production is None:
+        print("No Production model to warm start from.")
+        return None
+    model, run = production
+
+    train_rows = run.data.tags.get('train_rows')
+    if train_rows is None or int(train_rows) > len(X):
+        print("Production run does not match the current history.")
+        return None
+    train_rows = int(train_rows)
+
+    if train_rows == len(X):
+        print("No new rows since the Production model was trained.")
+        return model, None
+
+    y_new = y.iloc[train_rows:]
+    drift = drift_score(y.iloc[:train_rows], y_new)
+    mae_new = mean_absolute_error(y_new, model.predict(X.iloc[train_rows:]))
+    mae_test = run.data.metrics.get('mae_test')
+    print(f"{len(y_new)} new rows, drift {drift:.2f}, MAE {mae_new:.2f} "
+          f"(validated {mae_test})")
+
+    if drift > config.training.DRIFT_THRESHOLD:
+        print("Target drift above threshold.")
+        return None
+    if mae_test is None or mae_new > config.training.MAE_TOLERANCE * mae_test:
+        print("Production MAE on new rows above tolerance.")
+        return None
+
+    booster = base_booster(model)
+    n_trees = booster.num_boosted_rounds()
+    if n_trees + config.training.RETRAIN_ROUNDS > config.training.MAX_TREES:
+        print(f"Production model has {n_trees} trees, rebasing.")
+        return None
+
+    params, full_run_id = base_params(MlflowClient(), run)
+    start = max(0, min(train_rows, len(X) - config.training.RETRAIN_WINDOW))
+    new_model = continue_model(
+        booster, params, X.iloc[start:], y.iloc[start:],
+        config.training.RETRAIN_ROUNDS, n_jobs=n_jobs
+    )
+
+    with mlflow.start_run(tags={
+        'subba': subba,
+        'train_rows': str(len(X)),
+        'retrain': 'incremental',
+        'base_run_id': run.info.run_id,
+        'full_run_id': full_run_id,
+    }) as new_run:
+        run_logger = tracking.RunLogger(
+            new_run.info.run_id, async_uploads=config.mlflow.async_uploads
+        )
+        run_logger.log_params(params)
+        # Warm starts keep the cross-validated error of the full retrain
+        # they descend from, the baseline of the next MAE check.
+        run_logger.log_metric('mae_test', mae_test)
+        run_logger.log_metric('mae_new', mae_new)
+        run_logger.log_metric('drift', drift)
+        run_logger.log_artifacts(artifacts_path)
+        run_logger.log_model(new_model, 'xgb_best')
+        run_logger.close()
+    return new_model, new_run.info.run_id
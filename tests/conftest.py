@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'training'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'prediction'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
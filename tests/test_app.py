@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import mlflow
+import mlflow.xgboost
+from mlflow import MlflowClient
+from omegaconf import OmegaConf
+from xgboost import XGBRegressor
+
+import app
+import run_artifacts
+from data_preprocessing import preprocess, prepare_for_inference, WINDOW_SIZE
+from synthetic import demand_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+MODEL_NAME = 'xgb-regressor-ZONJ-reg'
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    """
+    Local file store and model cache, with nothing loaded yet.
+    """
+    uri = 'file://' + str(tmp_path / 'mlruns')
+    monkeypatch.setenv('MLFLOW_TRACKING_URI', uri)
+    monkeypatch.setenv('MLFLOW_ALLOW_FILE_STORE', 'true')
+    mlflow.set_tracking_uri(uri)
+    monkeypatch.setattr(app, 'CACHE_DIR', str(tmp_path / 'model-cache'))
+    monkeypatch.setattr(app, '_models', {})
+    yield tmp_path
+    mlflow.set_tracking_uri(None)
+
+
+def publish(tmp_path, n_rows=1000, manifest=True, hourly=False):
+    """
+    Train a model, log it as main_flow does and make it the Production
+    version of MODEL_NAME.
+    """
+    df = demand_frame(n_rows, hourly=hourly)
+    df_processed, ohe = preprocess(df, encoding='native', hourly=hourly)
+    X = df_processed.drop(columns=['value'])
+    model = XGBRegressor(n_estimators=10, max_depth=3,
+                         enable_categorical=True, tree_method='hist')
+    model.fit(X, df_processed['value'])
+
+    schema = X.columns.tolist()
+    recent_prepared = prepare_for_inference(
+        df=df.iloc[[-1]].reset_index(drop=True),
+        last_day_rolling_vals=df_processed[['rolling_mean', 'rolling_std']].iloc[-1].to_numpy(),
+        ohe=ohe,
+        schema=schema,
+        encoding='native'
+    )
+    recent_values = {
+        'period': df['period'].iloc[-1].isoformat(),
+        'frequency': 'hourly' if hourly else 'daily',
+        'window': df_processed['value'].to_numpy()[-WINDOW_SIZE:].tolist(),
+    }
+
+    with mlflow.start_run() as run:
+        mlflow.xgboost.log_model(model, 'xgb_best')
+        if manifest:
+            artifacts_path = str(tmp_path / f'artifacts-{run.info.run_id}')
+            run_artifacts.save_artifacts(
+                artifacts_path, ohe=ohe, schema=schema,
+                recent_prepared=recent_prepared,
+                recent_values=recent_values, encoding='native'
+            )
+            mlflow.log_artifacts(artifacts_path)
+
+    version = mlflow.register_model(f"runs:/{run.info.run_id}/xgb_best", MODEL_NAME)
+    MlflowClient().transition_model_version_stage(
+        MODEL_NAME, version.version, 'Production', archive_existing_versions=True
+    )
+    return model, recent_prepared[schema], df['period'].iloc[-1]
+
+
+def test_production_model_is_served(registry):
+    model, recent, _ = publish(registry)
+    assert np.isclose(app.predict(MODEL_NAME), model.predict(recent)[0], rtol=1e-6)
+
+
+def test_run_without_manifest_fails_clearly(registry):
+    publish(registry, manifest=False)
+    with pytest.raises(ValueError, match=run_artifacts.MANIFEST):
+        app.load_model(MODEL_NAME)
+    # Nothing is downloaded for a run that cannot be served.
+    assert not os.path.exists(os.path.join(app.CACHE_DIR, MODEL_NAME))
+
+
+def test_daily_forecasts_are_labelled_by_day(registry):
+    last = publish(registry)[2]
+    config = OmegaConf.load(CONFIG_PATH)
+
+    forecasts = app.batch_forecast(config, {'subbas': 'ZONJ', 'horizon': 3})
+    assert [f['date'] for f in forecasts] == [
+        (last + pd.Timedelta(days=step)).strftime('%Y-%m-%d') for step in (1, 2, 3)
+    ]
+    wanted = (last + pd.Timedelta(days=5)).strftime('%Y-%m-%d')
+    forecasts = app.batch_forecast(config, {'subbas': 'ZONJ', 'dates': [wanted]})
+    assert [f['date'] for f in forecasts] == [wanted]
+
+
+def test_hourly_forecasts_are_labelled_by_hour(registry):
+    model, recent, last = publish(registry, n_rows=24 * 60, hourly=True)
+    config = OmegaConf.load(CONFIG_PATH)
+
+    forecasts = app.batch_forecast(config, {'subbas': 'ZONJ', 'horizon': 1})
+    next_hour = (last + pd.Timedelta(hours=1)).isoformat()
+    assert [f['date'] for f in forecasts] == [next_hour]
+    assert np.isclose(forecasts[0]['prediction'], model.predict(recent)[0], rtol=1e-6)
+
+    forecasts = app.batch_forecast(config, {'subbas': 'ZONJ', 'dates': [next_hour]})
+    assert [f['date'] for f in forecasts] == [next_hour]
+    # The hour of later steps is not known to the recent features.
+    later = (last + pd.Timedelta(hours=3)).isoformat()
+    with pytest.raises(ValueError, match='horizon of 1'):
+        app.batch_forecast(config, {'subbas': 'ZONJ', 'dates': [later]})
+
+
+def test_cached_model_is_served_without_a_production_version(registry, monkeypatch):
+    model, recent, _ = publish(registry)
+    expected = app.predict(MODEL_NAME)
+
+    # E.g. right after the registered models were renamed.
+    client = MlflowClient()
+    for version in client.search_model_versions(f"name='{MODEL_NAME}'"):
+        client.transition_model_version_stage(MODEL_NAME, version.version, 'Archived')
+    monkeypatch.setattr(app, 'CHECK_INTERVAL', 0)
+    assert app.predict(MODEL_NAME) == expected
+
+    monkeypatch.setattr(app, '_models', {})
+    with pytest.raises(ValueError, match='no Production version'):
+        app.load_model(MODEL_NAME)
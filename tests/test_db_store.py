@@ -0,0 +1,182 @@
+import os
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from omegaconf import OmegaConf
+
+import db_store
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+TOTAL_ROWS = 10
+CHUNK_LEN = 2
+
+
+class StubAPI(object):
+    """
+    Local stand-in for the EIA API, serving TOTAL_ROWS rows of every
+    subba in pages. Statuses queued in `fail` are returned first.
+    """
+    def __init__(self):
+        self.requests = []
+        self.fail = []
+        self.lock = threading.Lock()
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                with api.lock:
+                    api.requests.append(query)
+                    status = api.fail.pop(0) if api.fail else 200
+                if status != 200:
+                    self.send_response(status)
+                    self.end_headers()
+                    return
+                offset, length = int(query['offset']), int(query['length'])
+                rows = [{
+                    'period': f"2024-01-{i + 1:02d}",
+                    'subba': query['subba'],
+                    'subba-name': query['subba'],
+                    'parent': 'PJM',
+                    'parent-name': 'PJM',
+                    'timezone': 'Eastern',
+                    'value': 100 + i,
+                    'value-units': 'megawatthours',
+                } for i in range(offset, min(offset + length, TOTAL_ROWS))]
+                body = json.dumps({'response': {'total': TOTAL_ROWS, 'data': rows}})
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def offsets(self, subba=None):
+        return sorted(int(q['offset']) for q in self.requests
+                      if subba is None or q['subba'] == subba)
+
+
+class FakeStore(object):
+    """
+    Database handler recording stored rows, failing the pages whose
+    first period is listed in `fail_periods`.
+    """
+    def __init__(self, fail_periods=()):
+        self.rows = []
+        self.fail_periods = set(fail_periods)
+        self.conn = self
+
+    def insert(self, data, schema, tab_name):
+        if data[0][0] in self.fail_periods:
+            self.fail_periods.discard(data[0][0])
+            raise RuntimeError("insert failed")
+        self.rows.extend(data)
+
+    copy_insert = insert
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def api():
+    api = StubAPI()
+    yield api
+    api.server.shutdown()
+
+
+@pytest.fixture
+def config(api, tmp_path):
+    config = OmegaConf.load(CONFIG_PATH)
+    config.data.api.urls.DEMAND = (
+        api.url + "?subba=<SUBBA_CODE>&start=<START_DATE>&end=<END_DATE>"
+        "&offset=<OFFSET>&length=<CHUNK_LEN>"
+    )
+    config.data.api.query.CHUNK_LEN = CHUNK_LEN
+    config.data.api.download.BACKOFF = 0
+    config.data.api.download.CHECKPOINT = str(tmp_path / 'checkpoint.json')
+    return config
+
+
+def test_failed_page_is_resumed_from_the_checkpoint_start(api, config):
+    store = FakeStore(fail_periods={'2024-01-05'})
+    stored, _ = db_store.ingest(config, store, 'demand', 'ZONJ', '2024-01-01')
+    assert stored == TOTAL_ROWS - CHUNK_LEN
+
+    # Later pages are stored, the watermark alone would skip the failed one.
+    start_date = db_store.ingest_start(config, 'demand', 'ZONJ', '2024-01-10')
+    assert start_date == '2024-01-01'
+
+    api.requests.clear()
+    stored, _ = db_store.ingest(config, store, 'demand', 'ZONJ', start_date)
+    assert stored == CHUNK_LEN
+    # The first page is always fetched for the row count.
+    assert api.offsets() == [0, 4]
+    assert sorted(row[0] for row in store.rows) == \
+        [f"2024-01-{i + 1:02d}" for i in range(TOTAL_ROWS)]
+    assert not os.path.exists(db_store.checkpoint_path(config, 'demand', 'ZONJ'))
+    assert db_store.ingest_start(config, 'demand', 'ZONJ', '2024-01-10') == '2024-01-07'
+
+
+def test_checkpoints_are_kept_per_subba(api, config):
+    store = FakeStore(fail_periods={'2024-01-03'})
+    db_store.ingest(config, store, 'demand', 'ZONJ', '2024-01-01')
+    db_store.ingest(config, store, 'demand', 'ZONK', '2024-01-02')
+
+    assert db_store.ingest_start(config, 'demand', 'ZONJ', '2024-01-10') == '2024-01-01'
+    assert db_store.ingest_start(config, 'demand', 'ZONK', '2024-01-10') == '2024-01-07'
+
+
+@pytest.fixture
+def downloader(config):
+    urlparser = db_store.URLParser(config, subba='ZONJ', start_date='2024-01-01')
+    return db_store.ChunkDownloader(
+        urlparser, 'demand', max_workers=2, max_retries=3, backoff=0,
+        checkpoint_path=db_store.checkpoint_path(config, 'demand', 'ZONJ')
+    )
+
+
+def test_fetch_retries_retryable_statuses(api, downloader):
+    api.fail = [503, 429]
+    data = downloader.fetch(downloader.urlparser.construct_url('demand'))
+    assert len(data['response']['data']) == CHUNK_LEN
+    assert len(api.requests) == 3
+
+
+def test_fetch_gives_up_after_max_retries(api, downloader):
+    api.fail = [500] * 10
+    with pytest.raises(db_store.requests.exceptions.RetryError):
+        downloader.fetch(downloader.urlparser.construct_url('demand'))
+    assert len(api.requests) == downloader.max_retries + 1
+
+
+def test_fetch_does_not_retry_client_errors(api, downloader):
+    api.fail = [404]
+    with pytest.raises(db_store.requests.exceptions.HTTPError):
+        downloader.fetch(downloader.urlparser.construct_url('demand'))
+    assert len(api.requests) == 1
+
+
+def test_download_resumes_from_the_checkpoint(api, downloader):
+    downloader.save_checkpoint({0, 2, 6})
+    done = downloader.load_checkpoint()
+    pages = dict(downloader.download(TOTAL_ROWS, done=done))
+
+    assert sorted(pages) == [4, 8]
+    assert api.offsets() == [4, 8]
+    assert [row['period'] for row in pages[4]] == ['2024-01-05', '2024-01-06']
+
+
+def test_checkpoint_of_another_query_is_ignored(downloader):
+    downloader.save_checkpoint({0, 2})
+    downloader.urlparser.chunk_len = 5
+    assert downloader.load_checkpoint() == set()
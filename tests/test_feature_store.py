@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from omegaconf import OmegaConf
+
+import feature_store
+from feature_store import FeatureStore, load_features
+from synthetic import demand_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+
+class FakeDB(object):
+    """
+    DatabaseHandler reading one subba's rows from a DataFrame.
+    """
+    def __init__(self, df):
+        self.df = df
+        self.reads = []
+
+    def window(self, start=None, end=None):
+        mask = np.ones(len(self.df), dtype=bool)
+        if start is not None:
+            mask &= (self.df['period'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (self.df['period'] <= pd.Timestamp(end)).to_numpy()
+        return self.df[mask].reset_index(drop=True)
+
+    def read_demand(self, tab_name, subba=None, start=None, end=None, columns=None):
+        df = self.window(start, end)
+        self.reads.append(len(df))
+        return df[list(columns)] if columns else df
+
+    def watermark(self, tab_name, subba=None, start=None, end=None):
+        df = self.window(start, end)
+        return df['period'].max(), len(df)
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = OmegaConf.load(CONFIG_PATH)
+    config.features.CACHE_DIR = str(tmp_path / 'cache')
+    return config
+
+
+def test_build_hit_and_extend(config):
+    df = demand_frame(1000)
+    db = FakeDB(df.iloc[:-20])
+    built = load_features(config, db, 'ZONJ')[0]
+
+    hit = load_features(config, db, 'ZONJ')[0]
+    pd.testing.assert_frame_equal(hit, built)
+    # Only the days the ingest may have revised are read again.
+    assert db.reads[1] == 2 * (config.data.api.query.OVERLAP_DAYS + 1)
+
+    db.df = df
+    extended = load_features(config, db, 'ZONJ')[0]
+    assert db.reads[-1] < 100
+    rebuilt, _ = feature_store.preprocess(
+        df, bounds=feature_store.iqr_bounds(df.iloc[:-20]['value']),
+        encoding=config.training.ENCODING,
+        **feature_store.feature_params(config)
+    )
+    pd.testing.assert_frame_equal(extended, rebuilt, check_dtype=False)
+
+
+def test_load_maps_the_arrow_file(config, tmp_path):
+    df = pd.DataFrame({
+        'value': np.arange(1000, dtype='int32'),
+        'rolling_mean': np.linspace(0, 1, 1000, dtype='float32'),
+        'timezone': pd.Categorical(['Eastern', 'Central'] * 500),
+    })
+    store = FeatureStore(str(tmp_path / 'cache'))
+    path = store.entry_path('ZONJ', '2024-01-01', 1000, 'f')
+    store.save(path, df, None, {'subba': 'ZONJ'})
+
+    allocated = pa.total_allocated_bytes()
+    loaded, _, _ = store.load(path)
+    # Columns are views of the memory map, not copies.
+    assert pa.total_allocated_bytes() - allocated < 1000
+    pd.testing.assert_frame_equal(loaded, df)
+
+
+def test_entries_skip_unfinished_writes(tmp_path):
+    store = FeatureStore(str(tmp_path / 'cache'), max_bytes=0)
+    path = store.entry_path('ZONJ', '2024-01-01', 10, 'f')
+    store.save(path, pd.DataFrame({'value': [1, 2]}), None,
+               {'subba': 'ZONJ', 'fingerprint': 'f', 'watermark': '2024-01-01'})
+
+    # Another process writing an entry, meta.json already in place.
+    tmp_path = f"{store.entry_path('ZONJ', '2024-01-02', 11, 'f')}.123.tmp"
+    os.makedirs(tmp_path)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f_out:
+        f_out.write('{"subba": "ZONJ", "fingerprint": "f", "watermark": "2024-01-02"}')
+
+    assert [meta['path'] for meta in store.entries()] == [path]
+    assert store.latest('ZONJ', 'f')['path'] == path
+    store.evict()
+    assert not os.path.exists(path)
+    assert os.path.isdir(tmp_path)
+
+
+def test_extension_rebuilds_when_the_bounds_drift(config):
+    df = demand_frame(1000)
+    db = FakeDB(df.iloc[:-200])
+    load_features(config, db, 'ZONJ')
+
+    # A lasting level shift moves the quartiles of the whole history.
+    shifted = df.copy()
+    shifted.loc[shifted.index[-200:], 'value'] += 20000
+    db.df = shifted
+    rows = len(db.reads)
+    features = load_features(config, db, 'ZONJ')[0]
+
+    assert db.reads[-1] == len(shifted)
+    assert len(db.reads) == rows + 2
+    rebuilt, _ = feature_store.preprocess(
+        shifted, bounds=feature_store.iqr_bounds(shifted['value']),
+        encoding=config.training.ENCODING,
+        **feature_store.feature_params(config)
+    )
+    pd.testing.assert_frame_equal(features, rebuilt, check_dtype=False)
+
+
+@pytest.mark.parametrize('appended', [0, 20])
+def test_revised_values_are_preprocessed_again(config, appended):
+    df = demand_frame(1000)
+    db = FakeDB(df.iloc[:-20])
+    load_features(config, db, 'ZONJ')
+
+    # The ingest upserts the last OVERLAP_DAYS again with revised values.
+    revised = df.iloc[:len(df) - 20 + appended].copy()
+    n_old = len(df) - 20
+    overlap = 2 * config.data.api.query.OVERLAP_DAYS
+    revised.loc[revised.index[n_old - overlap:n_old], 'value'] -= 50
+    db.df = revised
+    features = load_features(config, db, 'ZONJ')[0]
+
+    assert db.reads[-1] < 100
+    rebuilt, _ = feature_store.preprocess(
+        revised, bounds=feature_store.iqr_bounds(df.iloc[:-20]['value']),
+        encoding=config.training.ENCODING,
+        **feature_store.feature_params(config)
+    )
+    pd.testing.assert_frame_equal(features, rebuilt, check_dtype=False)
+    assert load_features(config, db, 'ZONJ')[0]['value'].tolist() \
+        == rebuilt['value'].tolist()
+
+
+def test_fingerprint_follows_only_the_feature_code_and_config(config, tmp_path, monkeypatch):
+    fprint = feature_store.fingerprint(config)
+    config.training.RETRAIN = 'full'
+    config.training.FOLD_WORKERS = 4
+    config.hyperparameters.N_JOBS = 4
+    assert feature_store.fingerprint(config) == fprint
+
+    config.training.ENCODING = 'onehot'
+    assert feature_store.fingerprint(config) != fprint
+    config.training.ENCODING = 'native'
+    config.features.daily.LAGS = [*config.features.daily.LAGS, 30]
+    assert feature_store.fingerprint(config) != fprint
+    config.features.daily.LAGS = config.features.daily.LAGS[:-1]
+    assert feature_store.fingerprint(config) == fprint
+
+    edited = tmp_path / 'calendar_features.py'
+    edited.write_text('# edited\n')
+    monkeypatch.setattr(feature_store.calendar_features, '__file__', str(edited))
+    assert feature_store.fingerprint(config) != fprint
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+from omegaconf import OmegaConf
+
+import hp_optimization
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeTrain(object):
+    """train_func returning a made-up MAE, failing after `fail_after` calls."""
+
+    def __init__(self, fail_after=None):
+        self.calls = 0
+        self.fail_after = fail_after
+
+    def __call__(self, config, model, X, y, n_splits, fold_callback, folds):
+        if self.calls == self.fail_after:
+            raise Interrupted()
+        self.calls += 1
+        mae = float(model.get_params()['max_depth'])
+        fold_callback(0, mae)
+        return mae, mae
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = OmegaConf.load(CONFIG_PATH)
+    config.hyperparameters.N_JOBS = 1
+    config.hyperparameters.STORAGE = str(tmp_path / 'optuna-journal.log')
+    return config
+
+
+def tune(config, train_func, study_name):
+    X, y = np.zeros((10, 1)), np.zeros(10)
+    return hp_optimization.tune_hyperparameters(
+        config, train_func, X, y, n_trials=4, n_splits=2,
+        study_name=study_name, folds=object()
+    )
+
+
+def test_storage_defaults_to_memory():
+    config = OmegaConf.load(CONFIG_PATH)
+    assert hp_optimization.make_storage(config.hyperparameters.STORAGE) is None
+
+
+def test_interrupted_study_resumes_then_its_journal_is_removed(config, tmp_path):
+    path = hp_optimization.journal_path(config.hyperparameters.STORAGE, 'study-ZONJ-10')
+    assert path == str(tmp_path / 'optuna-journal-study-ZONJ-10.log')
+
+    with pytest.raises(Interrupted):
+        tune(config, FakeTrain(fail_after=2), 'study-ZONJ-10')
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+    resumed = FakeTrain()
+    tune(config, resumed, 'study-ZONJ-10')
+    assert resumed.calls == 2
+    assert os.listdir(tmp_path) == []
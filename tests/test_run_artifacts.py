@@ -0,0 +1,187 @@
+import io
+import hashlib
+import os
+import json
+
+import numpy as np
+import pytest
+from xgboost import XGBRegressor
+
+import run_artifacts
+import lean_app
+from data_preprocessing import preprocess, prepare_for_inference, WINDOW_SIZE
+from scoring import BoosterScorer
+from synthetic import demand_frame
+
+ENCODING_PARAMS = {
+    'native': {'enable_categorical': True, 'tree_method': 'hist'},
+    'onehot': {},
+}
+
+
+@pytest.fixture(scope='module', params=['native', 'onehot'])
+def trained(request):
+    encoding = request.param
+    df = demand_frame(1000)
+    df_processed, ohe = preprocess(df, encoding=encoding)
+    X = df_processed.drop(columns=['value'])
+    model = XGBRegressor(n_estimators=20, max_depth=3, **ENCODING_PARAMS[encoding])
+    model.fit(X, df_processed['value'])
+
+    schema = X.columns.tolist()
+    recent_prepared = prepare_for_inference(
+        df=df.iloc[[-1]].reset_index(drop=True),
+        last_day_rolling_vals=df_processed[['rolling_mean', 'rolling_std']].iloc[-1].to_numpy(),
+        ohe=ohe,
+        schema=schema,
+        encoding=encoding
+    )
+    kwargs = {
+        'ohe': ohe,
+        'schema': schema,
+        'recent_prepared': recent_prepared,
+        'recent_values': {
+            'period': df['period'].iloc[-1].strftime('%Y-%m-%d'),
+            'window': df_processed['value'].to_numpy()[-WINDOW_SIZE:].tolist(),
+        },
+        'encoding': encoding,
+    }
+    return model, kwargs
+
+
+def test_bundle_predicts_like_the_model(trained, tmp_path):
+    model, kwargs = trained
+    manifest = run_artifacts.save_artifacts(str(tmp_path), model=model, **kwargs)
+    assert set(manifest['files']) == {run_artifacts.RECENT, run_artifacts.MODEL}
+
+    bundle = lean_app.load_bundle(str(tmp_path))
+    expected = model.predict(kwargs['recent_prepared'][kwargs['schema']])
+    np.testing.assert_allclose(
+        lean_app.predict(bundle, bundle['recent']), expected, rtol=1e-6
+    )
+    # Same rows as the scorer builds from the prepared frame.
+    scorer = BoosterScorer.from_model(model, kwargs['schema'])
+    np.testing.assert_array_equal(
+        bundle['recent'], scorer.rows(kwargs['recent_prepared'])
+    )
+
+
+def test_run_artifacts_are_not_a_bundle(trained, tmp_path):
+    model, kwargs = trained
+    run_artifacts.save_artifacts(str(tmp_path), **kwargs)
+    with pytest.raises(ValueError):
+        lean_app.load_bundle(str(tmp_path))
+
+
+def test_tampered_files_are_rejected(trained, tmp_path):
+    model, kwargs = trained
+    manifest = run_artifacts.save_artifacts(str(tmp_path), model=model, **kwargs)
+    run_artifacts.verify_files(str(tmp_path), manifest)
+
+    with open(tmp_path / run_artifacts.MODEL, 'ab') as f_out:
+        f_out.write(b'\0')
+    with pytest.raises(ValueError):
+        run_artifacts.verify_files(str(tmp_path), manifest)
+
+    edited = dict(manifest, schema=manifest['schema'][::-1])
+    with open(tmp_path / run_artifacts.MANIFEST, 'w') as f_out:
+        json.dump(edited, f_out)
+    with pytest.raises(ValueError):
+        run_artifacts.read_manifest(str(tmp_path))
+
+
+def test_feature_types_must_match_the_model(trained, tmp_path):
+    model, kwargs = trained
+    manifest = run_artifacts.save_artifacts(str(tmp_path), model=model, **kwargs)
+    scorer = BoosterScorer.from_model(model, kwargs['schema'])
+    scorer.check_types(manifest['feature_types'])
+    with pytest.raises(ValueError):
+        scorer.check_types(['float' if t == 'c' else 'c' for t in manifest['feature_types']])
+
+
+class FakeS3(object):
+    """Bucket kept in a dict, with the calls lean_app makes."""
+
+    def __init__(self):
+        self.objects = {}
+        self.heads = 0
+
+    def put_dir(self, bucket, prefix, path):
+        for name in os.listdir(path):
+            with open(os.path.join(path, name), 'rb') as f_in:
+                body = f_in.read()
+            self.objects[(bucket, f"{prefix}/{name}")] = body
+
+    def etag(self, bucket, key):
+        return f'"{hashlib.md5(self.objects[(bucket, key)]).hexdigest()}"'
+
+    def head_object(self, Bucket, Key):
+        self.heads += 1
+        return {'ETag': self.etag(Bucket, Key)}
+
+    def get_object(self, Bucket, Key):
+        body = self.objects[(Bucket, Key)]
+        return {'ETag': self.etag(Bucket, Key), 'Body': io.BytesIO(body)}
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, 'wb') as f_out:
+            f_out.write(self.objects[(Bucket, Key)])
+
+
+@pytest.fixture
+def retrained(trained):
+    model, kwargs = trained
+    other = XGBRegressor(**dict(model.get_params(), n_estimators=5))
+    X = kwargs['recent_prepared'][kwargs['schema']]
+    other.fit(X, [1000.0] * len(X))
+    return other
+
+
+def test_published_bundle_is_picked_up_after_the_interval(
+        trained, retrained, tmp_path, monkeypatch):
+    model, kwargs = trained
+    monkeypatch.setattr(lean_app, '_bundle', None)
+    monkeypatch.setenv('BUNDLE_URI', str(tmp_path))
+    run_artifacts.save_artifacts(str(tmp_path), model=model, **kwargs)
+    first = lean_app.lambda_handler({}, None)['prediction']
+
+    run_artifacts.save_artifacts(str(tmp_path), model=retrained, **kwargs)
+    monkeypatch.setattr(lean_app, 'CHECK_INTERVAL', 3600)
+    assert lean_app.lambda_handler({}, None)['prediction'] == first
+
+    monkeypatch.setattr(lean_app, 'CHECK_INTERVAL', 0)
+    second = lean_app.lambda_handler({}, None)['prediction']
+    assert second != first
+    expected = retrained.predict(kwargs['recent_prepared'][kwargs['schema']])
+    assert np.isclose(float(second), expected[0], rtol=1e-6)
+
+    # A broken publication keeps the cached bundle in service.
+    with open(tmp_path / run_artifacts.MANIFEST, 'w') as f_out:
+        f_out.write('{')
+    assert lean_app.lambda_handler({}, None)['prediction'] == second
+
+
+def test_s3_bundle_is_fetched_only_when_its_etag_changes(
+        trained, retrained, tmp_path, monkeypatch):
+    model, kwargs = trained
+    s3 = FakeS3()
+    published = tmp_path / 'published'
+    monkeypatch.setattr(lean_app, 's3_client', lambda: s3)
+    monkeypatch.setattr(lean_app, 'BUNDLE_DIR', str(tmp_path / 'local'))
+    monkeypatch.setattr(lean_app, 'CHECK_INTERVAL', 0)
+    monkeypatch.setattr(lean_app, '_bundle', None)
+    monkeypatch.setenv('BUNDLE_URI', 's3://bucket/bundles/model')
+
+    run_artifacts.save_artifacts(str(published), model=model, **kwargs)
+    s3.put_dir('bucket', 'bundles/model', str(published))
+    first = lean_app.get_bundle()
+    assert lean_app.get_bundle() is first
+    assert s3.heads == 1
+
+    run_artifacts.save_artifacts(str(published), model=retrained, **kwargs)
+    s3.put_dir('bucket', 'bundles/model', str(published))
+    second = lean_app.get_bundle()
+    assert second is not first
+    assert second['version'] != first['version']
+    # Only the bundle being served is kept locally.
+    assert os.listdir(tmp_path / 'local') == [os.path.basename(second['path'])]
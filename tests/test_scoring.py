@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import mlflow.pyfunc
+import mlflow.xgboost
+from xgboost import XGBRegressor
+
+from data_preprocessing import preprocess
+from scoring import BoosterScorer
+from synthetic import demand_frame
+
+ENCODING_PARAMS = {
+    'native': {'enable_categorical': True, 'tree_method': 'hist'},
+    'onehot': {},
+}
+
+
+@pytest.fixture(scope='module', params=['native', 'onehot'])
+def saved_model(request, tmp_path_factory):
+    """
+    Early stopped model saved in MLflow format as training logs it, with
+    its features.
+    """
+    df_processed, _ = preprocess(demand_frame(1500), encoding=request.param)
+    X = df_processed.drop(columns=['value'])
+    y = df_processed['value']
+    split = len(X) * 4 // 5
+    model = XGBRegressor(n_estimators=200, max_depth=4, early_stopping_rounds=10,
+                         **ENCODING_PARAMS[request.param])
+    model.fit(X.iloc[:split], y.iloc[:split],
+              eval_set=[(X.iloc[split:], y.iloc[split:])], verbose=False)
+    assert model.get_booster().attr('best_iteration') is not None
+
+    path = str(tmp_path_factory.mktemp(request.param) / 'model')
+    mlflow.xgboost.save_model(model, path)
+    return path, X
+
+
+@pytest.mark.parametrize('n_rows', [1, 500])
+def test_scorer_matches_pyfunc(saved_model, n_rows):
+    path, X = saved_model
+    frame = X.iloc[-n_rows:]
+    expected = np.asarray(mlflow.pyfunc.load_model(path).predict(frame))
+
+    scorer = BoosterScorer.from_model(mlflow.xgboost.load_model(path), X.columns.tolist())
+    scorer.check_frame(frame)
+    np.testing.assert_allclose(scorer.predict_frame(frame), expected, rtol=1e-6)
+    rows = scorer.rows(frame).copy()
+    np.testing.assert_allclose(scorer.predict(rows), expected, rtol=1e-6)
+
+
+def test_scorer_rejects_mismatched_features(saved_model):
+    path, X = saved_model
+    model = mlflow.xgboost.load_model(path)
+    with pytest.raises(ValueError):
+        BoosterScorer.from_model(model, X.columns.tolist()[::-1])
+    scorer = BoosterScorer.from_model(model, X.columns.tolist())
+    with pytest.raises(ValueError):
+        scorer.check_frame(X.drop(columns=X.columns[0]))
@@ -0,0 +1,95 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from omegaconf import OmegaConf
+
+from data_preprocessing import (
+    lag_schema,
+    iqr_bounds,
+    filter_by_iqr,
+    extract_features,
+    transform_to_supervised,
+)
+from streaming_stats import P2Quantile, PreprocessState
+from synthetic import demand_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+
+@pytest.mark.parametrize('seeded, tolerance', [(True, 0.01), (False, 0.05)])
+def test_sketch_bounds_match_iqr_bounds(seeded, tolerance):
+    # Outliers early in a trending series throw off a sketch streamed
+    # from scratch by 10-30%. The feature cache always seeds it from the
+    # exact quartiles of the history.
+    outliers = 0.005 if seeded else 0
+    values = demand_frame(3653, outliers=outliers)['value'].to_numpy()
+    exact = iqr_bounds(pd.Series(values))
+    seed = len(values) - 30 if seeded else 0
+
+    state = PreprocessState(exact)
+    state.q1 = P2Quantile.from_values(values[:seed], 0.25)
+    state.q3 = P2Quantile.from_values(values[:seed], 0.75)
+    for x in values[seed:]:
+        state.q1.add(x)
+        state.q3.add(x)
+
+    for streamed, expected in zip(state.sketch_bounds(), exact):
+        assert streamed == pytest.approx(expected, rel=tolerance)
+    if seeded:
+        # The feature cache would keep extending these features.
+        config = OmegaConf.load(CONFIG_PATH)
+        assert state.bounds_drift() < config.features.BOUNDS_TOLERANCE
+
+
+@pytest.mark.parametrize('hourly, n_rows, new_rows', [
+    (False, 3653, 30),
+    (True, 24 * 400, 72),
+])
+def test_streamed_rows_match_the_batch_functions(hourly, n_rows, new_rows):
+    config = OmegaConf.load(CONFIG_PATH)
+    params = config.features['hourly' if hourly else 'daily']
+    window_size, lags = params.WINDOW_SIZE, tuple(params.LAGS)
+    rolling = tuple(tuple(pair) for pair in params.ROLLING)
+
+    # Metering outliers for the IQR filter to drop.
+    df = demand_frame(n_rows, hourly=hourly,
+                      timezones=None if hourly else ('Eastern',))
+    split = len(df) - new_rows
+    bounds = iqr_bounds(df['value'])
+    state = PreprocessState.from_history(
+        df.iloc[:split], bounds=bounds, window_size=window_size,
+        lags=lags, rolling=rolling, hourly=hourly
+    )
+
+    rows = []
+    for i in range(split, len(df)):
+        # Persisted and restored between days, as in the feature cache.
+        state = PreprocessState.from_dict(json.loads(json.dumps(state.to_dict())))
+        rows.append(state.process(df.iloc[[i]].reset_index(drop=True)))
+    streamed = pd.concat(rows, ignore_index=True)
+
+    df_newfeat = extract_features(
+        filter_by_iqr(df, bounds), window_size=window_size, hourly=hourly
+    )
+    is_new = (df_newfeat['period'] >= df['period'].iloc[split]).to_numpy()
+    expected = transform_to_supervised(
+        df_newfeat, lags=lags, rolling=rolling, unit='h' if hourly else None
+    )
+    expected = expected[is_new[expected.index]].reset_index(drop=True)
+
+    assert len(expected) > 0
+    assert list(streamed.columns) == list(expected.columns)
+    assert (streamed['timezone'].astype(str).to_numpy()
+            == expected['timezone'].astype(str).to_numpy()).all()
+    features = [c for c in expected.columns if c not in ('period', 'timezone')]
+    for column in features:
+        # Rolling statistics are float32 on both sides.
+        np.testing.assert_allclose(
+            streamed[column].to_numpy(dtype='float64'),
+            expected[column].to_numpy(dtype='float64'),
+            rtol=1e-6, err_msg=column
+        )
+    assert set(lag_schema(lags, rolling)) <= set(features)
@@ -0,0 +1,96 @@
+import os
+from collections import Counter
+
+import pytest
+import mlflow
+from mlflow import MlflowClient
+from mlflow.store.tracking.file_store import FileStore
+from mlflow.store.artifact.local_artifact_repo import LocalArtifactRepository
+from omegaconf import OmegaConf
+from xgboost import XGBRegressor
+
+import train
+import tracking
+from data_preprocessing import preprocess
+from synthetic import demand_frame
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'conf', 'config.yaml')
+
+
+@pytest.fixture
+def calls(monkeypatch, tmp_path):
+    """
+    Calls reaching a local file store and its artifact repository.
+    """
+    uri = 'file://' + str(tmp_path / 'mlruns')
+    monkeypatch.setenv('MLFLOW_TRACKING_URI', uri)
+    monkeypatch.setenv('MLFLOW_ALLOW_FILE_STORE', 'true')
+    mlflow.set_tracking_uri(uri)
+
+    counter = Counter()
+    for cls, names in ((FileStore, ('log_metric', 'log_param', 'log_batch')),
+                       (LocalArtifactRepository, ('log_artifact', 'log_artifacts'))):
+        for name in names:
+            method = getattr(cls, name)
+
+            def wrapper(self, *args, _method=method, _name=name, **kwargs):
+                counter[_name] += 1
+                return _method(self, *args, **kwargs)
+            monkeypatch.setattr(cls, name, wrapper)
+    yield counter
+    mlflow.set_tracking_uri(None)
+
+
+@pytest.fixture
+def config(calls):
+    config = OmegaConf.load(CONFIG_PATH)
+    config.training.N_SPLITS = 3
+    # Created without the S3 artifact location, setup_tracking reuses it.
+    mlflow.set_experiment(config.mlflow.experiment_name)
+    return config
+
+
+@pytest.mark.parametrize('async_uploads', [True, False])
+def test_run_logger_sends_full_batches(calls, config, async_uploads, tmp_path):
+    (tmp_path / 'artifacts').mkdir()
+    (tmp_path / 'artifacts' / 'manifest.json').write_text('{}')
+
+    with mlflow.start_run() as run:
+        run_logger = tracking.RunLogger(run.info.run_id, async_uploads=async_uploads)
+        run_logger.log_params({f"p{i}": i for i in range(150)})
+        for step in range(1500):
+            run_logger.log_metric('mae', step, step=step)
+        run_logger.log_artifacts(str(tmp_path / 'artifacts'))
+        run_logger.close()
+        # Nothing is left to send.
+        run_logger.flush()
+
+    # 150 params and 1500 metrics at 100 params and 1000 metrics per batch.
+    assert calls == {'log_batch': 4, 'log_artifacts': 1}
+    client = MlflowClient()
+    assert len(client.get_run(run.info.run_id).data.params) == 150
+    assert len(client.get_metric_history(run.info.run_id, 'mae')) == 1500
+    assert [f.path for f in client.list_artifacts(run.info.run_id)] == ['manifest.json']
+
+
+def test_tracked_training_batches_logging_and_uploads_once(calls, config, tmp_path):
+    (tmp_path / 'artifacts').mkdir()
+    (tmp_path / 'artifacts' / 'manifest.json').write_text('{}')
+    df_processed, _ = preprocess(
+        demand_frame(500), encoding=config.training.ENCODING
+    )
+    X = df_processed.drop(columns=['value'])
+    model = XGBRegressor(n_estimators=20, early_stopping_rounds=5,
+                         **train.model_params(config))
+
+    train.train(config, model, X, df_processed.value, 3, track=True,
+                artifacts_path=str(tmp_path / 'artifacts'), tags={'subba': 'ZONJ'})
+
+    # One batch of params, one of the fold metrics, the artifacts and the
+    # model uploaded once each.
+    assert calls == {'log_batch': 2, 'log_artifacts': 2}
+    client = MlflowClient()
+    run_id = mlflow.last_active_run().info.run_id
+    history = client.get_metric_history(run_id, 'mae_test')
+    assert sorted(m.step for m in history) == [0, 1, 2]
+    assert {f.path for f in client.list_artifacts(run_id)} == {'manifest.json', 'xgb_best'}
@@ -0,0 +1,87 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import mlflow.xgboost
+from xgboost import XGBRegressor
+
+# warm_start names models through register_model, whose flows need prefect.
+pytest.importorskip('prefect')
+from warm_start import parse_param, base_params, continue_model, base_booster
+
+
+def make_run(run_id, params=None, tags=None):
+    return SimpleNamespace(
+        info=SimpleNamespace(run_id=run_id),
+        data=SimpleNamespace(params=params or {}, tags=tags or {}),
+    )
+
+
+class FakeClient(object):
+    def __init__(self, *runs):
+        self.runs = {run.info.run_id: run for run in runs}
+
+    def get_run(self, run_id):
+        return self.runs[run_id]
+
+
+def train_params(booster):
+    """
+    Values of eta and max_depth in every training section of the
+    booster's config.
+    """
+    found = {'eta': set(), 'max_depth': set()}
+
+    def walk(section):
+        for key, value in section.items():
+            if isinstance(value, dict):
+                walk(value)
+            elif key in found:
+                found[key].add(round(float(value), 6))
+    walk(json.loads(booster.save_config()))
+    return found
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('True', True), ('False', False), ('7', 7), ('0.01', 0.01),
+    ('1e-05', 1e-05), ('hist', 'hist'), ('reg:squarederror', 'reg:squarederror'),
+])
+def test_parse_param(value, expected):
+    assert parse_param(value) == expected
+
+
+def test_base_params_follow_the_full_run():
+    full = make_run('full', params={'learning_rate': '0.01', 'max_depth': '2',
+                                    'subsample': 'None'},
+                    tags={'retrain': 'full'})
+    older = make_run('older', tags={'retrain': 'incremental', 'base_run_id': 'full'})
+    newer = make_run('newer', tags={'retrain': 'incremental', 'full_run_id': 'full'})
+    client = FakeClient(full, older)
+
+    for run in (full, older, newer):
+        params, run_id = base_params(client, run)
+        assert params == {'learning_rate': 0.01, 'max_depth': 2}
+        assert run_id == 'full'
+
+
+def test_continued_booster_keeps_the_base_params(tmp_path):
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.random((500, 3)), columns=['a', 'b', 'c'])
+    y = pd.Series(100 * X['a'] + rng.normal(size=500))
+
+    model = XGBRegressor(n_estimators=30, learning_rate=0.01, max_depth=2,
+                         subsample=0.8, reg_lambda=3.0)
+    model.fit(X.iloc[:400], y.iloc[:400])
+    logged = {key: str(value) for key, value in model.get_params().items()}
+    mlflow.xgboost.save_model(model, str(tmp_path / 'model'))
+    loaded = mlflow.xgboost.load_model(str(tmp_path / 'model'))
+
+    params, _ = base_params(FakeClient(), make_run('full', params=logged))
+    new_model = continue_model(base_booster(loaded), params,
+                               X.iloc[300:], y.iloc[300:], n_rounds=10)
+
+    booster = new_model.get_booster()
+    assert booster.num_boosted_rounds() == 40
+    assert train_params(booster) == {'eta': {0.01}, 'max_depth': {2.0}}